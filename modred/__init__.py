@@ -39,22 +39,30 @@ from .ltigalerkinproj import (
     compute_derivs_handles, compute_derivs_matrices, standard_basis
 )
 
-from .vectorspace import VectorSpaceHandles, VectorSpaceMatrices
+from .vectorspace import (
+    VectorSpaceHandles, VectorSpaceMatrices, DistributedMatrix, ModeHandle,
+    ModeCache, make_mode_handles)
 
 from .vectors import (
     VecHandlePickle, VecHandleInMemory,
-    Vector, VecHandle, VecHandleArrayText,
-    InnerProductTrapz, inner_product_array_uniform
+    Vector, VecHandle, VecHandleArrayText, VecHandleNpy,
+    InnerProductTrapz, inner_product_array_uniform,
+    inner_product_block_array_uniform
 )
 
+from .tracing import Tracer
+
+from .gramcache import GramCache
+
 from . import parallel
 
 from .util import (
     UndefinedError, make_mat, make_iterable, flatten_list, save_array_text,
-    load_array_text, get_file_list, get_data_members, sum_arrays, sum_lists,
-    smart_eq, InnerProductBlock, svd, eigh, eig_biorthog,
-    solve_Lyapunov_iterative, solve_Lyapunov_direct, balanced_truncation, drss,
-    rss, lsim, impulse, load_multiple_signals, load_signals, Hankel
+    load_array_text, save_array_binary, load_array_binary, get_file_list,
+    get_data_members, sum_arrays, sum_lists, smart_eq, InnerProductBlock, svd,
+    eigh, eig_biorthog, solve_Lyapunov_iterative, solve_Lyapunov_direct,
+    balanced_truncation, drss, rss, lsim, impulse, load_multiple_signals,
+    load_signals, Hankel
 )
 
 from modred import tests
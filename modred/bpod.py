@@ -3,7 +3,8 @@ from future.builtins import object
 
 import numpy as np
 
-from .vectorspace import VectorSpaceMatrices, VectorSpaceHandles
+from .vectorspace import (
+    VectorSpaceMatrices, VectorSpaceHandles, make_mode_handles)
 from . import util
 from . import parallel
 
@@ -99,16 +100,28 @@ class BPODHandles(object):
 
     Kwargs:
         ``put_mat``: Function to put a matrix out of modred, e.g., write it to
-        file.
+        file.  Default is :py:func:`util.save_array_text`;
+        :py:func:`util.save_array_binary` is much faster for large matrices.
 
       	``get_mat``: Function to get a matrix into modred, e.g., load it from
-        file.
+        file.  Default is :py:func:`util.load_array_text`; use
+        :py:func:`util.load_array_binary` for matrices put with
+        :py:func:`util.save_array_binary`.
 
         ``max_vecs_per_node``: Maximum number of vectors that can be stored in
         memory, per node.
 
         ``verbosity``: 1 prints progress and warnings, 0 prints almost nothing.
 
+        ``inner_product_block``: Function that computes the matrix of inner
+        products of two lists of vector objects.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
+        ``max_bytes_per_node``: Maximum number of bytes of vectors that can be
+        stored in memory, per node, or ``'auto'``.  If given, it is used
+        instead of ``max_vecs_per_node``.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
     Computes direct and adjoint BPOD modes from direct and adjoint vector
     objects (or handles).  Uses :py:class:`vectorspace.VectorSpaceHandles` for
     low level functions.
@@ -124,7 +137,8 @@ class BPODHandles(object):
     """
     def __init__(
         self, inner_product, put_mat=util.save_array_text,
-        get_mat=util.load_array_text,max_vecs_per_node=None, verbosity=1):
+        get_mat=util.load_array_text,max_vecs_per_node=None, verbosity=1,
+        inner_product_block=None, max_bytes_per_node=None):
         """Constructor """
         self.get_mat = get_mat
         self.put_mat = put_mat
@@ -136,7 +150,8 @@ class BPODHandles(object):
         # Class that contains all of the low-level vec operations
         self.vec_space = VectorSpaceHandles(
             inner_product=inner_product, max_vecs_per_node=max_vecs_per_node,
-            verbosity=verbosity)
+            verbosity=verbosity, inner_product_block=inner_product_block,
+            max_bytes_per_node=max_bytes_per_node)
         self.direct_vec_handles = None
         self.adjoint_vec_handles = None
 
@@ -260,7 +275,8 @@ class BPODHandles(object):
 
 
     def compute_decomp(
-        self, direct_vec_handles, adjoint_vec_handles, atol=1e-13, rtol=None):
+        self, direct_vec_handles, adjoint_vec_handles, atol=1e-13, rtol=None,
+        assembly='allreduce'):
         """Computes Hankel matrix :math:`H=Y^*X` and its singular value
         decomposition :math:`UEV^*=H`.
 
@@ -277,6 +293,13 @@ class BPODHandles(object):
             ``rtol``: Maximum relative difference between largest and smallest
             Hankel singular values.  Smaller ones are truncated.
 
+            ``assembly``: How the inner product matrix is assembled.  With
+            ``'allreduce'`` (default), every processor/MPI worker gets the
+            full Hankel matrix.  With ``'rank_zero'``, only rank zero does, and
+            the others store None, which avoids summing full matrices over all
+            processors/MPI workers.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.compute_inner_product_mat`.
+
         Returns:
             ``sing_vals``: 1D array of Hankel singular values (:math:`E`).
 
@@ -286,16 +309,21 @@ class BPODHandles(object):
             ``R_sing_vecs``: Matrix of right singular vectors of Hankel matrix
             (:math:`V`).
         """
+        if assembly not in ['allreduce', 'rank_zero']:
+            raise ValueError('Invalid assembly "%s", must be "allreduce" or '
+                '"rank_zero"'%assembly)
         self.direct_vec_handles = direct_vec_handles
         self.adjoint_vec_handles = adjoint_vec_handles
         self.Hankel_mat = self.vec_space.compute_inner_product_mat(
-            self.adjoint_vec_handles, self.direct_vec_handles)
+            self.adjoint_vec_handles, self.direct_vec_handles,
+            assembly=assembly)
         self.compute_SVD(atol=atol, rtol=rtol)
         return self.sing_vals, self.L_sing_vecs, self.R_sing_vecs
 
 
     def compute_direct_modes(
-        self, mode_indices, mode_handles, direct_vec_handles=None):
+        self, mode_indices, mode_handles, direct_vec_handles=None,
+        resume=False):
         """Computes direct BPOD modes and calls ``put`` on them using mode
         handles.
 
@@ -308,23 +336,25 @@ class BPODHandles(object):
         Kwargs:
             ``direct_vec_handles``: List of handles for direct vector objects.
             Optional if given when calling :py:meth:`compute_decomp`.
+
+            ``resume``: If True, modes that were already put, e.g., by a run
+            that was killed, are not computed again.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.lin_combine`.
         """
         if direct_vec_handles is not None:
             self.direct_vec_handles = util.make_iterable(direct_vec_handles)
         if self.direct_vec_handles is None:
             raise util.UndefinedError('direct_vec_handles undefined')
 
-        self.sing_vals = np.squeeze(np.array(self.sing_vals))
-        build_coeff_mat = np.dot(
-            self.R_sing_vecs, np.diag(self.sing_vals ** -0.5))
-
         self.vec_space.lin_combine(
-            mode_handles, self.direct_vec_handles, build_coeff_mat,
-            coeff_mat_col_indices=mode_indices)
+            mode_handles, self.direct_vec_handles,
+            self._compute_build_coeffs_direct(),
+            coeff_mat_col_indices=mode_indices, resume=resume)
 
 
     def compute_adjoint_modes(
-        self, mode_indices, mode_handles, adjoint_vec_handles=None):
+        self, mode_indices, mode_handles, adjoint_vec_handles=None,
+        resume=False):
         """Computes adjoint BPOD modes and calls ``put`` on them using mode
         handles.
 
@@ -337,19 +367,145 @@ class BPODHandles(object):
         Kwargs:
             ``adjoint_vec_handles``: List of handles for adjoint vector objects.
             Optional if given when calling :py:meth:`compute_decomp`.
+
+            ``resume``: If True, modes that were already put, e.g., by a run
+            that was killed, are not computed again.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.lin_combine`.
+        """
+        if adjoint_vec_handles is not None:
+            self.adjoint_vec_handles = util.make_iterable(adjoint_vec_handles)
+        if self.adjoint_vec_handles is None:
+            raise util.UndefinedError('adjoint_vec_handles undefined')
+
+        self.vec_space.lin_combine(
+            mode_handles, self.adjoint_vec_handles,
+            self._compute_build_coeffs_adjoint(),
+            coeff_mat_col_indices=mode_indices, resume=resume)
+
+
+    def compute_direct_and_adjoint_modes(
+        self, mode_indices, direct_mode_handles, adjoint_mode_handles,
+        direct_vec_handles=None, adjoint_vec_handles=None, resume=False):
+        """Computes direct and adjoint BPOD modes and calls ``put`` on them
+        using mode handles, in one pass over the vector objects.
+
+        Args:
+            ``mode_indices``: List of indices describing which modes to
+            compute, e.g. ``range(10)`` or ``[3, 0, 5]``.
+
+            ``direct_mode_handles``: List of handles for direct modes to
+            compute.
+
+            ``adjoint_mode_handles``: List of handles for adjoint modes to
+            compute.
+
+        Kwargs:
+            ``direct_vec_handles``: List of handles for direct vector objects.
+            Optional if given when calling :py:meth:`compute_decomp`.
+
+            ``adjoint_vec_handles``: List of handles for adjoint vector objects.
+            Optional if given when calling :py:meth:`compute_decomp`.
+
+            ``resume``: If True, modes that were already put, e.g., by a run
+            that was killed, are not computed again.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.lin_combine`.
+
+        This gives the same modes as :py:meth:`compute_direct_modes` and
+        :py:meth:`compute_adjoint_modes`, but with one call to
+        :py:meth:`vectorspace.VectorSpaceHandles.lin_combine_multiple`, so
+        that the sums of both are computed while the direct and adjoint vector
+        objects are retrieved.
+        """
+        if direct_vec_handles is not None:
+            self.direct_vec_handles = util.make_iterable(direct_vec_handles)
+        if self.direct_vec_handles is None:
+            raise util.UndefinedError('direct_vec_handles undefined')
+        if adjoint_vec_handles is not None:
+            self.adjoint_vec_handles = util.make_iterable(adjoint_vec_handles)
+        if self.adjoint_vec_handles is None:
+            raise util.UndefinedError('adjoint_vec_handles undefined')
+
+        self.vec_space.lin_combine_multiple(
+            [direct_mode_handles, adjoint_mode_handles],
+            [self.direct_vec_handles, self.adjoint_vec_handles],
+            [self._compute_build_coeffs_direct(),
+            self._compute_build_coeffs_adjoint()],
+            coeff_mat_col_indices_list=[mode_indices, mode_indices],
+            resume=resume)
+
+
+    def make_direct_mode_handles(self, mode_indices, direct_vec_handles=None,
+        mode_cache=None):
+        """Returns handles for direct BPOD modes that are only computed when
+        they are retrieved, instead of computing and putting the modes.
+
+        Args:
+            ``mode_indices``: List of indices describing which direct modes to
+            make handles for, e.g. ``range(10)`` or ``[3, 0, 5]``.
+
+        Kwargs:
+            ``direct_vec_handles``: List of handles for direct vector objects.
+            Optional if given when calling :py:meth:`compute_decomp`.
+
+            ``mode_cache``: :py:class:`vectorspace.ModeCache` in which modes
+            are kept once they are computed.  Default is None, for which the
+            cache shared by default is used (see
+            :py:func:`vectorspace.make_mode_handles`).
+
+        Returns:
+            ``mode_handles``: List of :py:class:`vectorspace.ModeHandle`
+            objects (see :py:func:`vectorspace.make_mode_handles`).
+        """
+        if direct_vec_handles is not None:
+            self.direct_vec_handles = util.make_iterable(direct_vec_handles)
+        if self.direct_vec_handles is None:
+            raise util.UndefinedError('direct_vec_handles undefined')
+        return make_mode_handles(self.direct_vec_handles,
+            self._compute_build_coeffs_direct(),
+            coeff_mat_col_indices=mode_indices, mode_cache=mode_cache)
+
+
+    def make_adjoint_mode_handles(self, mode_indices, adjoint_vec_handles=None,
+        mode_cache=None):
+        """Returns handles for adjoint BPOD modes that are only computed when
+        they are retrieved, instead of computing and putting the modes.
+
+        Args:
+            ``mode_indices``: List of indices describing which adjoint modes to
+            make handles for, e.g. ``range(10)`` or ``[3, 0, 5]``.
+
+        Kwargs:
+            ``adjoint_vec_handles``: List of handles for adjoint vector objects.
+            Optional if given when calling :py:meth:`compute_decomp`.
+
+            ``mode_cache``: :py:class:`vectorspace.ModeCache` in which modes
+            are kept once they are computed.  Default is None, for which the
+            cache shared by default is used (see
+            :py:func:`vectorspace.make_mode_handles`).
+
+        Returns:
+            ``mode_handles``: List of :py:class:`vectorspace.ModeHandle`
+            objects (see :py:func:`vectorspace.make_mode_handles`).
         """
         if adjoint_vec_handles is not None:
             self.adjoint_vec_handles = util.make_iterable(adjoint_vec_handles)
         if self.adjoint_vec_handles is None:
             raise util.UndefinedError('adjoint_vec_handles undefined')
+        return make_mode_handles(self.adjoint_vec_handles,
+            self._compute_build_coeffs_adjoint(),
+            coeff_mat_col_indices=mode_indices, mode_cache=mode_cache)
 
+
+    def _compute_build_coeffs_direct(self):
+        """Compute build coefficients for direct BPOD modes."""
         self.sing_vals = np.squeeze(np.array(self.sing_vals))
-        build_coeff_mat = np.dot(
-            self.L_sing_vecs, np.diag(self.sing_vals ** -0.5))
+        return np.dot(self.R_sing_vecs, np.diag(self.sing_vals ** -0.5))
 
-        self.vec_space.lin_combine(
-            mode_handles, self.adjoint_vec_handles, build_coeff_mat,
-            coeff_mat_col_indices=mode_indices)
+
+    def _compute_build_coeffs_adjoint(self):
+        """Compute build coefficients for adjoint BPOD modes."""
+        self.sing_vals = np.squeeze(np.array(self.sing_vals))
+        return np.dot(self.L_sing_vecs, np.diag(self.sing_vals ** -0.5))
 
 
     def compute_proj_coeffs(self):
@@ -380,3 +536,56 @@ class BPODHandles(object):
         self.adjoint_proj_coeffs = (
             np.mat(np.diag(self.sing_vals ** 0.5)) * self.L_sing_vecs.H)
         return self.adjoint_proj_coeffs
+
+
+    def compute_proj_coeffs_of(self, new_direct_vec_handles):
+        """Computes biorthogonal projection of new direct vector objects onto
+        direct BPOD modes, using adjoint BPOD modes, without computing the
+        modes.
+
+        Args:
+            ``new_direct_vec_handles``: List of handles for new direct vector
+            objects.
+
+        Returns:
+            ``proj_coeffs``: Matrix of projection coefficients for new direct
+            vector objects, expressed as a linear combination of direct BPOD
+            modes.  Columns correspond to new direct vector objects, rows
+            correspond to direct BPOD modes.
+
+        The adjoint modes are linear combinations of the adjoint vector
+        objects, so the coefficients are found from the inner products of the
+        adjoint vector objects with the new direct vector objects.  The modes
+        are never computed or retrieved.
+        """
+        if self.adjoint_vec_handles is None:
+            raise util.UndefinedError('adjoint_vec_handles undefined')
+        new_direct_vec_handles = util.make_iterable(new_direct_vec_handles)
+        IP_mat = self.vec_space.compute_inner_product_mat(
+            self.adjoint_vec_handles, new_direct_vec_handles)
+        return np.mat(self._compute_build_coeffs_adjoint()).H * np.mat(IP_mat)
+
+
+    def compute_adjoint_proj_coeffs_of(self, new_adjoint_vec_handles):
+        """Computes biorthogonal projection of new adjoint vector objects
+        onto adjoint BPOD modes, using direct BPOD modes, without computing
+        the modes.
+
+        Args:
+            ``new_adjoint_vec_handles``: List of handles for new adjoint vector
+            objects.
+
+        Returns:
+            ``adjoint_proj_coeffs``: Matrix of projection coefficients for new
+            adjoint vector objects, expressed as a linear combination of
+            adjoint BPOD modes.  Columns correspond to new adjoint vector
+            objects, rows correspond to adjoint BPOD modes.
+
+        See :py:meth:`compute_proj_coeffs_of`.
+        """
+        if self.direct_vec_handles is None:
+            raise util.UndefinedError('direct_vec_handles undefined')
+        new_adjoint_vec_handles = util.make_iterable(new_adjoint_vec_handles)
+        IP_mat = self.vec_space.compute_inner_product_mat(
+            self.direct_vec_handles, new_adjoint_vec_handles)
+        return np.mat(self._compute_build_coeffs_direct()).H * np.mat(IP_mat)
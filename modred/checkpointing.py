@@ -0,0 +1,282 @@
+"""Checkpoints of inner product matrices.
+
+An :py:class:`IPMatCheckpoint` saves the blocks of an inner product matrix
+computed by :py:class:`vectorspace.VectorSpaceHandles` (see its
+``checkpoint_dir``) as they are computed, so a run that is killed, e.g., at
+the end of a batch job, restarts without computing them again.
+"""
+from __future__ import division
+from __future__ import absolute_import
+from future.builtins import range
+from future.builtins import object
+import os
+import hashlib
+import json
+from time import time
+
+import numpy as np
+
+from . import util
+from . import parallel
+
+
+class IPMatCheckpoint(object):
+    """Saves the blocks of a :py:class:`vectorspace.DistributedMatrix`
+    computed by this processor/MPI worker, and restores blocks saved by a
+    previous run.
+
+    Args:
+        ``checkpoint_dir``: Directory holding the checkpoint files.
+
+        ``name``: Name of the matrix, used as the prefix of its files.
+
+        ``IP_mat``: The :py:class:`vectorspace.DistributedMatrix` being
+        computed.
+
+        ``interval``: Minimum time (in seconds) between saves.
+
+        ``vec_keys``: Keys of the row and col vecs (see
+        :py:func:`vectors.find_vec_handle_keys`), or None.
+
+    Each save writes only the blocks computed since the previous one, to a
+    new ``.npz`` file, then lists it in the manifest of this processor/MPI
+    worker, a ``.json`` file.  Both are written under temporary names and
+    renamed, so a run that is killed while saving keeps the previous
+    checkpoint.  Files are named by the number of processors/MPI workers and
+    the rank, so runs with different numbers of processors/MPI workers do not
+    overwrite each other's files.
+
+    The blocks listed in the manifests of every previous run are loaded, and
+    a tile is restored if all of its elements are in them, whatever the
+    positions and shapes of the tiles of the previous runs.  The matrix was
+    finished if every processor/MPI worker of a previous run saved its final
+    blocks.  A fingerprint of the keys of the vecs is saved too, and a
+    checkpoint saved for other vecs, e.g., by a run that computed other
+    matrices in another order, is rejected.  Vecs without keys, e.g., in
+    memory, are only checked by their number.
+    """
+    def __init__(self, checkpoint_dir, name, IP_mat, interval, vec_keys):
+        self.checkpoint_dir = checkpoint_dir
+        self.vec_keys_fingerprint = hashlib.sha1(
+            repr(vec_keys).encode('utf-8')).hexdigest()
+        self.interval = interval
+        self.is_symmetric = IP_mat.is_symmetric
+        self.prefix = '%s_np%05d_rank%05d'%(
+            name, parallel.get_num_procs(), parallel.get_rank())
+        self.prev_save_time = time()
+        if parallel.is_rank_zero() and not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        parallel.barrier()
+
+        # Blocks from previous runs, as a list of (row_start, col_start,
+        # block), with arrays of their bounds to find the ones in a tile.
+        self.saved_blocks = []
+        self.file_names = []
+        num_complete_files = {}
+        for manifest_name in util.get_file_list(
+            checkpoint_dir, file_extension='.json'):
+            if not manifest_name.startswith(name + '_np'):
+                continue
+            with open(os.path.join(checkpoint_dir, manifest_name)) as \
+                manifest_file:
+                manifest = json.load(manifest_file)
+            if (tuple(manifest['shape']) != IP_mat.shape or
+                manifest['is_symmetric'] != IP_mat.is_symmetric):
+                raise ValueError('Checkpoint %s does not match the inner '
+                    'product matrix being computed'%manifest_name)
+            if manifest['vec_keys_fingerprint'] != self.vec_keys_fingerprint:
+                raise ValueError('Checkpoint %s was saved for other vecs '
+                    'than those of the inner product matrix being computed'%
+                    manifest_name)
+            for file_name in manifest['file_names']:
+                with np.load(os.path.join(checkpoint_dir, file_name)) as saved:
+                    for block_index, (row_start, col_start) in enumerate(
+                        saved['positions']):
+                        self.saved_blocks.append((int(row_start),
+                            int(col_start), saved['block_%d'%block_index]))
+            if manifest_name == self.prefix + '.json':
+                self.file_names = manifest['file_names']
+            num_procs = manifest['num_procs']
+            num_complete_files[num_procs] = num_complete_files.get(
+                num_procs, 0) + int(manifest['is_complete'])
+        self.is_complete = any(num_complete == num_procs
+            for num_procs, num_complete in num_complete_files.items())
+        self.block_row_starts = np.array(
+            [block[0] for block in self.saved_blocks], dtype=int)
+        self.block_col_starts = np.array(
+            [block[1] for block in self.saved_blocks], dtype=int)
+        self.block_row_ends = self.block_row_starts + np.array(
+            [block[2].shape[0] for block in self.saved_blocks], dtype=int)
+        self.block_col_ends = self.block_col_starts + np.array(
+            [block[2].shape[1] for block in self.saved_blocks], dtype=int)
+
+        # Blocks of IP_mat that were restored, so are not saved again, and
+        # the number of blocks already saved.
+        self.restored_block_indices = set()
+        self.num_blocks_saved = 0
+
+        # Don't overwrite any files until every processor/MPI worker has
+        # loaded them.
+        parallel.barrier()
+
+
+    def _find_tile(self, row_start, col_start, num_rows, num_cols):
+        """Returns the saved elements of the tile at ``(row_start,
+        col_start)`` with shape ``(num_rows, num_cols)``, and a boolean array
+        of which were saved.  For a symmetric matrix, elements saved on the
+        other side of the diagonal are used too."""
+        tile = np.zeros((num_rows, num_cols))
+        is_found = np.zeros(tile.shape, dtype=bool)
+        if self.is_symmetric:
+            orientations = [False, True]
+        else:
+            orientations = [False]
+        for is_mirrored in orientations:
+            if is_mirrored:
+                rows = (col_start, col_start + num_cols)
+                cols = (row_start, row_start + num_rows)
+            else:
+                rows = (row_start, row_start + num_rows)
+                cols = (col_start, col_start + num_cols)
+            block_indices = np.nonzero(
+                (self.block_row_starts < rows[1]) &
+                (self.block_row_ends > rows[0]) &
+                (self.block_col_starts < cols[1]) &
+                (self.block_col_ends > cols[0]))[0]
+            for block_index in block_indices:
+                block_row_start, block_col_start, block = self.saved_blocks[
+                    block_index]
+                start_row = max(rows[0], block_row_start)
+                end_row = min(rows[1], self.block_row_ends[block_index])
+                start_col = max(cols[0], block_col_start)
+                end_col = min(cols[1], self.block_col_ends[block_index])
+                values = block[start_row - block_row_start:
+                    end_row - block_row_start, start_col - block_col_start:
+                    end_col - block_col_start]
+                # Only the elements on and above the diagonal of blocks on
+                # the diagonal of a symmetric matrix were computed.
+                if self.is_symmetric and block_row_start == block_col_start:
+                    is_valid = (np.arange(start_row, end_row)[:, np.newaxis]
+                        <= np.arange(start_col, end_col)[np.newaxis, :])
+                else:
+                    is_valid = np.ones(values.shape, dtype=bool)
+                if is_mirrored:
+                    values = values.conj().T
+                    is_valid = is_valid.T
+                    start_row, end_row, start_col, end_col = (
+                        start_col, end_col, start_row, end_row)
+                tile = tile.astype(np.result_type(tile, values), copy=False)
+                tile_slice = (
+                    slice(start_row - row_start, end_row - row_start),
+                    slice(start_col - col_start, end_col - col_start))
+                tile[tile_slice][is_valid] = values[is_valid]
+                is_found[tile_slice] |= is_valid
+        return tile, is_found
+
+
+    def has_saved_blocks(self):
+        """Returns True if a previous run saved any blocks."""
+        return len(self.saved_blocks) > 0
+
+
+    def restore(self, IP_mat, row_start, col_start, num_rows, num_cols,
+        transpose=False):
+        """Adds the tile at ``(row_start, col_start)`` with shape
+        ``(num_rows, num_cols)`` to ``IP_mat``, as
+        :py:meth:`vectorspace.DistributedMatrix.add_block`, if all of its
+        elements were saved.  Only the upper-triangular part of tiles on the
+        diagonal of a symmetric matrix is needed.  Returns True if it was, and
+        False otherwise."""
+        if len(self.saved_blocks) == 0:
+            return False
+        if transpose:
+            row_start, col_start = col_start, row_start
+            num_rows, num_cols = num_cols, num_rows
+        tile, is_found = self._find_tile(
+            row_start, col_start, num_rows, num_cols)
+        is_diagonal = self.is_symmetric and row_start == col_start
+        if is_diagonal:
+            is_found |= np.tril(np.ones(is_found.shape, dtype=bool), -1)
+        if not is_found.all():
+            return False
+        if is_diagonal:
+            tile = np.triu(tile)
+        IP_mat.add_block(row_start, col_start, tile)
+        self.restored_block_indices.add(len(IP_mat.blocks) - 1)
+        return True
+
+
+    def restore_all(self, IP_mat):
+        """Adds all of the saved elements to ``IP_mat``, dividing the rows
+        among processors/MPI workers, if a previous run finished the matrix.
+        Returns True if it did, and False otherwise.  Must be called by all
+        processors/MPI workers."""
+        if not self.is_complete:
+            return False
+        row_indices = parallel.find_assignments(
+            list(range(IP_mat.shape[0])))[parallel.get_rank()]
+        is_restored = True
+        if len(row_indices) > 0:
+            # For a symmetric matrix, only the cols on and above the
+            # diagonal are needed.
+            if self.is_symmetric:
+                col_start = row_indices[0]
+            else:
+                col_start = 0
+            is_restored = self.restore(IP_mat, row_indices[0], col_start,
+                len(row_indices), IP_mat.shape[1] - col_start)
+        return bool(parallel.allreduce_min(int(is_restored)))
+
+
+    def update(self, IP_mat):
+        """Saves the new blocks of ``IP_mat`` if ``interval`` seconds have
+        passed since the last save."""
+        if time() - self.prev_save_time > self.interval:
+            self.save(IP_mat)
+
+
+    def save(self, IP_mat, is_complete=False):
+        """Saves the blocks of ``IP_mat`` added since the last save, noting
+        whether they complete the blocks this processor/MPI worker
+        computes."""
+        new_blocks = [block for block_index, block in enumerate(
+            IP_mat.blocks[self.num_blocks_saved:], self.num_blocks_saved)
+            if block_index not in self.restored_block_indices]
+        self.num_blocks_saved = len(IP_mat.blocks)
+        if len(new_blocks) > 0:
+            arrays = {'positions': np.array(
+                [block[:2] for block in new_blocks], dtype=int).reshape(-1, 2)}
+            for block_index, block in enumerate(new_blocks):
+                arrays['block_%d'%block_index] = block[2]
+            file_name = '%s_%06d.npz'%(self.prefix, len(self.file_names))
+            self._put_file(file_name,
+                lambda path: np.savez(path, **arrays))
+            self.file_names.append(file_name)
+        elif not is_complete:
+            self.prev_save_time = time()
+            return
+        manifest = {
+            'shape': list(IP_mat.shape),
+            'is_symmetric': IP_mat.is_symmetric,
+            'vec_keys_fingerprint': self.vec_keys_fingerprint,
+            'num_procs': parallel.get_num_procs(),
+            'rank': parallel.get_rank(),
+            'is_complete': is_complete,
+            'file_names': self.file_names}
+        self._put_file(self.prefix + '.json',
+            lambda path: json.dump(manifest, path))
+        self.prev_save_time = time()
+
+
+    def _put_file(self, file_name, put_file):
+        """Calls ``put_file`` with an open temporary file, then renames it to
+        ``file_name`` in the checkpoint directory."""
+        path = os.path.join(self.checkpoint_dir, file_name)
+        temp_path = path + '.tmp'
+        if file_name.endswith('.json'):
+            mode = 'w'
+        else:
+            mode = 'wb'
+        with open(temp_path, mode) as temp_file:
+            put_file(temp_file)
+        os.rename(temp_path, path)
@@ -4,7 +4,8 @@ from future.builtins import object
 
 import numpy as np
 
-from .vectorspace import VectorSpaceMatrices, VectorSpaceHandles
+from .vectorspace import (
+    VectorSpaceMatrices, VectorSpaceHandles, make_mode_handles)
 from . import util
 from . import parallel
 
@@ -341,6 +342,19 @@ def compute_DMD_matrices_direct_method(
         return exact_modes, proj_modes, spectral_coeffs, eigvals
 
 
+def _slice_expanded_correlation_mat(expanded_correlation_mat):
+    """Slices the correlation matrix of a sequential dataset into the
+    correlation, cross-correlation, and advanced correlation matrices.  These
+    are None if the expanded correlation matrix is None (i.e., if it was only
+    assembled on rank zero)."""
+    if expanded_correlation_mat is None:
+        return None, None, None
+    return (
+        expanded_correlation_mat[:-1, :-1],
+        expanded_correlation_mat[:-1, 1:],
+        expanded_correlation_mat[1:, 1:])
+
+
 class DMDHandles(object):
     """Dynamic Mode Decomposition implemented for large datasets.
 
@@ -350,16 +364,28 @@ class DMDHandles(object):
 
     Kwargs:
         ``put_mat``: Function to put a matrix out of modred, e.g., write it to
-        file.
+        file.  Default is :py:func:`util.save_array_text`;
+        :py:func:`util.save_array_binary` is much faster for large matrices.
 
         ``get_mat``: Function to get a matrix into modred, e.g., load it from
-        file.
+        file.  Default is :py:func:`util.load_array_text`; use
+        :py:func:`util.load_array_binary` for matrices put with
+        :py:func:`util.save_array_binary`.
 
         ``max_vecs_per_node``: Maximum number of vectors that can be stored in
         memory, per node.
 
         ``verbosity``: 1 prints progress and warnings, 0 prints almost nothing.
 
+        ``inner_product_block``: Function that computes the matrix of inner
+        products of two lists of vector objects.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
+        ``max_bytes_per_node``: Maximum number of bytes of vectors that can be
+        stored in memory, per node, or ``'auto'``.  If given, it is used
+        instead of ``max_vecs_per_node``.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
     Computes DMD modes from vector objects (or handles).  It uses
     :py:class:`vectorspace.VectorSpaceHandles` for low level functions.
 
@@ -374,7 +400,8 @@ class DMDHandles(object):
     """
     def __init__(
         self, inner_product, get_mat=util.load_array_text,
-        put_mat=util.save_array_text, max_vecs_per_node=None, verbosity=1):
+        put_mat=util.save_array_text, max_vecs_per_node=None, verbosity=1,
+        inner_product_block=None, max_bytes_per_node=None):
         """Constructor"""
         self.get_mat = get_mat
         self.put_mat = put_mat
@@ -391,7 +418,9 @@ class DMDHandles(object):
         self.proj_coeffs = None
         self.adv_proj_coeffs = None
         self.vec_space = VectorSpaceHandles(inner_product=inner_product,
-            max_vecs_per_node=max_vecs_per_node, verbosity=verbosity)
+            max_vecs_per_node=max_vecs_per_node, verbosity=verbosity,
+            inner_product_block=inner_product_block,
+            max_bytes_per_node=max_bytes_per_node)
         self.vec_handles = None
         self.adv_vec_handles = None
 
@@ -568,6 +597,10 @@ class DMDHandles(object):
           DMD.compute_exact_modes(
               mode_idx_list, mode_handles, adv_vec_handles=adv_vec_handles)
 
+        Matrices put with ``put_mat=util.save_array_binary`` can be
+        memory-mapped with :py:func:`util.load_array_binary` instead of
+        loaded from text.
+
         Another way to use this is to compute a DMD using a truncated basis for
         the projection of the approximating linear map.  Start by either
         computing a full decomposition or by loading pre-computed correlation
@@ -612,14 +645,17 @@ class DMDHandles(object):
             self.correlation_mat_eigvecs = self.correlation_mat_eigvecs[
                 :, :max_num_eigvals]
 
-        # Compute low-order linear map
+        # Compute low-order linear map on rank zero, which is the only
+        # processor/MPI worker with the cross-correlation matrix if it was
+        # assembled there.
         correlation_mat_eigvals_sqrt_inv = np.mat(np.diag(
             self.correlation_mat_eigvals ** -0.5))
-        self.low_order_linear_map = (
+        self.low_order_linear_map = parallel.call_and_bcast(
+            lambda: (
             correlation_mat_eigvals_sqrt_inv *
             self.correlation_mat_eigvecs.conj().T *
             self.cross_correlation_mat * self.correlation_mat_eigvecs *
-            correlation_mat_eigvals_sqrt_inv)
+            correlation_mat_eigvals_sqrt_inv))
 
         # Compute eigendecomposition of low-order linear map
         self.eigvals, self.R_low_order_eigvecs, self.L_low_order_eigvecs =\
@@ -630,7 +666,7 @@ class DMDHandles(object):
 
     def compute_decomp(
         self, vec_handles, adv_vec_handles=None, atol=1e-13, rtol=None,
-        max_num_eigvals=None):
+        max_num_eigvals=None, assembly='allreduce'):
         """Computes eigendecomposition of low-order linear map approximating
         relationship between vector objects, returning various matrices
         necessary for computing and characterizing DMD modes.
@@ -657,6 +693,13 @@ class DMDHandles(object):
             matrix. If set to None, no truncation will be performed, and the
             maximum possible number of DMD eigenvalues will be computed.
 
+            ``assembly``: How the inner product matrices are assembled.  With
+            ``'allreduce'`` (default), every processor/MPI worker gets the
+            full matrices.  With ``'rank_zero'``, only rank zero does, and
+            the others store None, which avoids summing full matrices over all
+            processors/MPI workers.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.compute_inner_product_mat`.
+
         Returns:
             ``eigvals``: 1D array of eigenvalues of low-order linear map, i.e.,
             the DMD eigenvalues.
@@ -673,6 +716,9 @@ class DMDHandles(object):
             ``correlation_mat_eigvecs``: Matrix whose columns are eigenvectors
             of correlation matrix.
         """
+        if assembly not in ['allreduce', 'rank_zero']:
+            raise ValueError('Invalid assembly "%s", must be "allreduce" or '
+                '"rank_zero"'%assembly)
         self.vec_handles = vec_handles
         if adv_vec_handles is not None:
             self.adv_vec_handles = adv_vec_handles
@@ -690,19 +736,20 @@ class DMDHandles(object):
         if adv_vec_handles is None:
             self.expanded_correlation_mat =\
                 self.vec_space.compute_symmetric_inner_product_mat(
-                self.vec_handles)
-            self.correlation_mat = self.expanded_correlation_mat[:-1, :-1]
-            self.cross_correlation_mat = self.expanded_correlation_mat[:-1, 1:]
+                self.vec_handles, assembly=assembly)
+            self.correlation_mat, self.cross_correlation_mat = (
+                _slice_expanded_correlation_mat(
+                self.expanded_correlation_mat)[:2])
         # For non-sequential data, compute the correlation matrix from the
         # unadvanced snapshots only.  Compute the cross correlation matrix
         # involving the unadvanced and advanced snapshots separately.
         else:
             self.correlation_mat = \
                 self.vec_space.compute_symmetric_inner_product_mat(
-                self.vec_handles)
+                self.vec_handles, assembly=assembly)
             self.cross_correlation_mat = \
                 self.vec_space.compute_inner_product_mat(
-                self.vec_handles, self.adv_vec_handles)
+                self.vec_handles, self.adv_vec_handles, assembly=assembly)
 
         # Compute eigendecomposition of low-order linear map.
         self.compute_eigendecomp(
@@ -716,6 +763,114 @@ class DMDHandles(object):
             self.correlation_mat_eigvecs)
 
 
+    def _append_correlation_mats(
+        self, new_vec_handles, new_adv_vec_handles, assembly):
+        """Extends the correlation and cross-correlation matrices with the
+        inner products involving new vector objects, and appends the new
+        handles to the stored ones.  Returns the new advanced handles of a
+        non-sequential dataset, as a list."""
+        if assembly not in ['allreduce', 'rank_zero']:
+            raise ValueError('Invalid assembly "%s", must be "allreduce" or '
+                '"rank_zero"'%assembly)
+        if self.vec_handles is None:
+            raise util.UndefinedError('Must call compute_decomp first')
+        if (new_adv_vec_handles is None) != (self.adv_vec_handles is None):
+            raise ValueError('new_adv_vec_handles must be given if and only '
+                'if adv_vec_handles were given to compute_decomp')
+        old_vec_handles = list(self.vec_handles)
+        new_vec_handles = list(util.make_iterable(new_vec_handles))
+
+        # For a sequential dataset, extend the expanded correlation mat by the
+        # inner products of the new vectors with all of the vectors, then
+        # slice it as in compute_decomp.
+        if new_adv_vec_handles is None:
+            self.expanded_correlation_mat = util.extend_mat(
+                self.expanded_correlation_mat,
+                self.vec_space.compute_inner_product_mat(
+                old_vec_handles, new_vec_handles, assembly=assembly),
+                self.vec_space.compute_symmetric_inner_product_mat(
+                new_vec_handles, assembly=assembly))
+            self.correlation_mat, self.cross_correlation_mat = (
+                _slice_expanded_correlation_mat(
+                self.expanded_correlation_mat)[:2])
+            self.vec_handles = old_vec_handles + new_vec_handles
+            return None
+
+        # For non-sequential data, the cross correlation mat gains new columns
+        # for the new advanced vectors and new rows for the new unadvanced
+        # vectors.
+        new_adv_vec_handles = list(util.make_iterable(new_adv_vec_handles))
+        if len(new_vec_handles) != len(new_adv_vec_handles):
+            raise ValueError(('Number of new_vec_handles and '
+                'new_adv_vec_handles is not equal.'))
+        old_adv_vec_handles = list(self.adv_vec_handles)
+        self.correlation_mat = util.extend_mat(
+            self.correlation_mat,
+            self.vec_space.compute_inner_product_mat(
+            old_vec_handles, new_vec_handles, assembly=assembly),
+            self.vec_space.compute_symmetric_inner_product_mat(
+            new_vec_handles, assembly=assembly))
+        new_cross_cols = self.vec_space.compute_inner_product_mat(
+            old_vec_handles + new_vec_handles, new_adv_vec_handles,
+            assembly=assembly)
+        new_cross_rows = self.vec_space.compute_inner_product_mat(
+            new_vec_handles, old_adv_vec_handles, assembly=assembly)
+        if new_cross_cols is not None:
+            num_old_vecs = len(old_vec_handles)
+            self.cross_correlation_mat = util.extend_mat(
+                self.cross_correlation_mat, new_cross_cols[:num_old_vecs],
+                new_cross_cols[num_old_vecs:], new_rows=new_cross_rows)
+        self.vec_handles = old_vec_handles + new_vec_handles
+        self.adv_vec_handles = old_adv_vec_handles + new_adv_vec_handles
+        return new_adv_vec_handles
+
+
+    def append_vecs(
+        self, new_vec_handles, new_adv_vec_handles=None, atol=1e-13,
+        rtol=None, max_num_eigvals=None, assembly='allreduce'):
+        """Appends vector objects to those given to :py:meth:`compute_decomp`
+        and updates the eigendecomposition of the low-order linear map.
+
+        Args:
+            ``new_vec_handles``: List of handles for new vector objects.  For a
+            sequential dataset, these continue the time-series.
+
+        Kwargs:
+            ``new_adv_vec_handles``: List of handles for new vector objects
+            advanced in time.  Must be given if and only if
+            ``adv_vec_handles`` was given to :py:meth:`compute_decomp`.
+
+            ``atol``: Level below which DMD eigenvalues are truncated.
+
+            ``rtol``: Maximum relative difference between largest and smallest
+            DMD eigenvalues.  Smaller ones are truncated.
+
+            ``max_num_eigvals``: Maximum number of DMD eigenvalues that will be
+            computed.  See :py:meth:`compute_decomp`.
+
+            ``assembly``: How the new inner products are assembled.  Must be
+            the same as when :py:meth:`compute_decomp` was called.
+
+        Returns:
+            Same as :py:meth:`compute_decomp`.
+
+        Only the inner products involving the new vector objects are computed,
+        so the cost of each call grows linearly with the number of vector
+        objects already stored, e.g., when snapshots are appended as a
+        simulation produces them.
+        """
+        self._append_correlation_mats(
+            new_vec_handles, new_adv_vec_handles, assembly)
+        self.compute_eigendecomp(
+            atol=atol, rtol=rtol, max_num_eigvals=max_num_eigvals)
+        return (
+            self.eigvals,
+            self.R_low_order_eigvecs,
+            self.L_low_order_eigvecs,
+            self.correlation_mat_eigvals,
+            self.correlation_mat_eigvecs)
+
+
     def _compute_build_coeffs_exact(self):
         """Compute build coefficients for exact DMD modes."""
         return (
@@ -733,8 +888,16 @@ class DMDHandles(object):
             self.R_low_order_eigvecs)
 
 
+    def _compute_build_coeffs_adjoint(self):
+        """Compute build coefficients for adjoint DMD modes."""
+        return (
+            self.correlation_mat_eigvecs *
+            np.mat(np.diag(self.correlation_mat_eigvals ** -0.5)) *
+            self.L_low_order_eigvecs)
+
+
     def compute_exact_modes(self, mode_indices, mode_handles,
-        adv_vec_handles=None):
+        adv_vec_handles=None, resume=False):
         """Computes exact DMD modes and calls ``put`` on them using mode
         handles.
 
@@ -747,6 +910,10 @@ class DMDHandles(object):
         Kwargs:
             ``vec_handles``: List of handles for vector objects. Optional if
             when calling :py:meth:`compute_decomp`.
+
+            ``resume``: If True, modes that were already put, e.g., by a run
+            that was killed, are not computed again.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.lin_combine`.
         """
         # If advanced vec handles are passed in, set the internal attribute,
         if adv_vec_handles is not None:
@@ -754,28 +921,35 @@ class DMDHandles(object):
 
         # Compute build coefficient matrix
         build_coeffs_exact = self._compute_build_coeffs_exact()
+        self.vec_space.lin_combine(mode_handles,
+            self._find_exact_mode_basis(build_coeffs_exact),
+            build_coeffs_exact, coeff_mat_col_indices=mode_indices,
+            resume=resume)
 
-        # If the internal attribute is set, then compute the modes
+
+    def _find_exact_mode_basis(self, build_coeffs_exact):
+        """Returns the handles of the vector objects that exact DMD modes are
+        linear combinations of."""
+        # If the internal attribute is set, then the modes are built from the
+        # advanced vecs.
         if self.adv_vec_handles is not None:
-            self.vec_space.lin_combine(mode_handles, self.adv_vec_handles,
-                build_coeffs_exact, coeff_mat_col_indices=mode_indices)
+            return self.adv_vec_handles
         # If the internal attribute is not set, then check to see if
         # vec_handles is set.  If so, assume a sequential dataset, in which
         # case adv_vec_handles can be taken from a slice of vec_handles.
         elif self.vec_handles is not None:
             if len(self.vec_handles) - build_coeffs_exact.shape[0] == 1:
-                self.vec_space.lin_combine(mode_handles, self.vec_handles[1:],
-                    build_coeffs_exact, coeff_mat_col_indices=mode_indices)
+                return self.vec_handles[1:]
             else:
-                raise(
-                    ValueError, ('Number of vec_handles is not correct for a '
+                raise ValueError(('Number of vec_handles is not correct for a '
                     'sequential dataset.'))
         else:
-            raise(ValueError, 'Neither vec_handles nor adv_vec_handles is '
+            raise ValueError('Neither vec_handles nor adv_vec_handles is '
                 'defined.')
 
 
-    def compute_proj_modes(self, mode_indices, mode_handles, vec_handles=None):
+    def compute_proj_modes(
+        self, mode_indices, mode_handles, vec_handles=None, resume=False):
         """Computes projected DMD modes and calls ``put`` on them using mode
         handles.
 
@@ -788,27 +962,37 @@ class DMDHandles(object):
         Kwargs:
             ``vec_handles``: List of handles for vector objects. Optional if
             when calling :py:meth:`compute_decomp`.
+
+            ``resume``: If True, modes that were already put, e.g., by a run
+            that was killed, are not computed again.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.lin_combine`.
         """
         if vec_handles is not None:
             self.vec_handles = vec_handles
 
         # Compute build coefficient matrix
         build_coeffs_proj = self._compute_build_coeffs_proj()
+        self.vec_space.lin_combine(mode_handles,
+            self._find_proj_mode_basis(build_coeffs_proj),
+            build_coeffs_proj, coeff_mat_col_indices=mode_indices,
+            resume=resume)
 
+
+    def _find_proj_mode_basis(self, build_coeffs_proj):
+        """Returns the handles of the vector objects that projected DMD modes
+        are linear combinations of."""
         # For sequential data, the user will provide a list vec_handles that
         # whose length is one larger than the number of rows of the
         # build_coeffs matrix.  This is to be expected, as vec_handles is
         # essentially partitioned into two sets of handles, each of length one
         # less than vec_handles.
         if len(self.vec_handles) - build_coeffs_proj.shape[0] == 1:
-            self.vec_space.lin_combine(mode_handles, self.vec_handles[:-1],
-                build_coeffs_proj, coeff_mat_col_indices=mode_indices)
+            return self.vec_handles[:-1]
         # For a non-sequential dataset, the user will provide a list
         # vec_handles whose length is equal to the number of rows in the
         # build_coeffs matrix.
         elif len(self.vec_handles) == build_coeffs_proj.shape[0]:
-            self.vec_space.lin_combine(mode_handles, self.vec_handles,
-                build_coeffs_proj, coeff_mat_col_indices=mode_indices)
+            return self.vec_handles
         # Otherwise, raise an error, as the number of handles should fit one of
         # the two cases described above.
         else:
@@ -816,6 +1000,120 @@ class DMDHandles(object):
                 'columns in build_coeffs_proj matrix.'))
 
 
+    def compute_exact_and_proj_modes(self, mode_indices, exact_mode_handles,
+        proj_mode_handles, vec_handles=None, adv_vec_handles=None,
+        resume=False):
+        """Computes exact and projected DMD modes and calls ``put`` on them
+        using mode handles, retrieving the vector objects once for both.
+
+        Args:
+            ``mode_indices``: List of indices describing which modes to
+            compute, e.g. ``range(10)`` or ``[3, 0, 5]``.
+
+            ``exact_mode_handles``: List of handles for exact modes to compute.
+
+            ``proj_mode_handles``: List of handles for projected modes to
+            compute.
+
+        Kwargs:
+            ``vec_handles``: List of handles for vector objects. Optional if
+            given when calling :py:meth:`compute_decomp`.
+
+            ``adv_vec_handles``: List of handles for advanced vector objects.
+            Optional if given when calling :py:meth:`compute_decomp`, or if
+            the dataset is sequential.
+
+            ``resume``: If True, modes that were already put, e.g., by a run
+            that was killed, are not computed again.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.lin_combine`.
+
+        This gives the same modes as :py:meth:`compute_exact_modes` and
+        :py:meth:`compute_proj_modes`, but with one call to
+        :py:meth:`vectorspace.VectorSpaceHandles.lin_combine_multiple`.  For
+        a sequential dataset, the vector objects are retrieved once instead
+        of twice, and for a non-sequential dataset, the vector objects and
+        advanced vector objects are each retrieved once.
+        """
+        if vec_handles is not None:
+            self.vec_handles = vec_handles
+        if adv_vec_handles is not None:
+            self.adv_vec_handles = adv_vec_handles
+
+        # Compute build coefficient matrices
+        build_coeffs_exact = self._compute_build_coeffs_exact()
+        build_coeffs_proj = self._compute_build_coeffs_proj()
+        self.vec_space.lin_combine_multiple(
+            [exact_mode_handles, proj_mode_handles],
+            [self._find_exact_mode_basis(build_coeffs_exact),
+            self._find_proj_mode_basis(build_coeffs_proj)],
+            [build_coeffs_exact, build_coeffs_proj],
+            coeff_mat_col_indices_list=[mode_indices, mode_indices],
+            resume=resume)
+
+
+    def make_exact_mode_handles(self, mode_indices, adv_vec_handles=None,
+        mode_cache=None):
+        """Returns handles for exact DMD modes that are only computed when
+        they are retrieved, instead of computing and putting the modes.
+
+        Args:
+            ``mode_indices``: List of indices describing which exact modes to
+            make handles for, e.g. ``range(10)`` or ``[3, 0, 5]``.
+
+        Kwargs:
+            ``adv_vec_handles``: List of handles for advanced vector objects.
+            Optional if given when calling :py:meth:`compute_decomp`, or if
+            the dataset is sequential.
+
+            ``mode_cache``: :py:class:`vectorspace.ModeCache` in which modes
+            are kept once they are computed.  Default is None, for which the
+            cache shared by default is used (see
+            :py:func:`vectorspace.make_mode_handles`).
+
+        Returns:
+            ``mode_handles``: List of :py:class:`vectorspace.ModeHandle`
+            objects (see :py:func:`vectorspace.make_mode_handles`).
+        """
+        if adv_vec_handles is not None:
+            self.adv_vec_handles = adv_vec_handles
+        build_coeffs_exact = self._compute_build_coeffs_exact()
+        return make_mode_handles(
+            self._find_exact_mode_basis(build_coeffs_exact),
+            build_coeffs_exact, coeff_mat_col_indices=mode_indices,
+            mode_cache=mode_cache)
+
+
+    def make_proj_mode_handles(self, mode_indices, vec_handles=None,
+        mode_cache=None):
+        """Returns handles for projected DMD modes that are only computed
+        when they are retrieved, instead of computing and putting the modes.
+
+        Args:
+            ``mode_indices``: List of indices describing which projected modes
+            to make handles for, e.g. ``range(10)`` or ``[3, 0, 5]``.
+
+        Kwargs:
+            ``vec_handles``: List of handles for vector objects. Optional if
+            given when calling :py:meth:`compute_decomp`.
+
+            ``mode_cache``: :py:class:`vectorspace.ModeCache` in which modes
+            are kept once they are computed.  Default is None, for which the
+            cache shared by default is used (see
+            :py:func:`vectorspace.make_mode_handles`).
+
+        Returns:
+            ``mode_handles``: List of :py:class:`vectorspace.ModeHandle`
+            objects (see :py:func:`vectorspace.make_mode_handles`).
+        """
+        if vec_handles is not None:
+            self.vec_handles = vec_handles
+        build_coeffs_proj = self._compute_build_coeffs_proj()
+        return make_mode_handles(
+            self._find_proj_mode_basis(build_coeffs_proj),
+            build_coeffs_proj, coeff_mat_col_indices=mode_indices,
+            mode_cache=mode_cache)
+
+
     def compute_spectrum(self):
         """Computes DMD spectral coefficients.  These coefficients come from a
         biorthogonal projection of the first vector object onto the exact DMD
@@ -855,13 +1153,43 @@ class DMDHandles(object):
             self.L_low_order_eigvecs.H *
             np.mat(np.diag(np.sqrt(self.correlation_mat_eigvals))) *
             self.correlation_mat_eigvecs.T)
-        self.adv_proj_coeffs = (
+        self.adv_proj_coeffs = parallel.call_and_bcast(
+            lambda: (
             self.L_low_order_eigvecs.H *
             np.mat(np.diag(self.correlation_mat_eigvals ** -0.5)) *
-            self.correlation_mat_eigvecs.T * self.cross_correlation_mat)
+            self.correlation_mat_eigvecs.T * self.cross_correlation_mat))
         return self.proj_coeffs, self.adv_proj_coeffs
 
 
+    def compute_proj_coeffs_of(self, new_vec_handles):
+        """Computes projection of new vector objects onto DMD modes, without
+        computing the modes.  As for :py:meth:`compute_proj_coeffs`, this is
+        a biorthogonal projection onto exact DMD modes, using the adjoint DMD
+        modes.
+
+        Args:
+            ``new_vec_handles``: List of handles for new vector objects.
+
+        Returns:
+            ``proj_coeffs``: Matrix of projection coefficients for new vector
+            objects, expressed as a linear combination of DMD modes.  Columns
+            correspond to new vector objects, rows correspond to DMD modes.
+
+        The adjoint modes are linear combinations of the vector objects, so
+        the coefficients are found from the inner products of the vector
+        objects with the new vector objects (see
+        :py:meth:`vectorspace.VectorSpaceHandles.compute_inner_product_mat`).
+        The modes are never computed or retrieved.
+        """
+        if self.vec_handles is None:
+            raise util.UndefinedError('vec_handles undefined')
+        new_vec_handles = util.make_iterable(new_vec_handles)
+        build_coeffs_adjoint = self._compute_build_coeffs_adjoint()
+        IP_mat = self.vec_space.compute_inner_product_mat(
+            self._find_proj_mode_basis(build_coeffs_adjoint), new_vec_handles)
+        return build_coeffs_adjoint.H * np.mat(IP_mat)
+
+
 def compute_TLSqrDMD_matrices_snaps_method(
     vecs, mode_indices, adv_vecs=None, inner_product_weights=None, atol=1e-13,
     rtol=None, max_num_eigvals=None, return_all=False):
@@ -1262,16 +1590,28 @@ class TLSqrDMDHandles(DMDHandles):
 
     Kwargs:
         ``put_mat``: Function to put a matrix out of modred, e.g., write it to
-        file.
+        file.  Default is :py:func:`util.save_array_text`;
+        :py:func:`util.save_array_binary` is much faster for large matrices.
 
       	``get_mat``: Function to get a matrix into modred, e.g., load it from
-        file.
+        file.  Default is :py:func:`util.load_array_text`; use
+        :py:func:`util.load_array_binary` for matrices put with
+        :py:func:`util.save_array_binary`.
 
         ``max_vecs_per_node``: Maximum number of vectors that can be stored in
         memory, per node.
 
         ``verbosity``: 1 prints progress and warnings, 0 prints almost nothing.
 
+        ``inner_product_block``: Function that computes the matrix of inner
+        products of two lists of vector objects.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
+        ``max_bytes_per_node``: Maximum number of bytes of vectors that can be
+        stored in memory, per node, or ``'auto'``.  If given, it is used
+        instead of ``max_vecs_per_node``.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
     Computes Total-Least-Squares DMD modes from vector objects (or handles).
     It uses :py:class:`vectorspace.VectorSpaceHandles` for low level functions.
 
@@ -1309,7 +1649,8 @@ class TLSqrDMDHandles(DMDHandles):
     """
     def __init__(
         self, inner_product, get_mat=util.load_array_text,
-        put_mat=util.save_array_text, max_vecs_per_node=None, verbosity=1):
+        put_mat=util.save_array_text, max_vecs_per_node=None, verbosity=1,
+        inner_product_block=None, max_bytes_per_node=None):
         """Constructor"""
         self.get_mat = get_mat
         self.put_mat = put_mat
@@ -1329,7 +1670,9 @@ class TLSqrDMDHandles(DMDHandles):
         self.proj_coeffs = None
         self.adv_proj_coeffs = None
         self.vec_space = VectorSpaceHandles(inner_product=inner_product,
-            max_vecs_per_node=max_vecs_per_node, verbosity=verbosity)
+            max_vecs_per_node=max_vecs_per_node, verbosity=verbosity,
+            inner_product_block=inner_product_block,
+            max_bytes_per_node=max_bytes_per_node)
         self.vec_handles = None
         self.adv_vec_handles = None
 
@@ -1400,9 +1743,11 @@ class TLSqrDMDHandles(DMDHandles):
         for over-constrained datasets, but must be enforced by the user for
         under-constrined datasets.
         """
-        # Compute eigendecomposition of stacked correlation matrix
-        self.summed_correlation_mats = (
-            self.correlation_mat + self.adv_correlation_mat)
+        # The correlation matrices are only used on rank zero, which is the
+        # only processor/MPI worker that has them if they were assembled
+        # there.  Compute eigendecomposition of stacked correlation matrix.
+        self.summed_correlation_mats = parallel.call_from_rank_zero(
+            lambda: self.correlation_mat + self.adv_correlation_mat)
         (self.summed_correlation_mats_eigvals,
         self.summed_correlation_mats_eigvecs) = parallel.call_and_bcast(
             util.eigh, self.summed_correlation_mats,
@@ -1417,12 +1762,13 @@ class TLSqrDMDHandles(DMDHandles):
                 self.summed_correlation_mats_eigvecs[:, :max_num_eigvals]
 
         # Compute eigendecomposition of projected correlation matrix
-        self.proj_correlation_mat = (
+        self.proj_correlation_mat = parallel.call_from_rank_zero(
+            lambda: (
             self.summed_correlation_mats_eigvecs *
             self.summed_correlation_mats_eigvecs.H *
             self.correlation_mat *
             self.summed_correlation_mats_eigvecs *
-            self.summed_correlation_mats_eigvecs.H)
+            self.summed_correlation_mats_eigvecs.H))
         (self.proj_correlation_mat_eigvals,
         self.proj_correlation_mat_eigvecs) = parallel.call_and_bcast(
             util.eigh, self.proj_correlation_mat ,
@@ -1439,7 +1785,8 @@ class TLSqrDMDHandles(DMDHandles):
         # Compute low-order linear map
         proj_correlation_mat_eigvals_sqrt_inv = np.mat(np.diag(
             self.proj_correlation_mat_eigvals ** -0.5))
-        self.low_order_linear_map = (
+        self.low_order_linear_map = parallel.call_and_bcast(
+            lambda: (
             proj_correlation_mat_eigvals_sqrt_inv *
             self.proj_correlation_mat_eigvecs.conj().H *
             self.summed_correlation_mats_eigvecs *
@@ -1448,7 +1795,7 @@ class TLSqrDMDHandles(DMDHandles):
             self.summed_correlation_mats_eigvecs *
             self.summed_correlation_mats_eigvecs.H *
             self.proj_correlation_mat_eigvecs *
-            proj_correlation_mat_eigvals_sqrt_inv)
+            proj_correlation_mat_eigvals_sqrt_inv))
 
         # Compute eigendecomposition of low-order linear map
         self.eigvals, self.R_low_order_eigvecs, self.L_low_order_eigvecs =\
@@ -1459,7 +1806,7 @@ class TLSqrDMDHandles(DMDHandles):
 
     def compute_decomp(
         self, vec_handles, adv_vec_handles=None, atol=1e-13, rtol=None,
-        max_num_eigvals=None):
+        max_num_eigvals=None, assembly='allreduce'):
         """Computes eigendecomposition of low-order linear map approximating
         relationship between vector objects, returning various matrices
         necessary for computing and characterizing DMD modes.
@@ -1486,6 +1833,13 @@ class TLSqrDMDHandles(DMDHandles):
             matrix. If set to None, no truncation will be performed, and the
             maximum possible number of DMD eigenvalues will be computed.
 
+            ``assembly``: How the inner product matrices are assembled.  With
+            ``'allreduce'`` (default), every processor/MPI worker gets the
+            full matrices.  With ``'rank_zero'``, only rank zero does, and
+            the others store None, which avoids summing full matrices over all
+            processors/MPI workers.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.compute_inner_product_mat`.
+
         Returns:
             ``eigvals``: 1D array of eigenvalues of low-order linear map, i.e.,
             the DMD eigenvalues.
@@ -1514,6 +1868,9 @@ class TLSqrDMDHandles(DMDHandles):
         for over-constrained datasets, but must be enforced by the user for
         under-constrined datasets.
         """
+        if assembly not in ['allreduce', 'rank_zero']:
+            raise ValueError('Invalid assembly "%s", must be "allreduce" or '
+                '"rank_zero"'%assembly)
         self.vec_handles = vec_handles
         if adv_vec_handles is not None:
             self.adv_vec_handles = adv_vec_handles
@@ -1531,23 +1888,25 @@ class TLSqrDMDHandles(DMDHandles):
         if adv_vec_handles is None:
             self.expanded_correlation_mat =\
                 self.vec_space.compute_symmetric_inner_product_mat(
-                self.vec_handles)
-            self.correlation_mat = self.expanded_correlation_mat[:-1, :-1]
-            self.cross_correlation_mat = self.expanded_correlation_mat[:-1, 1:]
-            self.adv_correlation_mat = self.expanded_correlation_mat[1:, 1:]
+                self.vec_handles, assembly=assembly)
+            self.correlation_mat, self.cross_correlation_mat = (
+                _slice_expanded_correlation_mat(
+                self.expanded_correlation_mat)[:2])
+            self.adv_correlation_mat = _slice_expanded_correlation_mat(
+                self.expanded_correlation_mat)[2]
         # For non-sequential data, compute the correlation matrix from the
         # unadvanced snapshots only.  Compute the cross correlation matrix
         # involving the unadvanced and advanced snapshots separately.
         else:
             self.correlation_mat = \
                 self.vec_space.compute_symmetric_inner_product_mat(
-                self.vec_handles)
+                self.vec_handles, assembly=assembly)
             self.cross_correlation_mat = \
                 self.vec_space.compute_inner_product_mat(
-                self.vec_handles, self.adv_vec_handles)
+                self.vec_handles, self.adv_vec_handles, assembly=assembly)
             self.adv_correlation_mat = \
                 self.vec_space.compute_symmetric_inner_product_mat(
-                self.adv_vec_handles)
+                self.adv_vec_handles, assembly=assembly)
 
         # Compute eigendecomposition of low-order linear map.
         self.compute_eigendecomp(
@@ -1563,6 +1922,64 @@ class TLSqrDMDHandles(DMDHandles):
             self.proj_correlation_mat_eigvecs)
 
 
+    def append_vecs(
+        self, new_vec_handles, new_adv_vec_handles=None, atol=1e-13,
+        rtol=None, max_num_eigvals=None, assembly='allreduce'):
+        """Appends vector objects to those given to :py:meth:`compute_decomp`
+        and updates the eigendecomposition of the low-order linear map.
+
+        Args:
+            ``new_vec_handles``: List of handles for new vector objects.  For a
+            sequential dataset, these continue the time-series.
+
+        Kwargs:
+            ``new_adv_vec_handles``: List of handles for new vector objects
+            advanced in time.  Must be given if and only if
+            ``adv_vec_handles`` was given to :py:meth:`compute_decomp`.
+
+            ``atol``: Level below which DMD eigenvalues are truncated.
+
+            ``rtol``: Maximum relative difference between largest and smallest
+            DMD eigenvalues.  Smaller ones are truncated.
+
+            ``max_num_eigvals``: Maximum number of DMD eigenvalues that will be
+            computed.  See :py:meth:`compute_decomp`.
+
+            ``assembly``: How the new inner products are assembled.  Must be
+            the same as when :py:meth:`compute_decomp` was called.
+
+        Returns:
+            Same as :py:meth:`compute_decomp`.
+
+        Only the inner products involving the new vector objects are computed,
+        so the cost of each call grows linearly with the number of vector
+        objects already stored.
+        """
+        old_adv_vec_handles = self.adv_vec_handles
+        new_adv_vec_handles = self._append_correlation_mats(
+            new_vec_handles, new_adv_vec_handles, assembly)
+        if new_adv_vec_handles is None:
+            self.adv_correlation_mat = _slice_expanded_correlation_mat(
+                self.expanded_correlation_mat)[2]
+        else:
+            self.adv_correlation_mat = util.extend_mat(
+                self.adv_correlation_mat,
+                self.vec_space.compute_inner_product_mat(
+                old_adv_vec_handles, new_adv_vec_handles, assembly=assembly),
+                self.vec_space.compute_symmetric_inner_product_mat(
+                new_adv_vec_handles, assembly=assembly))
+        self.compute_eigendecomp(
+            atol=atol, rtol=rtol, max_num_eigvals=max_num_eigvals)
+        return (
+            self.eigvals,
+            self.R_low_order_eigvecs,
+            self.L_low_order_eigvecs,
+            self.summed_correlation_mats_eigvals,
+            self.summed_correlation_mats_eigvecs,
+            self.proj_correlation_mat_eigvals,
+            self.proj_correlation_mat_eigvecs)
+
+
     def _compute_build_coeffs_exact(self):
         """Compute build coefficients for exact DMD modes."""
         return (
@@ -1584,6 +2001,16 @@ class TLSqrDMDHandles(DMDHandles):
             self.R_low_order_eigvecs)
 
 
+    def _compute_build_coeffs_adjoint(self):
+        """Compute build coefficients for adjoint DMD modes."""
+        return (
+            self.summed_correlation_mats_eigvecs *
+            self.summed_correlation_mats_eigvecs.H *
+            self.proj_correlation_mat_eigvecs *
+            np.mat(np.diag(self.proj_correlation_mat_eigvals ** -0.5)) *
+            self.L_low_order_eigvecs)
+
+
     def get_decomp(
         self, eigvals_src, R_low_order_eigvecs_src, L_low_order_eigvecs_src,
         summed_correlation_mats_eigvals_src,
@@ -1765,7 +2192,8 @@ class TLSqrDMDHandles(DMDHandles):
             self.L_low_order_eigvecs.H *
             np.mat(np.diag(np.sqrt(self.proj_correlation_mat_eigvals))) *
             self.proj_correlation_mat_eigvecs.T)
-        self.adv_proj_coeffs = (
+        self.adv_proj_coeffs = parallel.call_and_bcast(
+            lambda: (
             self.L_low_order_eigvecs.H *
             np.mat(np.diag(self.proj_correlation_mat_eigvals ** -0.5)) *
             self.proj_correlation_mat_eigvecs.T *
@@ -1773,6 +2201,6 @@ class TLSqrDMDHandles(DMDHandles):
             self.summed_correlation_mats_eigvecs.H *
             self.cross_correlation_mat *
             self.summed_correlation_mats_eigvecs *
-            self.summed_correlation_mats_eigvecs.H)
+            self.summed_correlation_mats_eigvecs.H))
 
         return self.proj_coeffs, self.adv_proj_coeffs
@@ -96,7 +96,8 @@ class ERA(object):
 
     Kwargs:
         ``put_mat``: Function to put a matrix out of modred, e.g., write it to
-        file.
+        file.  Default is :py:func:`util.save_array_text`;
+        :py:func:`util.save_array_binary` is much faster for large matrices.
 
         ``mc``: Number of Markov parameters for controllable dimension of
         Hankel matrix.
@@ -0,0 +1,260 @@
+"""Persistent cache of the inner products of vectors.
+
+A :py:class:`GramCache` keeps the inner products computed by
+:py:class:`vectorspace.VectorSpaceHandles` in files, keyed by the vectors and
+the inner product, so that each one is computed only once, even by different
+operations, decompositions, and runs.  For example, POD, DMD, and a Galerkin
+projection of the same vectors, or a second analysis with more vectors,
+reuse the inner products that were already computed.
+"""
+from __future__ import division
+from __future__ import absolute_import
+from future.builtins import object
+import os
+import hashlib
+import pickle
+import uuid
+
+import numpy as np
+
+from . import util
+
+
+def find_inner_product_key(inner_product):
+    """Returns a string identifying the function ``inner_product``.
+
+    The key is found from the pickled function, so functions are identified
+    by their module and name, and objects, e.g.,
+    :py:class:`vectors.InnerProductTrapz`, by their class and data, e.g.,
+    their grids.  Raises a ValueError if the function cannot be pickled,
+    e.g., a lambda function, in which case give the ``inner_product_key`` of
+    :py:class:`GramCache`.
+    """
+    try:
+        pickled_inner_product = pickle.dumps(inner_product, protocol=2)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        raise ValueError('Cannot find a key for the inner product %s, give '
+            'the inner_product_key of the GramCache'%inner_product)
+    return hashlib.sha1(pickled_inner_product).hexdigest()
+
+
+class _GramBlocks(object):
+    """The blocks of inner products saved for one inner product.
+
+    Args:
+        ``block_dir``: Directory holding the blocks.
+
+    Each block is saved as a ``.npy`` file of inner products and a
+    ``_keys.npz`` file with the keys of its rows and cols.  The keys file is
+    written last, so a block is only loaded once it is complete.  The inner
+    products are memory-mapped, so only the elements used are read.
+    """
+    def __init__(self, block_dir):
+        self.block_dir = block_dir
+        self.blocks = {}
+        # The blocks in which each vec key is a row or col, as sets of block
+        # names.
+        self.row_block_names = {}
+        self.col_block_names = {}
+
+
+    def refresh(self):
+        """Loads the blocks saved since the last refresh, e.g., by other
+        processors/MPI workers or runs."""
+        if not os.path.isdir(self.block_dir):
+            return
+        for file_name in util.get_file_list(
+            self.block_dir, file_extension='_keys.npz'):
+            block_name = file_name[:-len('_keys.npz')]
+            if block_name in self.blocks:
+                continue
+            with np.load(os.path.join(self.block_dir, file_name)) as keys:
+                row_keys = list(keys['row_keys'])
+                col_keys = list(keys['col_keys'])
+            IPs = np.load(os.path.join(self.block_dir, block_name + '.npy'),
+                mmap_mode='r')
+            self._add(block_name, IPs, row_keys, col_keys)
+
+
+    def _add(self, block_name, IPs, row_keys, col_keys):
+        """Adds a block to the index."""
+        self.blocks[block_name] = (IPs,
+            dict((key, index) for index, key in enumerate(row_keys)),
+            dict((key, index) for index, key in enumerate(col_keys)))
+        for key in row_keys:
+            self.row_block_names.setdefault(key, set()).add(block_name)
+        for key in col_keys:
+            self.col_block_names.setdefault(key, set()).add(block_name)
+
+
+    def save(self, IPs, row_keys, col_keys):
+        """Saves a new block."""
+        if not os.path.isdir(self.block_dir):
+            try:
+                os.makedirs(self.block_dir)
+            except OSError:
+                # Another processor/MPI worker may have just made it
+                if not os.path.isdir(self.block_dir):
+                    raise
+        block_name = 'block_%s'%uuid.uuid4().hex
+        block_path = os.path.join(self.block_dir, block_name)
+        with open(block_path + '.tmp.npy', 'wb') as IPs_file:
+            np.save(IPs_file, IPs)
+        os.rename(block_path + '.tmp.npy', block_path + '.npy')
+        with open(block_path + '.tmp.npz', 'wb') as keys_file:
+            np.savez(keys_file, row_keys=np.array(row_keys),
+                col_keys=np.array(col_keys))
+        os.rename(block_path + '.tmp.npz', block_path + '_keys.npz')
+        self._add(block_name, IPs, row_keys, col_keys)
+
+
+    def find(self, row_keys, col_keys):
+        """Returns the inner products of the vecs with ``row_keys`` and
+        ``col_keys``, and a boolean array of which were found."""
+        IP_mat = np.zeros((len(row_keys), len(col_keys)))
+        is_found = np.zeros(IP_mat.shape, dtype=bool)
+        row_positions = {}
+        for row_index, key in enumerate(row_keys):
+            if key is not None:
+                row_positions.setdefault(key, []).append(row_index)
+        col_positions = {}
+        for col_index, key in enumerate(col_keys):
+            if key is not None:
+                col_positions.setdefault(key, []).append(col_index)
+
+        # Blocks in which the rows are rows, and blocks in which they are
+        # cols.  The latter are conjugate transposed.
+        for block_names, is_transposed in [
+            (self.row_block_names, False), (self.col_block_names, True)]:
+            candidate_names = set()
+            for key in row_positions:
+                candidate_names.update(block_names.get(key, ()))
+            for block_name in candidate_names:
+                IPs, block_rows, block_cols = self.blocks[block_name]
+                if is_transposed:
+                    block_rows, block_cols = block_cols, block_rows
+                row_indices, block_row_indices = _match_keys(
+                    row_positions, block_rows)
+                col_indices, block_col_indices = _match_keys(
+                    col_positions, block_cols)
+                if len(row_indices) == 0 or len(col_indices) == 0:
+                    continue
+                if is_transposed:
+                    found_IPs = np.asarray(IPs[np.ix_(
+                        block_col_indices, block_row_indices)]).conj().T
+                else:
+                    found_IPs = np.asarray(IPs[np.ix_(
+                        block_row_indices, block_col_indices)])
+                IP_mat = IP_mat.astype(
+                    np.result_type(IP_mat, found_IPs), copy=False)
+                IP_mat[np.ix_(row_indices, col_indices)] = found_IPs
+                is_found[np.ix_(row_indices, col_indices)] = True
+        return IP_mat, is_found
+
+
+def _match_keys(positions, block_indices):
+    """Returns the indices of the keys in ``positions`` that are in a block,
+    and their indices in the block."""
+    indices = []
+    matching_block_indices = []
+    for key, key_indices in positions.items():
+        if key in block_indices:
+            indices.extend(key_indices)
+            matching_block_indices.extend(
+                [block_indices[key]] * len(key_indices))
+    return indices, matching_block_indices
+
+
+class GramCache(object):
+    """Keeps inner products of vectors in files, so that they are computed
+    once.
+
+    Args:
+        ``cache_dir``: Directory holding the cache.  It can be shared by
+        several :py:class:`vectorspace.VectorSpaceHandles`, decompositions,
+        and runs.
+
+    Kwargs:
+        ``inner_product_key``: String identifying the inner product.  If None
+        (default), it is found from the inner product function of each
+        :py:class:`vectorspace.VectorSpaceHandles` (see
+        :py:func:`find_inner_product_key`).
+
+    Give it as the ``gram_cache`` of
+    :py:class:`vectorspace.VectorSpaceHandles`.  The inner products of each
+    tile of an inner product matrix that are in the cache are not computed
+    again, and the new ones are saved, in a subdirectory for each inner
+    product.  Vectors are identified by the keys of their handles (see
+    :py:meth:`vectors.VecHandle.get_key`): the path, modification time, and
+    size of files, or a ``cache_key`` set by the user.  Inner products of
+    vectors without keys are computed, but not saved.  Inner products are
+    assumed to be conjugate symmetric, so saved tiles are reused in either
+    orientation.
+
+    Each processor/MPI worker saves the tiles it computes as separate files,
+    which are memory-mapped when they are read.  The cache is not cleared
+    when vectors change, but their keys, and so the inner products used,
+    change with them.  Delete the directory to clear it.
+    """
+    def __init__(self, cache_dir, inner_product_key=None):
+        self.cache_dir = cache_dir
+        self.inner_product_key = inner_product_key
+        self._blocks = {}
+
+
+    def _get_blocks(self, inner_product_key):
+        """Returns the blocks of ``inner_product_key``."""
+        if inner_product_key not in self._blocks:
+            self._blocks[inner_product_key] = _GramBlocks(
+                os.path.join(self.cache_dir, inner_product_key))
+        return self._blocks[inner_product_key]
+
+
+    def refresh(self, inner_product_key):
+        """Loads the inner products saved since the last refresh, e.g., by
+        other processors/MPI workers or runs."""
+        self._get_blocks(inner_product_key).refresh()
+
+
+    def find_IP_mat(self, inner_product_key, row_keys, col_keys):
+        """Returns the saved inner products of vectors.
+
+        Args:
+            ``inner_product_key``: String identifying the inner product.
+
+            ``row_keys``: List of the keys of the vectors of the rows.
+
+            ``col_keys``: List of the keys of the vectors of the cols.
+
+        Returns:
+            ``IP_mat``: 2D array of the saved inner products.  Elements that
+            were not saved are zero.
+
+            ``is_found``: 2D boolean array, True for elements that were saved.
+        """
+        return self._get_blocks(inner_product_key).find(row_keys, col_keys)
+
+
+    def save_IP_mat(self, inner_product_key, row_keys, col_keys, IP_mat):
+        """Saves inner products of vectors.  Rows and cols whose keys are None
+        are not saved.
+
+        Args:
+            ``inner_product_key``: String identifying the inner product.
+
+            ``row_keys``: List of the keys of the vectors of the rows.
+
+            ``col_keys``: List of the keys of the vectors of the cols.
+
+            ``IP_mat``: 2D array of inner products.
+        """
+        row_indices = [row_index for row_index, key in enumerate(row_keys)
+            if key is not None]
+        col_indices = [col_index for col_index, key in enumerate(col_keys)
+            if key is not None]
+        if len(row_indices) == 0 or len(col_indices) == 0:
+            return
+        self._get_blocks(inner_product_key).save(
+            np.asarray(IP_mat)[np.ix_(row_indices, col_indices)],
+            [row_keys[row_index] for row_index in row_indices],
+            [col_keys[col_index] for col_index in col_indices])
@@ -7,7 +7,7 @@ from future.builtins import object
 import numpy as np
 
 from . import util
-from .vectors import VecHandleInMemory
+from .vectors import VecHandleInMemory, find_vec_handle_costs
 from .vectorspace import *
 from . import parallel
 
@@ -25,7 +25,8 @@ def standard_basis(num_dims):
     return list(np.identity(num_dims))
 
 
-def compute_derivs_handles(vec_handles, adv_vec_handles, deriv_vec_handles, dt):
+def compute_derivs_handles(vec_handles, adv_vec_handles, deriv_vec_handles, dt,
+    weigh_tasks=False):
     """Computes 1st-order time derivatives of vector objects, using handles.
 
     Args:
@@ -40,6 +41,11 @@ def compute_derivs_handles(vec_handles, adv_vec_handles, deriv_vec_handles, dt):
         ``dt``: Time step, corresponding to time advanced between
         ``vec_handles`` and ``adv_vec_handles``
 
+    Kwargs:
+        ``weigh_tasks``: If True, the vectors are divided among
+        processors/MPI workers by the costs of their handles (see
+        :py:func:`vectors.find_vec_handle_costs`) instead of by number.
+
     Computes d(``vec``)/dt = ( ``vec``\(t=dt) -  ``vec``\(t=0) ) / dt.
     """
     num_vecs = len(vec_handles)
@@ -47,8 +53,15 @@ def compute_derivs_handles(vec_handles, adv_vec_handles, deriv_vec_handles, dt):
         num_vecs != len(deriv_vec_handles):
         raise RuntimeError('Number of vectors not equal')
 
-    vec_index_tasks = parallel.find_assignments(list(range(num_vecs)))[
-        parallel.get_rank()]
+    task_weights = None
+    if weigh_tasks:
+        costs = parallel.call_and_bcast(
+            find_vec_handle_costs, list(vec_handles) + list(adv_vec_handles))
+        if costs is not None:
+            task_weights = np.array(costs[:num_vecs]) + np.array(
+                costs[num_vecs:])
+    vec_index_tasks = parallel.find_assignments(list(range(num_vecs)),
+        task_weights=task_weights)[parallel.get_rank()]
 
     for i in vec_index_tasks:
         vec = vec_handles[i].get()
@@ -143,7 +156,8 @@ class LTIGalerkinProjectionMatrices(LTIGalerkinProjectionBase):
         Corresponds to :math:`W` in inner product :math:`v_1^* W v_2`.
 
         ``put_mat``: Function to put a matrix out of modred, e.g., write it to
-        file.
+        file.  Default is :py:func:`util.save_array_text`;
+        :py:func:`util.save_array_binary` is much faster for large matrices.
 
     This class projects discrete- or continuous-time dynamics onto a set of
     basis vectors, producing reduced-order models. For example, the basis
@@ -307,7 +321,10 @@ class LTIGalerkinProjectionHandles(LTIGalerkinProjectionBase):
         ``inner_product``: Function that computes inner product of two vector
         objects.
 
-        ``basis_vec_handles``: List of handles for basis vector objects.
+        ``basis_vec_handles``: List of handles for basis vector objects.  These
+        may be handles for modes that are only computed when they are
+        retrieved, e.g., from :py:meth:`pod.PODHandles.make_mode_handles`, so
+        that the modes need not be put first.
 
     Kwargs:
         ``adjoint_basis_vec_handles``: List of handles for adjoint basis vector
@@ -319,13 +336,23 @@ class LTIGalerkinProjectionHandles(LTIGalerkinProjectionBase):
         biorthonormal.  Default is ``False``.
 
         ``put_mat``: Function to put a matrix out of modred, e.g., write it to
-        file.
+        file.  Default is :py:func:`util.save_array_text`;
+        :py:func:`util.save_array_binary` is much faster for large matrices.
 
         ``max_vecs_per_node``: Maximum number of vectors that can be stored in
         memory, per node.
 
         ``verbosity``: 1 prints progress and warnings, 0 prints almost nothing.
 
+        ``inner_product_block``: Function that computes the matrix of inner
+        products of two lists of vector objects.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
+        ``max_bytes_per_node``: Maximum number of bytes of vectors that can be
+        stored in memory, per node, or ``'auto'``.  If given, it is used
+        instead of ``max_vecs_per_node``.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
     This class projects discrete- or continuous-time dynamics onto a set of
     basis vectors, producing reduced-order models. For example, the basis
     vectors could be POD, BPOD, or DMD modes.
@@ -342,7 +369,8 @@ class LTIGalerkinProjectionHandles(LTIGalerkinProjectionBase):
     def __init__(
         self, inner_product, basis_vec_handles, adjoint_basis_vec_handles=None,
         is_basis_orthonormal=False, put_mat=util.save_array_text, verbosity=1,
-        max_vecs_per_node=10000):
+        max_vecs_per_node=10000, inner_product_block=None,
+        max_bytes_per_node=None):
         """Constructor"""
         LTIGalerkinProjectionBase.__init__(self, is_basis_orthonormal,
             put_mat=put_mat)
@@ -359,7 +387,9 @@ class LTIGalerkinProjectionHandles(LTIGalerkinProjectionBase):
                 raise ValueError('Number of basis vecs is not equal to the '
                     'number of adjoint basis vecs')
         self.vec_space = VectorSpaceHandles(inner_product=inner_product,
-            max_vecs_per_node=max_vecs_per_node, verbosity=verbosity)
+            max_vecs_per_node=max_vecs_per_node, verbosity=verbosity,
+            inner_product_block=inner_product_block,
+            max_bytes_per_node=max_bytes_per_node)
 
 
     def reduce_A(self, A_on_basis_vec_handles):
@@ -5,6 +5,7 @@ from __future__ import absolute_import
 from future.builtins import range
 from future.builtins import object
 import socket
+import pickle
 
 import numpy as np
 
@@ -32,6 +33,19 @@ if _MPI_avail:
     # more scalable, see reductions.py for more details
     custom_comm = Intracomm(comm)
 
+    # Processors/MPI workers that share memory, i.e., are on the same node
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    _node_rank = node_comm.Get_rank()
+    _max_num_procs_per_node = comm.allreduce(
+        node_comm.Get_size(), op=MPI.MAX)
+
+    # Rank zero of each node, the "node leader", is in leader_comm, which
+    # links the nodes.  It is COMM_NULL on the other processors/MPI workers.
+    if _node_rank == 0:
+        leader_comm = comm.Split(0, comm.Get_rank())
+    else:
+        leader_comm = comm.Split(MPI.UNDEFINED, comm.Get_rank())
+
     # To adjust number of procs, use submission script/mpiexec
     _num_MPI_workers = comm.Get_size()
     _rank = comm.Get_rank()
@@ -43,9 +57,13 @@ else:
     _num_nodes = 1
     _num_MPI_workers = 1
     _rank = 0
+    _node_rank = 0
+    _max_num_procs_per_node = 1
     _is_distributed = False
     comm = None
     custom_comm = None
+    node_comm = None
+    leader_comm = None
 
 
 def get_hostname():
@@ -74,6 +92,16 @@ def get_rank():
     return _rank
 
 
+def get_node_rank():
+    """Returns rank of this processor/MPI worker among those on its node."""
+    return _node_rank
+
+
+def get_max_num_procs_per_node():
+    """Returns the largest number of processors/MPI workers on any node."""
+    return _max_num_procs_per_node
+
+
 def get_num_procs():
     """Returns number of processors (currently same as number of MPI
     workers)."""
@@ -154,6 +182,395 @@ def call_and_bcast(func, *args, **kwargs):
     return outputs
 
 
+def allreduce_min(value):
+    """Returns the minimum of a scalar ``value`` over all processors/MPI
+    workers."""
+    if _is_distributed:
+        return comm.allreduce(value, op=MPI.MIN)
+    return value
+
+
+def allreduce_max(value):
+    """Returns the maximum of a scalar ``value`` over all processors/MPI
+    workers."""
+    if _is_distributed:
+        return comm.allreduce(value, op=MPI.MAX)
+    return value
+
+
+def _find_buffer_layout(vecs):
+    """Returns a list of ``(shape, dtype, is_matrix)`` for ``vecs`` if all of
+    them are NumPy arrays (or matrices) of numeric data, which can be sent
+    as buffers.  Otherwise returns None."""
+    layout = []
+    for vec in vecs:
+        if type(vec) not in (np.ndarray, np.matrix) or vec.dtype.hasobject:
+            return None
+        layout.append((vec.shape, vec.dtype.str, type(vec) is np.matrix))
+    return layout
+
+
+def _make_empty_vecs(layout):
+    """Returns arrays to receive vecs with the buffer layout ``layout`` (see
+    :py:func:`_find_buffer_layout`)."""
+    return [np.empty(shape, dtype=dtype) for shape, dtype, is_matrix in layout]
+
+
+def _restore_matrices(vecs, layout):
+    """Returns ``vecs`` received as arrays, with those that were sent as
+    matrices viewed as matrices again."""
+    return [vec.view(np.matrix) if is_matrix else vec
+        for vec, (shape, dtype, is_matrix) in zip(vecs, layout)]
+
+
+class VecExchange(object):
+    """Sends a list of vectors and their indices to one processor/MPI worker
+    and receives another list from a second one, without blocking.
+
+    Args:
+        ``vecs``: List of vectors to send.
+
+        ``indices``: Indices of the vectors, sent with them.
+
+        ``dest``: Rank of the processor/MPI worker to send to.
+
+        ``source``: Rank of the processor/MPI worker to receive from.
+
+        ``send_tag``: Tag of the messages sent.
+
+        ``recv_tag``: Tag of the messages received.
+
+    Kwargs:
+        ``exchange_comm``: Communicator used, with ranks relative to it.
+        Default is all processors/MPI workers.
+
+    A small pickled header with the indices, the shapes and dtypes of the
+    vectors, and the size of the pickled vectors is sent first.  If the
+    vectors are NumPy arrays, their data is then sent directly from their
+    memory with ``Isend`` and received into preallocated arrays with
+    ``Irecv``, avoiding pickling and copies.  Other vector objects are
+    pickled, and the pickled bytes are sent and received the same way.  Call
+    :py:meth:`wait` to finish the exchange.
+
+    The constructor waits only for the header from ``source``, which is sent
+    eagerly as soon as ``source`` starts its side of the exchange, and then
+    posts the receives for the data.  The data is therefore transferred while
+    other work is done, until :py:meth:`wait`.
+
+    Usage::
+
+      exchange = parallel.VecExchange(vecs, indices, dest, source, tag, tag)
+      # ... other work ...
+      vecs, indices = exchange.wait()
+
+    """
+    def __init__(self, vecs, indices, dest, source, send_tag, recv_tag,
+        exchange_comm=None):
+        if exchange_comm is None:
+            exchange_comm = comm
+        self._comm = exchange_comm
+        layout = _find_buffer_layout(vecs)
+        if layout is None:
+            self._send_bufs = [np.frombuffer(
+                pickle.dumps(vecs, pickle.HIGHEST_PROTOCOL), dtype=np.uint8)]
+            num_pickled_bytes = self._send_bufs[0].size
+        else:
+            # Keep contiguous buffers alive until the sends are done
+            self._send_bufs = [np.ascontiguousarray(vec) for vec in vecs]
+            num_pickled_bytes = None
+        self._send_requests = [self._comm.isend(
+            (indices, layout, num_pickled_bytes), dest=dest, tag=send_tag)]
+        for buf in self._send_bufs:
+            self._send_requests.append(
+                self._comm.Isend(buf, dest=dest, tag=send_tag))
+
+        # The header is small, so wait for it, then post the receives for the
+        # data before returning.
+        self._recv_indices, self._recv_layout, num_pickled_bytes = \
+            self._comm.recv(source=source, tag=recv_tag)
+        if self._recv_layout is None:
+            self._recv_bufs = [np.empty(num_pickled_bytes, dtype=np.uint8)]
+        else:
+            self._recv_bufs = _make_empty_vecs(self._recv_layout)
+        self._recv_requests = [
+            self._comm.Irecv(buf, source=source, tag=recv_tag)
+            for buf in self._recv_bufs]
+
+
+    def wait(self):
+        """Waits for the exchange to finish.
+
+        Returns:
+            ``vecs``: List of vectors received.
+
+            ``indices``: Indices of the vectors received.
+        """
+        MPI.Request.Waitall(self._recv_requests + self._send_requests)
+        self._recv_requests = []
+        self._send_requests = []
+        self._send_bufs = []
+        if self._recv_layout is None:
+            vecs = pickle.loads(self._recv_bufs[0].tobytes())
+        else:
+            vecs = _restore_matrices(self._recv_bufs, self._recv_layout)
+        self._recv_bufs = []
+        return vecs, self._recv_indices
+
+
+def exchange_vecs(vecs, indices, dest, source, send_tag, recv_tag):
+    """Sends ``vecs`` and ``indices`` to ``dest`` and receives vectors and
+    indices from ``source``.  See :py:class:`VecExchange`.
+
+    Returns:
+        ``vecs``: List of vectors received.
+
+        ``indices``: Indices of the vectors received.
+    """
+    return VecExchange(
+        vecs, indices, dest, source, send_tag, recv_tag).wait()
+
+
+def circulate_vecs(vecs, indices, ring_comm=None):
+    """Passes vectors around a ring of all processors/MPI workers, from each
+    rank to rank + 1.
+
+    Args:
+        ``vecs``: List of vectors on this processor/MPI worker.
+
+        ``indices``: Indices of the vectors, passed with them.
+
+    Kwargs:
+        ``ring_comm``: Communicator whose processors/MPI workers form the
+        ring.  Default is all processors/MPI workers.
+
+    Yields:
+        ``vecs``, ``indices``: The vectors and indices of this processor/MPI
+        worker first, then those of rank - 1, rank - 2, etc., for a total of
+        one pass per processor/MPI worker.
+
+    The exchange for the next pass is started before the vectors of the
+    current pass are yielded, so communication overlaps with whatever is
+    computed from them.  Only neighbours communicate; there is no barrier.
+    Starting the exchange waits only for the small header sent by rank - 1
+    when it starts its own exchange, and then posts the receives for the
+    vectors of the next pass (see :py:class:`VecExchange`), so the transfer
+    of arrays, and of other vector objects once pickled, overlaps with the
+    current pass.  While a pass is used, the vectors of the next pass are
+    being received, so there are two sets of vectors in memory.  The yielded
+    vectors must not be modified, since they may still be being sent.
+    """
+    if ring_comm is None:
+        ring_comm = comm
+        rank = _rank
+        num_procs = get_num_procs()
+    else:
+        rank = ring_comm.Get_rank()
+        num_procs = ring_comm.Get_size()
+    dest = (rank + 1) % num_procs
+    source = (rank - 1) % num_procs
+
+    # Create unique tags based on send/recv ranks
+    send_tag = rank * (num_procs + 1) + dest
+    recv_tag = source * (num_procs + 1) + rank
+
+    for pass_index in range(num_procs):
+        if pass_index < num_procs - 1:
+            exchange = VecExchange(vecs, indices, dest, source, send_tag,
+                recv_tag, exchange_comm=ring_comm)
+        yield vecs, indices
+        if pass_index < num_procs - 1:
+            vecs, indices = exchange.wait()
+
+
+class TaskCounter(object):
+    """Counter shared by all processors/MPI workers, used to hand out tasks
+    on demand.
+
+    Each call to :py:meth:`next` returns a different integer, counting up
+    from zero over all processors/MPI workers.  In parallel, the counter is
+    stored on rank zero and incremented atomically with a one-sided MPI
+    operation, so rank zero does not need to take part.  The constructor and
+    :py:meth:`free` must be called by all processors/MPI workers.
+
+    Usage::
+
+      counter = parallel.TaskCounter()
+      task_index = counter.next()
+      while task_index < num_tasks:
+          do_task(task_index)
+          task_index = counter.next()
+      counter.free()
+
+    """
+    def __init__(self):
+        self._count = 0
+        self._win = None
+        if _is_distributed:
+            if is_rank_zero():
+                self._buf = np.zeros(1, dtype=np.int64)
+                self._win = MPI.Win.Create(self._buf,
+                    disp_unit=self._buf.itemsize, comm=comm)
+            else:
+                self._buf = None
+                self._win = MPI.Win.Create(None, comm=comm)
+            self._one = np.ones(1, dtype=np.int64)
+            self._result = np.zeros(1, dtype=np.int64)
+
+
+    def next(self):
+        """Returns the next value of the counter and increments it."""
+        if self._win is None:
+            self._count += 1
+            return self._count - 1
+        self._win.Lock(0, MPI.LOCK_SHARED)
+        self._win.Fetch_and_op(
+            [self._one, MPI.INT64_T], [self._result, MPI.INT64_T], 0, 0,
+            MPI.SUM)
+        self._win.Unlock(0)
+        return int(self._result[0])
+
+
+    def free(self):
+        """Frees the counter once all processors/MPI workers are done with
+        it."""
+        if self._win is not None:
+            self._win.Free()
+            self._win = None
+
+
+def dynamic_tasks(num_tasks):
+    """Hands out the indices of ``num_tasks`` tasks to processors/MPI workers
+    as they ask for them.
+
+    Args:
+        ``num_tasks``: Number of tasks.
+
+    Yields:
+        ``task_index``: Index of the next task this processor/MPI worker
+        should do.  Every index in ``range(num_tasks)`` is yielded on exactly
+        one processor/MPI worker.
+
+    Unlike :py:func:`find_assignments`, tasks are not divided up ahead of
+    time.  Processors/MPI workers that finish their tasks quickly take more of
+    them, which balances the work when tasks take unpredictable amounts of
+    time.  Must be called by all processors/MPI workers, and the generator
+    must be exhausted on all of them.
+    """
+    counter = TaskCounter()
+    task_index = counter.next()
+    while task_index < num_tasks:
+        yield task_index
+        task_index = counter.next()
+    counter.free()
+
+
+def _bcast_vecs(vecs, indices, root_comm):
+    """Broadcasts ``vecs`` and ``indices`` from rank zero of ``root_comm``.
+    Arrays are broadcast as buffers, other vectors are pickled.
+
+    Returns:
+        ``vecs``, ``indices``: The vectors and indices of rank zero.
+    """
+    if root_comm.Get_rank() == 0:
+        layout = _find_buffer_layout(vecs)
+    else:
+        layout = None
+    indices, layout = root_comm.bcast((indices, layout), root=0)
+    if layout is None:
+        return root_comm.bcast(vecs, root=0), indices
+    if root_comm.Get_rank() != 0:
+        vecs = _make_empty_vecs(layout)
+    for vec in vecs:
+        root_comm.Bcast(np.ascontiguousarray(vec) if root_comm.Get_rank() == 0
+            else vec, root=0)
+    return _restore_matrices(vecs, layout), indices
+
+
+def circulate_vecs_hierarchical(vecs, indices):
+    """Passes vectors among all processors/MPI workers, first within each
+    node, then between nodes.
+
+    Args:
+        ``vecs``: List of vectors on this processor/MPI worker.
+
+        ``indices``: Indices of the vectors, passed with them.
+
+    Yields:
+        ``vecs``, ``indices``: The vectors and indices of each processor/MPI
+        worker, once each, as :py:func:`circulate_vecs`.  Those of this node
+        come first.
+
+    The vectors first go around a ring of the processors/MPI workers on the
+    node, which communicate through shared memory.  Then rank zero of each
+    node, the "node leader", collects the vectors of its node and passes
+    them around a ring of node leaders, so each pair of neighbouring nodes
+    exchanges one message per pass instead of one per processor/MPI worker.
+    The leader broadcasts the vectors it receives within its node, one
+    processor's vectors at a time.  The next inter-node exchange is started
+    before the vectors received are used.
+
+    A node leader holds the vectors of two whole nodes at once, those being
+    used and those being received, so this needs more memory than
+    :py:func:`circulate_vecs` on the leaders.  The yielded vectors must not be
+    modified.
+    """
+    if not _is_distributed:
+        yield vecs, indices
+        return
+    for node_vecs, node_indices in circulate_vecs(
+        vecs, indices, ring_comm=node_comm):
+        yield node_vecs, node_indices
+    is_leader = _node_rank == 0
+    if is_leader:
+        num_nodes = leader_comm.Get_size()
+    else:
+        num_nodes = None
+    num_nodes = node_comm.bcast(num_nodes, root=0)
+    if num_nodes == 1:
+        return
+
+    # Node leaders collect the vecs of their nodes, flattened into one list
+    all_vecs = node_comm.gather(vecs, root=0)
+    all_indices = node_comm.gather(indices, root=0)
+    if is_leader:
+        node_vecs = [vec for proc_vecs in all_vecs for vec in proc_vecs]
+        node_indices = [(proc_indices, len(proc_vecs))
+            for proc_vecs, proc_indices in zip(all_vecs, all_indices)]
+        del all_vecs, all_indices
+        leader_rank = leader_comm.Get_rank()
+        dest = (leader_rank + 1) % num_nodes
+        source = (leader_rank - 1) % num_nodes
+        send_tag = leader_rank * (num_nodes + 1) + dest
+        recv_tag = source * (num_nodes + 1) + leader_rank
+
+        exchange = VecExchange(node_vecs, node_indices, dest, source,
+            send_tag, recv_tag, exchange_comm=leader_comm)
+
+    for node_pass_index in range(num_nodes - 1):
+        # The leader receives the vecs of the node before, and starts passing
+        # them on to the next node before they are used.
+        if is_leader:
+            node_vecs, node_indices = exchange.wait()
+            if node_pass_index < num_nodes - 2:
+                exchange = VecExchange(node_vecs, node_indices, dest, source,
+                    send_tag, recv_tag, exchange_comm=leader_comm)
+            num_procs_on_node = len(node_indices)
+        else:
+            num_procs_on_node = None
+        num_procs_on_node = node_comm.bcast(num_procs_on_node, root=0)
+
+        # Broadcast the vecs of each proc on the other node in turn
+        start_index = 0
+        for proc_index in range(num_procs_on_node):
+            if is_leader:
+                proc_indices, num_vecs = node_indices[proc_index]
+                proc_vecs = node_vecs[start_index:start_index + num_vecs]
+                start_index += num_vecs
+            else:
+                proc_vecs, proc_indices = [], None
+            yield _bcast_vecs(proc_vecs, proc_indices, node_comm)
+
+
 def find_assignments(tasks, task_weights=None):
     """Evenly distributes tasks among all processors/MPI workers using task
     weights.
@@ -165,48 +582,68 @@ def find_assignments(tasks, task_weights=None):
         processor/MPI worker which indices of an array to operate on.
 
     Kwargs:
-        ``task_weights``: List of weights for each task.  These are used to
-        equally distribute the workload among processors/MPI workers, in
-        case some tasks are more expensive than others.
+        ``task_weights``: List of non-negative weights for each task.  These
+        are used to equally distribute the workload among processors/MPI
+        workers, in case some tasks are more expensive than others.
 
     Returns:
         ``task_assignments``: 2D list of tasks, with indices corresponding
         to [rank][task_index].  Each processor/MPI worker is responsible
         for ``task_assignments[rank]``
-    """
-    task_assignments = []
 
+    Each processor/MPI worker gets consecutive tasks.  The cost is
+    :math:`O(n + p \\log n)` for :math:`n` tasks and :math:`p` processors/MPI
+    workers.
+    """
     # If no weights are given, assume each task has uniform weight
     if task_weights is None:
         task_weights = np.ones(len(tasks))
     else:
-        task_weights = np.array(task_weights)
-
+        task_weights = np.array(task_weights, dtype=float)
+    num_tasks = len(tasks)
+
+    # Each worker takes the tasks up to the one whose cumulative weight is
+    # closest to an equal share of the work that remains, and at least one
+    # task if any remain.  The cumulative weights are computed once, and the
+    # closest one is found with a binary search, since they are sorted.
+    cum_weights = np.cumsum(task_weights)
+    task_assignments = []
     first_unassigned_index = 0
-
     for worker_num in range(_num_MPI_workers):
-        # amount of work to do, float (scaled by weights)
-        work_remaining = sum(task_weights[first_unassigned_index:])
-
-        # Number of MPI workers whose jobs have not yet been assigned
-        num_remaining_workers = _num_MPI_workers - worker_num
-
-        # Distribute work load evenly across workers
-        work_per_worker = (1. * work_remaining) / num_remaining_workers
-
-        # If task list is not empty, compute assignments
-        if task_weights[first_unassigned_index:].size != 0:
-            # Index of tasks element which has sum(tasks[:ind])
-            # closest to work_per_worker
-            new_max_task_index = np.abs(np.cumsum(
-                task_weights[first_unassigned_index:]) -\
-                work_per_worker).argmin() + first_unassigned_index
-            # Append all tasks up to and including new_max_task_index
-            task_assignments.append(tasks[first_unassigned_index:\
-                new_max_task_index+1])
-            first_unassigned_index = new_max_task_index+1
-        else:
+        if first_unassigned_index >= num_tasks:
             task_assignments.append([])
+            continue
+        if first_unassigned_index > 0:
+            prev_cum_weight = cum_weights[first_unassigned_index - 1]
+        else:
+            prev_cum_weight = 0.
+        work_per_worker = (cum_weights[-1] - prev_cum_weight) / (
+            _num_MPI_workers - worker_num)
+        target_cum_weight = prev_cum_weight + work_per_worker
+
+        # First index at or above the target, and the first index of the run
+        # of equal cumulative weights just below it.  Ties go to the lower
+        # index.
+        upper_index = max(first_unassigned_index, int(np.searchsorted(
+            cum_weights, target_cum_weight, side='left')))
+        new_max_task_index = min(upper_index, num_tasks - 1)
+        if upper_index > first_unassigned_index:
+            lower_index = max(first_unassigned_index, int(np.searchsorted(
+                cum_weights, cum_weights[upper_index - 1], side='left')))
+            if upper_index == num_tasks or (
+                abs(cum_weights[lower_index] - target_cum_weight) <=
+                abs(cum_weights[upper_index] - target_cum_weight)):
+                new_max_task_index = lower_index
+
+        # The last worker takes any tasks that are left, including ones with
+        # no weight at the end of the list.
+        if worker_num == _num_MPI_workers - 1:
+            new_max_task_index = num_tasks - 1
+
+        # Append all tasks up to and including new_max_task_index
+        task_assignments.append(
+            tasks[first_unassigned_index:new_max_task_index + 1])
+        first_unassigned_index = new_max_task_index + 1
 
     return task_assignments
 
@@ -4,7 +4,8 @@ from future.builtins import object
 
 import numpy as np
 
-from .vectorspace import VectorSpaceMatrices, VectorSpaceHandles
+from .vectorspace import (
+    VectorSpaceMatrices, VectorSpaceHandles, make_mode_handles)
 from . import util
 from . import parallel
 
@@ -175,16 +176,28 @@ class PODHandles(object):
 
     Kwargs:
         ``put_mat``: Function to put a matrix out of modred, e.g., write it to
-        file.
+        file.  Default is :py:func:`util.save_array_text`;
+        :py:func:`util.save_array_binary` is much faster for large matrices.
 
       	``get_mat``: Function to get a matrix into modred, e.g., load it from
-        file.
+        file.  Default is :py:func:`util.load_array_text`; use
+        :py:func:`util.load_array_binary` for matrices put with
+        :py:func:`util.save_array_binary`.
 
         ``max_vecs_per_node``: Maximum number of vectors that can be stored in
         memory, per node.
 
         ``verbosity``: 1 prints progress and warnings, 0 prints almost nothing.
 
+        ``inner_product_block``: Function that computes the matrix of inner
+        products of two lists of vector objects.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
+        ``max_bytes_per_node``: Maximum number of bytes of vectors that can be
+        stored in memory, per node, or ``'auto'``.  If given, it is used
+        instead of ``max_vecs_per_node``.  See
+        :py:class:`vectorspace.VectorSpaceHandles`.
+
     Computes POD modes from vector objects (or handles).  Uses
     :py:class:`vectorspace.VectorSpaceHandles` for low level functions.
 
@@ -199,7 +212,8 @@ class PODHandles(object):
     """
     def __init__(
         self, inner_product, get_mat=util.load_array_text,
-        put_mat=util.save_array_text, max_vecs_per_node=None, verbosity=1):
+        put_mat=util.save_array_text, max_vecs_per_node=None, verbosity=1,
+        inner_product_block=None, max_bytes_per_node=None):
         self.get_mat = get_mat
         self.put_mat = put_mat
         self.verbosity = verbosity
@@ -208,7 +222,8 @@ class PODHandles(object):
 
         self.vec_space = VectorSpaceHandles(inner_product=inner_product,
             max_vecs_per_node=max_vecs_per_node,
-            verbosity=verbosity)
+            verbosity=verbosity, inner_product_block=inner_product_block,
+            max_bytes_per_node=max_bytes_per_node)
         self.vec_handles = None
         self.correlation_mat = None
 
@@ -302,13 +317,22 @@ class PODHandles(object):
           POD.correlation_mat = pre_existing_correlation_mat
           POD.compute_eigendecomp()
           POD.compute_modes(range(10), mode_handles, vec_handles=vec_handles)
+
+        A correlation matrix put with ``put_mat=util.save_array_binary`` can
+        be memory-mapped instead of loaded from text, so that it is read as
+        it is decomposed::
+
+          POD.correlation_mat = util.load_array_binary(
+              'correlation_mat.npy', mmap_mode='r')
+          POD.compute_eigendecomp()
         """
         self.eigvals, self.eigvecs = parallel.call_and_bcast(
             util.eigh, self.correlation_mat, atol=atol, rtol=rtol,
             is_positive_definite=True)
 
 
-    def compute_decomp(self, vec_handles, atol=1e-13, rtol=None):
+    def compute_decomp(
+        self, vec_handles, atol=1e-13, rtol=None, assembly='allreduce'):
         """Computes correlation matrix :math:`X^*WX` and its eigendecomposition.
 
         Args:
@@ -321,21 +345,78 @@ class PODHandles(object):
             ``rtol``: Maximum relative difference between largest and smallest
             eigenvalues of correlation matrix.  Smaller ones are truncated.
 
+            ``assembly``: How the inner product matrix is assembled.  With
+            ``'allreduce'`` (default), every processor/MPI worker gets the
+            full correlation matrix.  With ``'rank_zero'``, only rank zero does, and
+            the others store None, which avoids summing full matrices over all
+            processors/MPI workers.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.compute_inner_product_mat`.
+
         Returns:
             ``eigvals``: 1D array of eigenvalues of correlation matrix.
 
             ``eigvecs``: Matrix whose columns are eigenvectors of correlation
             matrix.
         """
+        if assembly not in ['allreduce', 'rank_zero']:
+            raise ValueError('Invalid assembly "%s", must be "allreduce" or '
+                '"rank_zero"'%assembly)
         self.vec_handles = vec_handles
         self.correlation_mat = (
             self.vec_space.compute_symmetric_inner_product_mat(
-            self.vec_handles))
+            self.vec_handles, assembly=assembly))
         self.compute_eigendecomp(atol=atol, rtol=rtol)
         return self.eigvals, self.eigvecs
 
 
-    def compute_modes(self, mode_indices, mode_handles, vec_handles=None):
+    def append_vecs(
+        self, new_vec_handles, atol=1e-13, rtol=None, assembly='allreduce'):
+        """Appends vector objects to those given to :py:meth:`compute_decomp`
+        and updates the correlation matrix and its eigendecomposition.
+
+        Args:
+            ``new_vec_handles``: List of handles for new vector objects.
+
+        Kwargs:
+            ``atol``: Level below which eigenvalues of correlation matrix are
+            truncated.
+
+            ``rtol``: Maximum relative difference between largest and smallest
+            eigenvalues of correlation matrix.  Smaller ones are truncated.
+
+            ``assembly``: How the new inner products are assembled.  Must be
+            the same as when :py:meth:`compute_decomp` was called.
+
+        Returns:
+            ``eigvals``: 1D array of eigenvalues of correlation matrix.
+
+            ``eigvecs``: Matrix whose columns are eigenvectors of correlation
+            matrix.
+
+        Only the inner products of the new vector objects with the old and new
+        ones are computed, so the cost of each call grows linearly with the
+        number of vector objects already stored, e.g., when snapshots are
+        appended as a simulation produces them.
+        """
+        if assembly not in ['allreduce', 'rank_zero']:
+            raise ValueError('Invalid assembly "%s", must be "allreduce" or '
+                '"rank_zero"'%assembly)
+        if self.vec_handles is None:
+            raise util.UndefinedError('Must call compute_decomp first')
+        new_vec_handles = list(util.make_iterable(new_vec_handles))
+        new_cols = self.vec_space.compute_inner_product_mat(
+            self.vec_handles, new_vec_handles, assembly=assembly)
+        new_block = self.vec_space.compute_symmetric_inner_product_mat(
+            new_vec_handles, assembly=assembly)
+        self.correlation_mat = util.extend_mat(
+            self.correlation_mat, new_cols, new_block)
+        self.vec_handles = list(self.vec_handles) + new_vec_handles
+        self.compute_eigendecomp(atol=atol, rtol=rtol)
+        return self.eigvals, self.eigvecs
+
+
+    def compute_modes(
+        self, mode_indices, mode_handles, vec_handles=None, resume=False):
         """Computes POD modes and calls ``put`` on them using mode handles.
 
         Args:
@@ -347,13 +428,49 @@ class PODHandles(object):
         Kwargs:
             ``vec_handles``: List of handles for vector objects. Optional if
             when calling :py:meth:`compute_decomp`.
+
+            ``resume``: If True, modes that were already put, e.g., by a run
+            that was killed, are not computed again.  See
+            :py:meth:`vectorspace.VectorSpaceHandles.lin_combine`.
         """
         if vec_handles is not None:
             self.vec_handles = util.make_iterable(vec_handles)
         build_coeff_mat = np.dot(self.eigvecs, np.diag(self.eigvals**-0.5))
         self.vec_space.lin_combine(
             mode_handles, self.vec_handles, build_coeff_mat,
-            coeff_mat_col_indices=mode_indices)
+            coeff_mat_col_indices=mode_indices, resume=resume)
+
+
+    def make_mode_handles(self, mode_indices, vec_handles=None,
+        mode_cache=None):
+        """Returns handles for POD modes that are only computed when they are
+        retrieved, instead of computing and putting the modes.
+
+        Args:
+            ``mode_indices``: List of indices describing which modes to make
+            handles for, e.g. ``range(10)`` or ``[3, 0, 5]``.
+
+        Kwargs:
+            ``vec_handles``: List of handles for vector objects. Optional if
+            given when calling :py:meth:`compute_decomp`.
+
+            ``mode_cache``: :py:class:`vectorspace.ModeCache` in which modes
+            are kept once they are computed.  Default is None, for which the
+            cache shared by default is used (see
+            :py:func:`vectorspace.make_mode_handles`).
+
+        Returns:
+            ``mode_handles``: List of :py:class:`vectorspace.ModeHandle`
+            objects, whose ``get`` computes a mode from the vector objects
+            (see :py:func:`vectorspace.make_mode_handles`).
+        """
+        if vec_handles is not None:
+            self.vec_handles = util.make_iterable(vec_handles)
+        if self.vec_handles is None:
+            raise util.UndefinedError('vec_handles undefined')
+        build_coeff_mat = np.dot(self.eigvecs, np.diag(self.eigvals**-0.5))
+        return make_mode_handles(self.vec_handles, build_coeff_mat,
+            coeff_mat_col_indices=mode_indices, mode_cache=mode_cache)
 
 
     def compute_proj_coeffs(self):
@@ -366,3 +483,32 @@ class PODHandles(object):
         """
         self.proj_coeffs = np.mat(np.diag(self.eigvals ** 0.5)) * self.eigvecs.H
         return self.proj_coeffs
+
+
+    def compute_proj_coeffs_of(self, new_vec_handles):
+        """Computes orthogonal projection of new vector objects onto POD
+        modes, without computing the modes.
+
+        Args:
+            ``new_vec_handles``: List of handles for new vector objects.
+
+        Returns:
+            ``proj_coeffs``: Matrix of projection coefficients for new vector
+            objects, expressed as a linear combination of POD modes.  Columns
+            correspond to new vector objects, rows correspond to POD modes.
+
+        The modes are linear combinations of the vector objects, so the
+        coefficients are found from the inner products of the vector objects
+        with the new vector objects (see
+        :py:meth:`vectorspace.VectorSpaceHandles.compute_inner_product_mat`).
+        The modes are never computed or retrieved, so this also works before
+        :py:meth:`compute_modes` is called.
+        """
+        if self.vec_handles is None:
+            raise util.UndefinedError('vec_handles undefined')
+        new_vec_handles = util.make_iterable(new_vec_handles)
+        IP_mat = self.vec_space.compute_inner_product_mat(
+            self.vec_handles, new_vec_handles)
+        return (
+            np.mat(np.diag(self.eigvals ** -0.5)) * self.eigvecs.H *
+            np.mat(IP_mat))
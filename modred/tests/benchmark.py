@@ -32,8 +32,15 @@ parser.add_argument(
     '--function',
     choices=['lin_combine', 'inner_product_mat', 'symmetric_inner_product_mat'],
     help='Function to benchmark.')
+parser.add_argument(
+    '--trace', default=None,
+    help='File in which to save a Chrome trace of the phases of the function.')
 args = parser.parse_args()
 data_dir = args.outdir
+if args.trace is not None:
+    tracer = mr.Tracer()
+else:
+    tracer = None
 
 #if data_dir[-1] != '/':
 #    join(data_dir, = '/'
@@ -80,7 +87,8 @@ def inner_product_mat(
     generate_vecs(data_dir, num_states, row_vec_handles+col_vec_handles)
 
     my_VS = mr.VectorSpaceHandles(
-        np.vdot, max_vecs_per_node=max_vecs_per_node, verbosity=verbosity)
+        np.vdot, max_vecs_per_node=max_vecs_per_node, verbosity=verbosity,
+        tracer=tracer)
 
     prof = cProfile.Profile()
     start_time = T.time()
@@ -103,7 +111,8 @@ def symmetric_inner_product_mat(
     generate_vecs(data_dir, num_states, vec_handles)
 
     my_VS = mr.VectorSpaceHandles(
-        np.vdot, max_vecs_per_node=max_vecs_per_node, verbosity=verbosity)
+        np.vdot, max_vecs_per_node=max_vecs_per_node, verbosity=verbosity,
+        tracer=tracer)
 
     prof = cProfile.Profile()
     start_time = T.time()
@@ -131,7 +140,7 @@ def lin_combine(
 
     generate_vecs(data_dir, num_states, basis_handles)
     my_VS = mr.VectorSpaceHandles(np.vdot, max_vecs_per_node=max_vecs_per_node,
-        verbosity=verbosity)
+        verbosity=verbosity, tracer=tracer)
     coeff_mat = np.random.random((num_bases, num_products))
     mr.parallel.barrier()
 
@@ -186,6 +195,8 @@ def main():
         print('lin_combine, inner_product_mat, and symmetric_inner_product_mat')
     #print 'Time for %s is %f'%(method_to_test, time_elapsed)
 
+    if tracer is not None:
+        tracer.save_chrome_trace(args.trace)
     mr.parallel.barrier()
     clean_up()
 
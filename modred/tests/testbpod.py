@@ -339,6 +339,24 @@ class TestBPODHandles(unittest.TestCase):
                 else:
                     self.assertAlmostEqual(IP, 1., places=5)
 
+        # Compute direct and adjoint modes together
+        direct_mode_handles = [V.VecHandleArrayText(
+            join(self.test_dir, 'direct_mode_both_%03d.txt')%i)
+            for i in self.mode_nums]
+        adjoint_mode_handles = [V.VecHandleArrayText(
+            join(self.test_dir, 'adjoint_mode_both_%03d.txt')%i)
+            for i in self.mode_nums]
+        self.my_BPOD.compute_direct_and_adjoint_modes(self.mode_nums,
+            direct_mode_handles, adjoint_mode_handles)
+        for mode_index, (direct_handle, adjoint_handle) in enumerate(
+            zip(direct_mode_handles, adjoint_mode_handles)):
+            np.testing.assert_allclose(direct_handle.get(),
+                self.direct_mode_array[:,self.mode_nums[mode_index]],
+                atol=atol)
+            np.testing.assert_allclose(adjoint_handle.get(),
+                self.adjoint_mode_array[:,self.mode_nums[mode_index]],
+                atol=atol)
+
 
     def test_compute_proj_coeffs(self):
         # Tests fail if tolerance is too tight, likely due to random nature of
@@ -390,5 +408,46 @@ class TestBPODHandles(unittest.TestCase):
             adj_proj_coeffs, adj_proj_coeffs_true, rtol=rtol, atol=atol)
 
 
+    def test_compute_proj_coeffs_of(self):
+        rtol = 1e-8
+        atol = 1e-10
+
+        # Projecting the direct and adjoint vecs themselves, without modes,
+        # gives the same coefficients as projecting them onto the modes.
+        self.my_BPOD.R_sing_vecs = self.R_sing_vecs_true
+        self.my_BPOD.L_sing_vecs = self.L_sing_vecs_true
+        self.my_BPOD.sing_vals = self.sing_vals_true
+        self.my_BPOD.direct_vec_handles = self.direct_vec_handles
+        self.my_BPOD.adjoint_vec_handles = self.adjoint_vec_handles
+        new_vec_array = parallel.call_and_bcast(np.random.random,
+            (self.num_states, 2))
+        new_vec_handles = [V.VecHandleInMemory(new_vec_array[:, i:i + 1])
+            for i in range(new_vec_array.shape[1])]
+        np.testing.assert_allclose(
+            self.my_BPOD.compute_proj_coeffs_of(new_vec_handles),
+            self.adjoint_mode_array.H * new_vec_array, rtol=rtol, atol=atol)
+        np.testing.assert_allclose(
+            self.my_BPOD.compute_adjoint_proj_coeffs_of(new_vec_handles),
+            self.direct_mode_array.H * new_vec_array, rtol=rtol, atol=atol)
+
+
+    def test_make_mode_handles(self):
+        atol = 1e-5
+        self.my_BPOD.R_sing_vecs = self.R_sing_vecs_true
+        self.my_BPOD.L_sing_vecs = self.L_sing_vecs_true
+        self.my_BPOD.sing_vals = self.sing_vals_true
+        direct_mode_handles = self.my_BPOD.make_direct_mode_handles(
+            self.mode_nums, direct_vec_handles=self.direct_vec_handles)
+        adjoint_mode_handles = self.my_BPOD.make_adjoint_mode_handles(
+            self.mode_nums, adjoint_vec_handles=self.adjoint_vec_handles)
+        for mode_index, mode_num in enumerate(self.mode_nums):
+            np.testing.assert_allclose(
+                direct_mode_handles[mode_index].get(),
+                self.direct_mode_array[:, mode_num], atol=atol)
+            np.testing.assert_allclose(
+                adjoint_mode_handles[mode_index].get(),
+                self.adjoint_mode_array[:, mode_num], atol=atol)
+
+
 if __name__ == '__main__':
     unittest.main()
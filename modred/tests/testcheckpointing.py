@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Test the checkpointing module"""
+from __future__ import division
+import unittest
+import os
+from os.path import join
+from shutil import rmtree
+
+import numpy as np
+
+import modred.parallel as parallel
+from modred.checkpointing import IPMatCheckpoint
+from modred.vectorspace import DistributedMatrix
+
+
+class TestIPMatCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'DELETE_ME_test_files_checkpointing'
+        if not os.access('.', os.W_OK):
+            raise RuntimeError('Cannot write to current directory')
+        if not os.path.isdir(self.test_dir) and parallel.is_rank_zero():
+            os.mkdir(self.test_dir)
+        parallel.barrier()
+
+
+    def tearDown(self):
+        parallel.barrier()
+        parallel.call_from_rank_zero(rmtree, self.test_dir, ignore_errors=True)
+        parallel.barrier()
+
+
+    @unittest.skipIf(parallel.is_distributed(), 'Serial only')
+    def test_save_and_restore(self):
+        """Test saving blocks and restoring tiles of other shapes."""
+        checkpoint_dir = join(self.test_dir, 'checkpoint')
+        mat = np.arange(20.).reshape(4, 5)
+        vec_keys = (['a', 'b', 'c', 'd'], ['e', 'f', 'g', 'h', 'i'])
+        IP_mat = DistributedMatrix(mat.shape)
+        checkpoint = IPMatCheckpoint(checkpoint_dir, 'IP_mat', IP_mat, 0.,
+            vec_keys)
+        self.assertFalse(checkpoint.has_saved_blocks())
+        IP_mat.add_block(0, 0, mat[:2, :3])
+        checkpoint.save(IP_mat)
+        IP_mat.add_block(0, 3, mat[:2, 3:])
+        checkpoint.save(IP_mat)
+
+        # Only the new blocks are written by each save
+        self.assertEqual(len(checkpoint.file_names), 2)
+        with np.load(join(checkpoint_dir, checkpoint.file_names[1])) as saved:
+            np.testing.assert_equal(saved['positions'], [[0, 3]])
+
+        # Tiles are restored if all of their elements were saved, whatever
+        # the tiles that were saved.  The matrix is not complete.
+        IP_mat = DistributedMatrix(mat.shape)
+        checkpoint = IPMatCheckpoint(checkpoint_dir, 'IP_mat', IP_mat, 0.,
+            vec_keys)
+        self.assertTrue(checkpoint.has_saved_blocks())
+        self.assertFalse(checkpoint.restore_all(IP_mat))
+        self.assertTrue(checkpoint.restore(IP_mat, 1, 1, 1, 4))
+        self.assertFalse(checkpoint.restore(IP_mat, 1, 1, 2, 2))
+        self.assertTrue(checkpoint.restore(IP_mat, 2, 0, 2, 2,
+            transpose=True))
+        np.testing.assert_equal(IP_mat.blocks[0][2], mat[1:2, 1:])
+        np.testing.assert_equal(IP_mat.blocks[1][:2], (0, 2))
+        np.testing.assert_equal(IP_mat.blocks[1][2], mat[:2, 2:4])
+
+        # Restored blocks are not saved again, and the complete matrix is
+        # restored by a later run.
+        IP_mat.add_block(2, 0, mat[2:])
+        checkpoint.save(IP_mat, is_complete=True)
+        self.assertEqual(len(checkpoint.file_names), 3)
+        IP_mat = DistributedMatrix(mat.shape)
+        checkpoint = IPMatCheckpoint(checkpoint_dir, 'IP_mat', IP_mat, 0.,
+            vec_keys)
+        self.assertTrue(checkpoint.restore_all(IP_mat))
+        np.testing.assert_equal(IP_mat.allreduce(), mat)
+
+        # Checkpoints of other vecs or matrices are rejected
+        self.assertRaises(ValueError, IPMatCheckpoint, checkpoint_dir,
+            'IP_mat', DistributedMatrix(mat.shape), 0.,
+            (vec_keys[0], vec_keys[1][::-1]))
+        self.assertRaises(ValueError, IPMatCheckpoint, checkpoint_dir,
+            'IP_mat', DistributedMatrix((4, 4)), 0., vec_keys)
+
+
+    @unittest.skipIf(parallel.is_distributed(), 'Serial only')
+    def test_symmetric(self):
+        """Test that tiles of symmetric matrices are restored from elements
+        saved on either side of the diagonal."""
+        checkpoint_dir = join(self.test_dir, 'checkpoint')
+        mat = np.arange(16.).reshape(4, 4)
+        mat = mat + mat.T
+        IP_mat = DistributedMatrix(mat.shape, is_symmetric=True)
+        checkpoint = IPMatCheckpoint(checkpoint_dir, 'IP_mat', IP_mat, 0.,
+            None)
+        IP_mat.add_block(0, 0, np.triu(mat[:2, :2]))
+        IP_mat.add_block(0, 2, mat[:2, 2:])
+        checkpoint.save(IP_mat)
+
+        IP_mat = DistributedMatrix(mat.shape, is_symmetric=True)
+        checkpoint = IPMatCheckpoint(checkpoint_dir, 'IP_mat', IP_mat, 0.,
+            None)
+        self.assertTrue(checkpoint.restore(IP_mat, 2, 0, 2, 2))
+        np.testing.assert_equal(IP_mat.blocks[0][2], mat[2:, :2])
+        self.assertTrue(checkpoint.restore(IP_mat, 0, 0, 2, 2))
+        np.testing.assert_equal(IP_mat.blocks[1][2], np.triu(mat[:2, :2]))
+        self.assertFalse(checkpoint.restore(IP_mat, 1, 1, 2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
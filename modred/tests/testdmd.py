@@ -606,11 +606,67 @@ class TestDMDHandles(unittest.TestCase):
             self.vec_handles, self.adv_vec_handles[:-1])
 
 
+    #@unittest.skip('Testing something else.')
+    def test_append_vecs(self):
+        """Test updating the decomposition with new vecs."""
+        rtol = 1e-10
+        atol = 1e-12
+        max_num_eigvals = int(np.round(self.num_vecs / 2))
+        vec_array = parallel.call_and_bcast(np.random.random,
+            ((self.num_states, self.num_vecs)))
+        adv_vec_array = parallel.call_and_bcast(np.random.random,
+            ((self.num_states, self.num_vecs)))
+        if parallel.is_rank_zero():
+            for vec_index, handle in enumerate(self.vec_handles):
+                handle.put(np.array(vec_array[:, vec_index]).squeeze())
+            for vec_index, handle in enumerate(self.adv_vec_handles):
+                handle.put(np.array(adv_vec_array[:, vec_index]).squeeze())
+        parallel.barrier()
+        self.assertRaises(
+            util.UndefinedError, self.my_DMD.append_vecs, self.vec_handles)
+
+        # Compare with decompositions of all of the vecs at once, for
+        # sequential and non-sequential datasets
+        for adv_vec_handles in [None, self.adv_vec_handles]:
+            DMD_true = type(self.my_DMD)(np.vdot, verbosity=0)
+            outputs_true = DMD_true.compute_decomp(
+                self.vec_handles, adv_vec_handles=adv_vec_handles,
+                max_num_eigvals=max_num_eigvals)
+            my_DMD = type(self.my_DMD)(np.vdot, verbosity=0)
+            if adv_vec_handles is None:
+                my_DMD.compute_decomp(self.vec_handles[:4])
+                self.assertRaises(ValueError, my_DMD.append_vecs,
+                    self.vec_handles[4:], self.adv_vec_handles[4:])
+                my_DMD.append_vecs(self.vec_handles[4:7])
+                outputs = my_DMD.append_vecs(self.vec_handles[7:],
+                    max_num_eigvals=max_num_eigvals)
+            else:
+                my_DMD.compute_decomp(
+                    self.vec_handles[:4], adv_vec_handles[:4])
+                self.assertRaises(
+                    ValueError, my_DMD.append_vecs, self.vec_handles[4:])
+                my_DMD.append_vecs(
+                    self.vec_handles[4:7], adv_vec_handles[4:7])
+                outputs = my_DMD.append_vecs(
+                    self.vec_handles[7:], adv_vec_handles[7:],
+                    max_num_eigvals=max_num_eigvals)
+                self.assertEqual(my_DMD.adv_vec_handles, adv_vec_handles)
+            self.assertEqual(my_DMD.vec_handles, self.vec_handles)
+            np.testing.assert_allclose(my_DMD.correlation_mat,
+                DMD_true.correlation_mat, rtol=rtol, atol=atol)
+            np.testing.assert_allclose(my_DMD.cross_correlation_mat,
+                DMD_true.cross_correlation_mat, rtol=rtol, atol=atol)
+            for output, output_true in zip(outputs, outputs_true):
+                np.testing.assert_allclose(
+                    np.abs(output), np.abs(output_true), rtol=rtol, atol=atol)
+
+
     #@unittest.skip('Testing something else.')
     def test_compute_modes(self):
         """Test building of modes."""
         # Generate path names for saving modes to disk
         mode_path = join(self.test_dir, 'dmd_mode_%03d.pkl')
+        proj_mode_path = join(self.test_dir, 'dmd_proj_mode_%03d.pkl')
 
         ### SEQUENTIAL DATASET ###
         # Generate data
@@ -660,6 +716,28 @@ class TestDMDHandles(unittest.TestCase):
             [V.VecHandlePickle(path) for path in seq_mode_path_list])
         self._helper_check_modes(modes_proj, seq_mode_path_list)
 
+        # Compute exact and projected modes together
+        seq_proj_mode_path_list = [
+            proj_mode_path % i for i in range(eigvals.size)]
+        self.my_DMD.compute_exact_and_proj_modes(seq_mode_indices,
+            [V.VecHandlePickle(path) for path in seq_mode_path_list],
+            [V.VecHandlePickle(path) for path in seq_proj_mode_path_list])
+        self._helper_check_modes(modes_exact, seq_mode_path_list)
+        self._helper_check_modes(modes_proj, seq_proj_mode_path_list)
+
+        # Make handles for modes that are computed when they are retrieved
+        exact_mode_handles = self.my_DMD.make_exact_mode_handles(
+            seq_mode_indices)
+        proj_mode_handles = self.my_DMD.make_proj_mode_handles(
+            seq_mode_indices)
+        for mode_index in seq_mode_indices:
+            np.testing.assert_allclose(
+                exact_mode_handles[mode_index].get(),
+                np.array(modes_exact)[:, mode_index], rtol=1e-10, atol=1e-12)
+            np.testing.assert_allclose(
+                proj_mode_handles[mode_index].get(),
+                np.array(modes_proj)[:, mode_index], rtol=1e-10, atol=1e-12)
+
         # For exact modes, also compute by setting adv_vec_handles
         self.my_DMD.vec_handles = None
         self.my_DMD.adv_vec_handles = self.vec_handles[1:]
@@ -721,6 +799,15 @@ class TestDMDHandles(unittest.TestCase):
             [V.VecHandlePickle(path) for path in mode_path_list])
         self._helper_check_modes(modes_proj, mode_path_list)
 
+        # Compute exact and projected modes together
+        proj_mode_path_list = [
+            proj_mode_path % i for i in range(eigvals.size)]
+        self.my_DMD.compute_exact_and_proj_modes(mode_indices,
+            [V.VecHandlePickle(path) for path in mode_path_list],
+            [V.VecHandlePickle(path) for path in proj_mode_path_list])
+        self._helper_check_modes(modes_exact, mode_path_list)
+        self._helper_check_modes(modes_proj, proj_mode_path_list)
+
 
     #@unittest.skip('Testing something else.')
     def test_compute_spectrum(self):
@@ -856,6 +943,13 @@ class TestDMDHandles(unittest.TestCase):
         np.testing.assert_allclose(
             adv_proj_coeffs, adv_proj_coeffs_true, rtol=rtol, atol=atol)
 
+        # Project the advanced vecs from their handles, without computing
+        # modes.
+        self.my_DMD.vec_handles = self.vec_handles
+        np.testing.assert_allclose(
+            self.my_DMD.compute_proj_coeffs_of(self.adv_vec_handles),
+            adv_proj_coeffs_true, rtol=rtol, atol=atol)
+
 
 #@unittest.skip('Testing something else.')
 @unittest.skipIf(parallel.is_distributed(), 'Serial only.')
@@ -1567,6 +1661,60 @@ class TestTLSqrDMDHandles(unittest.TestCase):
             self.vec_handles, self.adv_vec_handles[:-1])
 
 
+    #@unittest.skip('Testing something else.')
+    def test_append_vecs(self):
+        """Test updating the decomposition with new vecs."""
+        rtol = 1e-10
+        atol = 1e-12
+        vec_array = parallel.call_and_bcast(np.random.random,
+            ((self.num_states, self.num_vecs)))
+        adv_vec_array = parallel.call_and_bcast(np.random.random,
+            ((self.num_states, self.num_vecs)))
+        if parallel.is_rank_zero():
+            for vec_index, handle in enumerate(self.vec_handles):
+                handle.put(np.array(vec_array[:, vec_index]).squeeze())
+            for vec_index, handle in enumerate(self.adv_vec_handles):
+                handle.put(np.array(adv_vec_array[:, vec_index]).squeeze())
+        parallel.barrier()
+        self.assertRaises(
+            util.UndefinedError, self.my_DMD.append_vecs, self.vec_handles)
+
+        # Compare with decompositions of all of the vecs at once, for
+        # sequential and non-sequential datasets
+        for adv_vec_handles in [None, self.adv_vec_handles]:
+            DMD_true = type(self.my_DMD)(np.vdot, verbosity=0)
+            outputs_true = DMD_true.compute_decomp(
+                self.vec_handles, adv_vec_handles=adv_vec_handles,
+                max_num_eigvals=self.max_num_eigvals)
+            my_DMD = type(self.my_DMD)(np.vdot, verbosity=0)
+            if adv_vec_handles is None:
+                my_DMD.compute_decomp(self.vec_handles[:4])
+                self.assertRaises(ValueError, my_DMD.append_vecs,
+                    self.vec_handles[4:], self.adv_vec_handles[4:])
+                my_DMD.append_vecs(self.vec_handles[4:7])
+                outputs = my_DMD.append_vecs(self.vec_handles[7:],
+                    max_num_eigvals=self.max_num_eigvals)
+            else:
+                my_DMD.compute_decomp(
+                    self.vec_handles[:4], adv_vec_handles[:4])
+                self.assertRaises(
+                    ValueError, my_DMD.append_vecs, self.vec_handles[4:])
+                my_DMD.append_vecs(
+                    self.vec_handles[4:7], adv_vec_handles[4:7])
+                outputs = my_DMD.append_vecs(
+                    self.vec_handles[7:], adv_vec_handles[7:],
+                    max_num_eigvals=self.max_num_eigvals)
+                self.assertEqual(my_DMD.adv_vec_handles, adv_vec_handles)
+            self.assertEqual(my_DMD.vec_handles, self.vec_handles)
+            np.testing.assert_allclose(my_DMD.correlation_mat,
+                DMD_true.correlation_mat, rtol=rtol, atol=atol)
+            np.testing.assert_allclose(my_DMD.cross_correlation_mat,
+                DMD_true.cross_correlation_mat, rtol=rtol, atol=atol)
+            for output, output_true in zip(outputs, outputs_true):
+                np.testing.assert_allclose(
+                    np.abs(output), np.abs(output_true), rtol=rtol, atol=atol)
+
+
     #@unittest.skip('Testing something else.')
     def test_compute_modes(self):
         """Test building of modes."""
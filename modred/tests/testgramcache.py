@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""Test the gramcache module"""
+from __future__ import division
+import unittest
+import os
+from os.path import join
+from shutil import rmtree
+
+import numpy as np
+
+import modred.parallel as parallel
+from modred.gramcache import GramCache, find_inner_product_key
+from modred.tracing import Tracer
+from modred.vectorspace import VectorSpaceHandles
+from modred import vectors as V
+
+
+class TestGramCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'DELETE_ME_test_files_gramcache'
+        if not os.access('.', os.W_OK):
+            raise RuntimeError('Cannot write to current directory')
+        if not os.path.isdir(self.test_dir) and parallel.is_rank_zero():
+            os.mkdir(self.test_dir)
+        parallel.barrier()
+
+
+    def tearDown(self):
+        parallel.barrier()
+        parallel.call_from_rank_zero(rmtree, self.test_dir, ignore_errors=True)
+        parallel.barrier()
+
+
+    @unittest.skipIf(parallel.is_distributed(), 'Serial only')
+    def test_find_and_save(self):
+        """Test saving inner products and finding them again."""
+        cache_dir = join(self.test_dir, 'cache')
+        IP_mat = np.array([[1., 2., 3.], [4., 5., 6.]]) * (1 + 1j)
+        gram_cache = GramCache(cache_dir)
+        gram_cache.save_IP_mat('ip', ['a', 'b'], ['c', None, 'e'], IP_mat)
+
+        # Rows and cols are found in any order, and in either orientation.
+        # Other processes or runs find them once they refresh.
+        for gram_cache in [gram_cache, GramCache(cache_dir)]:
+            gram_cache.refresh('ip')
+            found_IP_mat, is_found = gram_cache.find_IP_mat(
+                'ip', ['b', None, 'a'], ['e', 'd', 'c'])
+            np.testing.assert_equal(is_found,
+                [[True, False, True], [False] * 3, [True, False, True]])
+            np.testing.assert_equal(found_IP_mat[is_found],
+                [IP_mat[1, 2], IP_mat[1, 0], IP_mat[0, 2], IP_mat[0, 0]])
+            found_IP_mat, is_found = gram_cache.find_IP_mat(
+                'ip', ['e'], ['a', 'b'])
+            self.assertTrue(is_found.all())
+            np.testing.assert_equal(found_IP_mat, IP_mat[:, [2]].conj().T)
+
+            # Inner products are kept separately for each inner product
+            self.assertFalse(gram_cache.find_IP_mat(
+                'other_ip', ['a'], ['c'])[1].any())
+
+
+    def test_find_inner_product_key(self):
+        """Test identifying inner products."""
+        self.assertEqual(find_inner_product_key(np.vdot),
+            find_inner_product_key(np.vdot))
+        self.assertNotEqual(find_inner_product_key(np.vdot),
+            find_inner_product_key(np.dot))
+        self.assertNotEqual(
+            find_inner_product_key(V.InnerProductTrapz(np.arange(3.))),
+            find_inner_product_key(V.InnerProductTrapz(np.arange(4.))))
+        self.assertRaises(ValueError, find_inner_product_key,
+            lambda vec1, vec2: np.vdot(vec1, vec2))
+
+
+    def test_vector_space(self):
+        """Test that vector space operations reuse saved inner products."""
+        num_states = 5
+        num_vecs = 7
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        vec_handles = [V.VecHandlePickle(join(self.test_dir, 'vec_%d.pkl'%i))
+            for i in range(num_vecs)]
+        if parallel.is_rank_zero():
+            for vec_index, vec_handle in enumerate(vec_handles):
+                vec_handle.put(vec_array[:, vec_index])
+        parallel.barrier()
+        for schedule in ['static', 'dynamic']:
+            cache_dir = join(self.test_dir, 'cache_%s'%schedule)
+
+            def compute(operation, *args):
+                tracer = Tracer()
+                my_VS = VectorSpaceHandles(inner_product=np.vdot,
+                    max_vecs_per_node=3 * parallel.get_num_procs(),
+                    schedule=schedule, tracer=tracer, verbosity=0,
+                    gram_cache=GramCache(cache_dir))
+                IP_mat = getattr(my_VS, operation)(*args)
+                return IP_mat, tracer.summarize()
+
+            IP_mat_true = np.dot(vec_array.T, vec_array)
+            IP_mat, summary = compute(
+                'compute_symmetric_inner_product_mat', vec_handles[:5])
+            np.testing.assert_allclose(IP_mat, IP_mat_true[:5, :5])
+            self.assertIn('inner_product', summary)
+
+            # All of the inner products were saved, so none are computed and
+            # no vecs are retrieved for them.
+            for args in [('compute_symmetric_inner_product_mat',
+                vec_handles[:4]), ('compute_inner_product_mat',
+                vec_handles[3:5], vec_handles[:4])]:
+                IP_mat, summary = compute(*args)
+                self.assertNotIn('inner_product', summary)
+                self.assertNotIn('get', summary)
+            np.testing.assert_allclose(IP_mat, IP_mat_true[3:5, :4])
+
+            # Only the inner products with new vecs are computed, after
+            # which all of them are saved.
+            IP_mat, summary = compute(
+                'compute_inner_product_mat', vec_handles, vec_handles[3:])
+            np.testing.assert_allclose(IP_mat, IP_mat_true[:, 3:])
+            IP_mat, summary = compute(
+                'compute_symmetric_inner_product_mat', vec_handles)
+            np.testing.assert_allclose(IP_mat, IP_mat_true)
+            self.assertNotIn('inner_product', summary)
+
+        # When a vec changes, its inner products are computed again
+        parallel.barrier()
+        if parallel.is_rank_zero():
+            vec_handles[0].put(np.append(vec_array[:-1, 0], 100.))
+        parallel.barrier()
+        vec_array[-1, 0] = 100.
+        IP_mat, summary = compute(
+            'compute_symmetric_inner_product_mat', vec_handles)
+        np.testing.assert_allclose(IP_mat, np.dot(vec_array.T, vec_array))
+
+
+
+    def test_checkpoint(self):
+        """Test that matrices restored from the cache are numbered for
+        checkpoints, and that checkpoints of other vecs are not used."""
+        num_states = 5
+        num_vecs = 4
+        vec_arrays = parallel.call_and_bcast(np.random.random,
+            (2, num_states, num_vecs))
+        vec_handles = [[V.VecHandlePickle(join(
+            self.test_dir, 'vec_%d_%d.pkl'%(set_index, vec_index)))
+            for vec_index in range(num_vecs)] for set_index in range(2)]
+        if parallel.is_rank_zero():
+            for set_index in range(2):
+                for vec_index in range(num_vecs):
+                    vec_handles[set_index][vec_index].put(
+                        vec_arrays[set_index][:, vec_index])
+        parallel.barrier()
+
+        def make_VS(checkpoint_dir, gram_cache_dir=None):
+            if gram_cache_dir is None:
+                gram_cache = None
+            else:
+                gram_cache = GramCache(gram_cache_dir)
+            return VectorSpaceHandles(inner_product=np.vdot,
+                checkpoint_dir=checkpoint_dir, checkpoint_interval=0,
+                gram_cache=gram_cache, verbosity=0)
+
+        # The restarted run restores the first matrix, then computes the
+        # second one, not the first one again.
+        checkpoint_dir = join(self.test_dir, 'checkpoint')
+        gram_cache_dir = join(self.test_dir, 'cache')
+        make_VS(checkpoint_dir, gram_cache_dir).\
+            compute_symmetric_inner_product_mat(vec_handles[0])
+        my_VS = make_VS(checkpoint_dir, gram_cache_dir)
+        for set_index in range(2):
+            np.testing.assert_allclose(
+                my_VS.compute_symmetric_inner_product_mat(
+                vec_handles[set_index]),
+                np.dot(vec_arrays[set_index].T, vec_arrays[set_index]))
+        self.assertEqual(my_VS.checkpoint_index, 2)
+
+        # A checkpoint saved for other vecs is rejected
+        checkpoint_dir = join(self.test_dir, 'checkpoint_other')
+        make_VS(checkpoint_dir).compute_symmetric_inner_product_mat(
+            vec_handles[0])
+        self.assertRaises(ValueError, make_VS(checkpoint_dir).
+            compute_symmetric_inner_product_mat, vec_handles[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,8 @@ import copy
 import os
 from os.path import join
 
+import numpy as np
+
 import modred.parallel as parallel
 
 
@@ -105,6 +107,114 @@ class TestParallel(unittest.TestCase):
             tasks, task_weights=task_weights), correct_assignments)
         self.assertEqual(task_weights, copy_task_weights)
 
+        # The last proc takes any tasks with no weight at the end
+        tasks = [1, 2, 3, 4]
+        task_weights = [1, 1, 0, 0]
+        parallel._num_MPI_workers = 2
+        correct_assignments = [[1], [2, 3, 4]]
+        self.assertEqual(parallel.find_assignments(
+            tasks, task_weights=task_weights), correct_assignments)
+
+        # Many tasks are assigned in one pass over the weights
+        tasks = list(range(10**5))
+        parallel._num_MPI_workers = 1000
+        assignments = parallel.find_assignments(tasks)
+        self.assertEqual([len(a) for a in assignments], [100] * 1000)
+        self.assertEqual(sum(assignments, []), tasks)
+
+
+    def test_find_buffer_layout(self):
+        """Test which vecs are sent as buffers rather than pickled."""
+        vecs = [np.zeros(3), np.mat(np.ones((2, 2), dtype=complex))]
+        self.assertEqual(parallel._find_buffer_layout(vecs),
+            [((3,), np.dtype(float).str, False),
+            ((2, 2), np.dtype(complex).str, True)])
+        self.assertEqual(parallel._find_buffer_layout([]), [])
+        self.assertIsNone(
+            parallel._find_buffer_layout([np.zeros(3), [1., 2.]]))
+        self.assertIsNone(
+            parallel._find_buffer_layout([np.array([None, 1.])]))
+
+
+    @unittest.skipIf(not distributed, 'Only test exchanges in parallel')
+    def test_exchange_vecs(self):
+        """Test passing vecs around a ring of MPI workers."""
+        num_procs = parallel.get_num_procs()
+        dest = (rank + 1) % num_procs
+        source = (rank - 1) % num_procs
+        def make_vecs(vec_rank):
+            return [
+                [vec_rank * np.ones(4), vec_rank * np.ones((2, 3))],
+                [np.mat(vec_rank * np.ones((2, 2)))],
+                [{'rank': vec_rank}],
+                []]
+        for vecs, vecs_true in zip(make_vecs(rank), make_vecs(source)):
+            vecs_recv, indices_recv = parallel.exchange_vecs(
+                vecs, [rank] * len(vecs), dest, source,
+                rank * (num_procs + 1) + dest,
+                source * (num_procs + 1) + rank)
+            self.assertEqual(indices_recv, [source] * len(vecs))
+            self.assertEqual(len(vecs_recv), len(vecs_true))
+            for vec_recv, vec_true in zip(vecs_recv, vecs_true):
+                self.assertEqual(type(vec_recv), type(vec_true))
+                if isinstance(vec_true, dict):
+                    self.assertEqual(vec_recv, vec_true)
+                else:
+                    np.testing.assert_equal(vec_recv, vec_true)
+
+
+    @unittest.skipIf(not distributed, 'Only test exchanges in parallel')
+    def test_exchange_posts_receives(self):
+        """Test that the receives are posted before waiting."""
+        num_procs = parallel.get_num_procs()
+        dest = (rank + 1) % num_procs
+        source = (rank - 1) % num_procs
+        for vecs, num_recvs in [
+            ([rank * np.ones(3), rank * np.ones(2)], 2),
+            ([{'rank': rank}], 1)]:
+            exchange = parallel.VecExchange(vecs, [rank] * len(vecs), dest,
+                source, rank * (num_procs + 1) + dest,
+                source * (num_procs + 1) + rank)
+            self.assertEqual(len(exchange._recv_requests), num_recvs)
+            vecs_recv, indices_recv = exchange.wait()
+            self.assertEqual(indices_recv, [source] * len(vecs))
+            self.assertEqual(len(exchange._recv_requests), 0)
+        self.assertEqual(vecs_recv, [{'rank': source}])
+        parallel.barrier()
+
+
+    def test_circulate_vecs(self):
+        """Test that every MPI worker sees the vecs of every other one once,
+        with the flat and hierarchical rings."""
+        num_procs = parallel.get_num_procs()
+        for circulate_vecs in [
+            parallel.circulate_vecs, parallel.circulate_vecs_hierarchical]:
+            # MPI workers have different numbers of vecs
+            vecs = [rank * np.ones(3)] * (rank % 2 + 1) + [
+                np.mat(rank * np.ones((2, 2)))]
+            indices = [rank] * len(vecs)
+            ranks_seen = []
+            for vecs_recv, indices_recv in circulate_vecs(vecs, indices):
+                self.assertEqual(len(vecs_recv), len(indices_recv))
+                self.assertEqual(len(set(indices_recv)), 1)
+                source = indices_recv[0]
+                self.assertEqual(len(vecs_recv), source % 2 + 2)
+                np.testing.assert_equal(vecs_recv[0], source * np.ones(3))
+                self.assertIsInstance(vecs_recv[-1], np.matrix)
+                ranks_seen.append(source)
+            self.assertEqual(sorted(ranks_seen), list(range(num_procs)))
+
+
+    def test_dynamic_tasks(self):
+        """Test that every task is handed out exactly once."""
+        for num_tasks in [0, 1, 5, 3 * parallel.get_num_procs() + 1]:
+            my_tasks = list(parallel.dynamic_tasks(num_tasks))
+            if distributed:
+                all_tasks = sum(MPI.COMM_WORLD.allgather(my_tasks), [])
+            else:
+                all_tasks = my_tasks
+            self.assertEqual(sorted(all_tasks), list(range(num_tasks)))
+
 
     def test_call_and_bcast(self):
         """Call a function on rank zero and bcast outputs to all MPI workers."""
@@ -3,6 +3,7 @@
 from __future__ import division
 from future.builtins import range
 import unittest
+from functools import partial
 import os
 from os.path import join
 from shutil import rmtree
@@ -117,26 +118,32 @@ class TestPODHandles(unittest.TestCase):
         eigvecs_true = parallel.call_and_bcast(
             np.random.random, ((num_states, num_vecs)))
 
-        my_POD = PODHandles(None, verbosity=0)
-        my_POD.correlation_mat = correlation_mat_true
-        my_POD.eigvals = eigvals_true
-        my_POD.eigvecs = eigvecs_true
-
-        eigvecs_path = join(test_dir, 'eigvecs.txt')
-        eigvals_path = join(test_dir, 'eigvals.txt')
-        correlation_mat_path = join(test_dir, 'correlation.txt')
-        my_POD.put_decomp(eigvals_path, eigvecs_path)
-        my_POD.put_correlation_mat(correlation_mat_path)
-        parallel.barrier()
-
-        POD_load = PODHandles(None, verbosity=0)
-        POD_load.get_decomp(eigvals_path, eigvecs_path)
-        correlation_mat_loaded = util.load_array_text(correlation_mat_path)
-
-        np.testing.assert_allclose(correlation_mat_loaded,
-            correlation_mat_true)
-        np.testing.assert_allclose(POD_load.eigvals, eigvals_true)
-        np.testing.assert_allclose(POD_load.eigvecs, eigvecs_true)
+        # Matrices are put as text by default, or in binary files, which
+        # can be memory-mapped when they are retrieved.
+        for put_mat, get_mat, ext in [
+            (util.save_array_text, util.load_array_text, 'txt'),
+            (util.save_array_binary,
+                partial(util.load_array_binary, mmap_mode='r'), 'npy')]:
+            my_POD = PODHandles(None, put_mat=put_mat, verbosity=0)
+            my_POD.correlation_mat = correlation_mat_true
+            my_POD.eigvals = eigvals_true
+            my_POD.eigvecs = eigvecs_true
+
+            eigvecs_path = join(test_dir, 'eigvecs.%s'%ext)
+            eigvals_path = join(test_dir, 'eigvals.%s'%ext)
+            correlation_mat_path = join(test_dir, 'correlation.%s'%ext)
+            my_POD.put_decomp(eigvals_path, eigvecs_path)
+            my_POD.put_correlation_mat(correlation_mat_path)
+            parallel.barrier()
+
+            POD_load = PODHandles(None, get_mat=get_mat, verbosity=0)
+            POD_load.get_decomp(eigvals_path, eigvecs_path)
+            correlation_mat_loaded = get_mat(correlation_mat_path)
+
+            np.testing.assert_allclose(correlation_mat_loaded,
+                correlation_mat_true)
+            np.testing.assert_allclose(POD_load.eigvals, eigvals_true)
+            np.testing.assert_allclose(POD_load.eigvecs, eigvecs_true)
 
 
     def test_init(self):
@@ -206,6 +213,42 @@ class TestPODHandles(unittest.TestCase):
         np.testing.assert_allclose(eigvals_returned,
             self.eigvals_true, rtol=tol)
 
+        # Assemble the correlation mat on rank zero only
+        eigvals_returned, eigvecs_returned = self.my_POD.compute_decomp(
+            self.vec_handles, assembly='rank_zero')
+        if parallel.is_rank_zero():
+            np.testing.assert_allclose(self.my_POD.correlation_mat,
+                self.correlation_mat_true, rtol=tol)
+        else:
+            self.assertIsNone(self.my_POD.correlation_mat)
+        np.testing.assert_allclose(eigvecs_returned,
+            self.eigvecs_true, rtol=tol)
+        np.testing.assert_allclose(eigvals_returned,
+            self.eigvals_true, rtol=tol)
+        self.assertRaises(ValueError, self.my_POD.compute_decomp,
+            self.vec_handles, assembly='distributed')
+
+
+    def test_append_vecs(self):
+        """Test updating the decomposition with new vecs."""
+        tol = 1e-6
+        self.assertRaises(
+            util.UndefinedError, self.my_POD.append_vecs, self.vec_handles)
+        for assembly in ['allreduce', 'rank_zero']:
+            self.my_POD.compute_decomp(
+                self.vec_handles[:4], assembly=assembly)
+            self.my_POD.append_vecs(self.vec_handles[4:7], assembly=assembly)
+            eigvals_returned, eigvecs_returned = self.my_POD.append_vecs(
+                self.vec_handles[7:], assembly=assembly)
+            self.assertEqual(self.my_POD.vec_handles, self.vec_handles)
+            if parallel.is_rank_zero() or assembly == 'allreduce':
+                np.testing.assert_allclose(self.my_POD.correlation_mat,
+                    self.correlation_mat_true, rtol=tol)
+            np.testing.assert_allclose(eigvals_returned,
+                self.eigvals_true, rtol=tol)
+            np.testing.assert_allclose(np.abs(eigvecs_returned),
+                np.abs(self.eigvecs_true), rtol=tol)
+
 
     def test_compute_modes(self):
         mode_path = join(self.test_dir, 'mode_%03d.txt')
@@ -256,5 +299,37 @@ class TestPODHandles(unittest.TestCase):
             proj_coeffs, proj_coeffs_true, rtol=rtol, atol=atol)
 
 
+    def test_compute_proj_coeffs_of(self):
+        rtol = 1e-10
+        atol = 1e-12
+
+        # Project new vecs, and the original vecs, without computing modes
+        new_vec_array = parallel.call_and_bcast(np.random.random,
+            (self.vec_array.shape[0], 3))
+        new_vec_handles = [V.VecHandleInMemory(new_vec_array[:, i])
+            for i in range(new_vec_array.shape[1])]
+        self.my_POD.eigvecs = self.eigvecs_true
+        self.my_POD.eigvals = self.eigvals_true
+        self.my_POD.vec_handles = self.vec_handles
+        np.testing.assert_allclose(
+            self.my_POD.compute_proj_coeffs_of(new_vec_handles),
+            np.dot(self.mode_array.conj().T, new_vec_array),
+            rtol=rtol, atol=atol)
+        np.testing.assert_allclose(
+            self.my_POD.compute_proj_coeffs_of(self.vec_handles),
+            self.my_POD.compute_proj_coeffs(), rtol=rtol, atol=atol)
+
+
+    def test_make_mode_handles(self):
+        self.my_POD.eigvecs = self.eigvecs_true
+        self.my_POD.eigvals = self.eigvals_true
+        mode_indices = [2, 0]
+        mode_handles = self.my_POD.make_mode_handles(mode_indices,
+            vec_handles=self.vec_handles)
+        for mode_index, mode_handle in zip(mode_indices, mode_handles):
+            np.testing.assert_allclose(
+                mode_handle.get(), self.mode_array[:, mode_index])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Test the tracing module"""
+from __future__ import division
+import unittest
+import os
+from os.path import join
+from shutil import rmtree
+import json
+
+import numpy as np
+
+import modred.parallel as parallel
+from modred.tracing import Tracer
+from modred.vectorspace import VectorSpaceHandles
+from modred import vectors as V
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'DELETE_ME_test_files_tracing'
+        if not os.access('.', os.W_OK):
+            raise RuntimeError('Cannot write to current directory')
+        if not os.path.isdir(self.test_dir) and parallel.is_rank_zero():
+            os.mkdir(self.test_dir)
+        parallel.barrier()
+
+
+    def tearDown(self):
+        parallel.barrier()
+        parallel.call_from_rank_zero(rmtree, self.test_dir, ignore_errors=True)
+        parallel.barrier()
+
+
+    def test_record(self):
+        """Test recording and summarizing events."""
+        tracer = Tracer()
+        tracer.record('get', 10., 12., num_bytes=80)
+        tracer.record('get', 12., 12.5, num_bytes=40)
+        with tracer.span('inner_product'):
+            pass
+        try:
+            with tracer.span('put', num_bytes=8):
+                raise ValueError('Events are recorded after errors')
+        except ValueError:
+            pass
+        self.assertEqual([event['name'] for event in tracer.events],
+            ['get', 'get', 'inner_product', 'put'])
+        self.assertEqual(tracer.events[1]['duration'], 0.5)
+        summary = tracer.summarize()
+        self.assertEqual(summary['get'],
+            {'count': 2, 'duration': 2.5, 'num_bytes': 120})
+        self.assertEqual(summary['put']['num_bytes'], 8)
+        self.assertEqual(summary['inner_product']['count'], 1)
+
+
+    def test_chrome_trace(self):
+        """Test exporting events of all MPI workers to a Chrome trace."""
+        tracer = Tracer()
+        tracer.record('get', 100. + parallel.get_rank(), 101.5, num_bytes=8)
+        trace_path = join(self.test_dir, 'trace.json')
+        tracer.save_chrome_trace(trace_path)
+        with open(trace_path) as trace_file:
+            trace = json.load(trace_file)
+        events = [event for event in trace['traceEvents']
+            if event['ph'] == 'X']
+        self.assertEqual(sorted(event['pid'] for event in events),
+            list(range(parallel.get_num_procs())))
+        for event in events:
+            self.assertEqual(event['name'], 'get')
+            self.assertAlmostEqual(event['ts'], event['pid'] * 1e6)
+            self.assertAlmostEqual(event['dur'], (1.5 - event['pid']) * 1e6)
+            self.assertEqual(event['args'], {'num_bytes': 8})
+
+
+    def test_vector_space_events(self):
+        """Test that the phases of vector space operations are traced."""
+        num_vecs = 6
+        vec_array = parallel.call_and_bcast(np.random.random, (5, num_vecs))
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_vecs)]
+        sum_handles = [V.VecHandleInMemory() for i in range(2)]
+        for schedule in ['static', 'dynamic']:
+            tracer = Tracer()
+            my_VS = VectorSpaceHandles(inner_product=np.vdot,
+                max_vecs_per_node=4 * parallel.get_num_procs(),
+                schedule=schedule, tracer=tracer, verbosity=0)
+            np.testing.assert_allclose(
+                my_VS.compute_symmetric_inner_product_mat(vec_handles),
+                np.dot(vec_array.T, vec_array))
+            my_VS.compute_inner_product_mat(vec_handles, vec_handles[:2],
+                assembly='rank_zero')
+            my_VS.lin_combine(sum_handles, vec_handles, np.ones((num_vecs, 2)))
+            summary = tracer.summarize()
+            for name in ['get', 'inner_product', 'barrier', 'allreduce',
+                'gather']:
+                self.assertIn(name, summary)
+            if schedule == 'static':
+                self.assertIn('wait', summary)
+            self.assertEqual(summary['get']['num_bytes'],
+                summary['get']['count'] * vec_array[:, 0].nbytes)
+            if parallel.is_rank_zero() or schedule == 'dynamic':
+                self.assertIn('sum', summary)
+            if not parallel.is_distributed():
+                self.assertEqual(summary['put']['count'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -67,6 +67,28 @@ class TestUtil(unittest.TestCase):
                             np.testing.assert_allclose(mat_read, mat)#,rtol=tol)
 
 
+    @unittest.skipIf(
+        parallel.is_distributed(), 'Only save/load matrices in serial')
+    def test_load_save_array_binary(self):
+        """Test that can read/write binary matrices"""
+        mat_real = np.random.random((5, 4))
+        for mat in [mat_real, mat_real + 1j * np.random.random((5, 4)),
+            mat_real[:, 0], np.mat(mat_real)]:
+            for file_name in ['test_matrix.npy', 'test_matrix',
+                'test_matrix.npz']:
+                mat_path = join(self.test_dir, file_name)
+                util.save_array_binary(mat, mat_path)
+                self.assertTrue(os.path.isfile(mat_path))
+                for mmap_mode in [None, 'r']:
+                    mat_read = util.load_array_binary(
+                        mat_path, mmap_mode=mmap_mode)
+                    self.assertEqual(mat_read.dtype, mat.dtype)
+                    np.testing.assert_equal(mat_read, np.asarray(mat))
+        mat_read = util.load_array_binary(
+            join(self.test_dir, 'test_matrix.npy'), mmap_mode='r')
+        self.assertIsInstance(mat_read, np.memmap)
+
+
     @unittest.skipIf(parallel.is_distributed(), 'Only load matrices in serial')
     def test_svd(self):
         # Set tolerance for testing eigval/eigvec property
@@ -412,5 +434,84 @@ class TestUtil(unittest.TestCase):
                 np.testing.assert_equal(Hankel_comp, Hankel_true)
 
 
+    def test_extend_mat(self):
+        """Test appending columns and rows to a matrix."""
+        vecs = np.random.random((5, 6)) + 1j * np.random.random((5, 6))
+        adv_vecs = np.random.random((5, 6))
+        mat_true = np.mat(vecs.conj().T.dot(vecs))
+        mat = util.extend_mat(
+            mat_true[:4, :4], mat_true[:4, 4:], mat_true[4:, 4:])
+        np.testing.assert_allclose(mat, mat_true)
+        self.assertIsInstance(mat, np.matrix)
+
+        mat_true = vecs.conj().T.dot(adv_vecs)
+        mat = util.extend_mat(mat_true[:3, :2], mat_true[:3, 2:],
+            mat_true[3:, 2:], new_rows=mat_true[3:, :2])
+        np.testing.assert_allclose(mat, mat_true)
+        self.assertIsNone(util.extend_mat(None, None, None))
+
+
+    def test_get_nbytes(self):
+        """Test estimate of memory used by vectors."""
+        array = np.zeros(100)
+        self.assertEqual(util.get_nbytes(array), array.nbytes)
+        self.assertEqual(util.get_nbytes(np.mat(array)), array.nbytes)
+        # Shared arrays are only counted once
+        self.assertEqual(util.get_nbytes([array, array]), array.nbytes)
+        class MyVec(object):
+            def __init__(self):
+                self.data = np.zeros(10)
+                self.grid = [np.zeros(5), np.zeros(5)]
+        self.assertEqual(util.get_nbytes(MyVec()), 20 * array.itemsize)
+
+
+    @unittest.skipIf(parallel.is_distributed(), 'Only save files in serial')
+    def test_get_available_memory(self):
+        """Test reading available memory from meminfo and cgroup files."""
+        meminfo_path = join(self.test_dir, 'meminfo')
+        with open(meminfo_path, 'w') as meminfo_file:
+            meminfo_file.write('MemTotal:       16000 kB\n'
+                'MemFree:         4000 kB\nMemAvailable:    8000 kB\n')
+        self.assertEqual(
+            util._read_meminfo_available(meminfo_path), 8000 * 1024)
+        self.assertIsNone(util._read_meminfo_available(
+            join(self.test_dir, 'missing')))
+
+        # cgroup v2
+        cgroup_path = join(self.test_dir, 'cgroup')
+        cgroup_root = join(self.test_dir, 'sys_fs_cgroup')
+        os.makedirs(join(cgroup_root, 'job'))
+        with open(cgroup_path, 'w') as cgroup_file:
+            cgroup_file.write('0::/job\n')
+        with open(join(cgroup_root, 'job', 'memory.max'), 'w') as limit_file:
+            limit_file.write('1000\n')
+        with open(join(cgroup_root, 'job', 'memory.current'), 'w') as \
+            usage_file:
+            usage_file.write('400\n')
+        self.assertEqual(
+            util._read_cgroup_available(cgroup_path, cgroup_root), 600)
+        with open(join(cgroup_root, 'job', 'memory.max'), 'w') as limit_file:
+            limit_file.write('max\n')
+        self.assertIsNone(
+            util._read_cgroup_available(cgroup_path, cgroup_root))
+
+        # cgroup v1, where the cgroup path is not visible
+        with open(cgroup_path, 'w') as cgroup_file:
+            cgroup_file.write('4:memory:/other_job\n1:cpu:/\n')
+        os.makedirs(join(cgroup_root, 'memory'))
+        with open(join(cgroup_root, 'memory', 'memory.limit_in_bytes'),
+            'w') as limit_file:
+            limit_file.write('2000\n')
+        with open(join(cgroup_root, 'memory', 'memory.usage_in_bytes'),
+            'w') as usage_file:
+            usage_file.write('500\n')
+        self.assertEqual(
+            util._read_cgroup_available(cgroup_path, cgroup_root), 1500)
+
+        available_bytes = util.get_available_memory()
+        if available_bytes is not None:
+            self.assertTrue(available_bytes >= 0)
+
+
 if __name__ == '__main__':
     unittest.main()
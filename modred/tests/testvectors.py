@@ -90,7 +90,8 @@ class TestVectors(unittest.TestCase):
         vec_saved = join(self.test_dir, 'put_vec')
         base_path1 = join(self.test_dir, 'base_vec1')
         base_path2 = join(self.test_dir, 'base_vec2')
-        for VecHandle in [V.VecHandleArrayText, V.VecHandlePickle]:
+        for VecHandle in [
+            V.VecHandleArrayText, V.VecHandlePickle, V.VecHandleNpy]:
             VecHandle(base_path1).put(base_vec1)
             VecHandle(base_path2).put(base_vec2)
             VecHandle(vec_true_path).put(vec_true)
@@ -111,6 +112,115 @@ class TestVectors(unittest.TestCase):
             self.assertEqual(vec_handle1, vec_handle2)
             self.assertNotEqual(vec_handle1, vec_handle3)
             self.assertNotEqual(vec_handle1, vec_handle4)
+            # Test cost, the file size
+            self.assertEqual(VecHandle(vec_saved).get_cost(),
+                os.path.getsize(vec_saved))
+            self.assertIsNone(VecHandle('a').get_cost())
+            # Test whether the file exists.  Files are renamed once they are
+            # saved, so no temporary files are left.
+            self.assertTrue(VecHandle(vec_saved).exists())
+            self.assertFalse(VecHandle('a').exists())
+            if not parallel.is_distributed():
+                self.assertEqual(sorted(os.listdir(self.test_dir)), [
+                    'base_vec1', 'base_vec2', 'put_vec', 'test_vec'])
+
+
+    def test_npy_handle(self):
+        """Test that npy handles memory-map the vectors they get"""
+        vec_true = parallel.call_and_bcast(np.random.random, (3, 4))
+        base_vec = parallel.call_and_bcast(np.random.random, (3, 4))
+        vec_path = join(self.test_dir, 'vec.npy')
+        base_path = join(self.test_dir, 'base_vec.npy')
+        if parallel.is_rank_zero():
+            V.VecHandleNpy(vec_path).put(vec_true)
+            V.VecHandleNpy(base_path).put(base_vec)
+        parallel.barrier()
+        # Vectors are plain arrays backed by the mapped file, so they take
+        # the fast paths for arrays, e.g., sending them as buffers.
+        vec = V.VecHandleNpy(vec_path).get()
+        self.assertIs(type(vec), np.ndarray)
+        self.assertIsInstance(vec.base, np.memmap)
+        self.assertFalse(vec.flags.writeable)
+        np.testing.assert_equal(vec, vec_true)
+        self.assertIsNotNone(parallel._find_buffer_layout([vec]))
+        vec = V.VecHandleNpy(vec_path, mmap_mode=None).get()
+        self.assertIs(type(vec), np.ndarray)
+        np.testing.assert_equal(vec, vec_true)
+        np.testing.assert_allclose(V.VecHandleNpy(vec_path,
+            base_vec_handle=V.VecHandleNpy(base_path), scale=2.).get(),
+            2. * (vec_true - base_vec))
+
+
+    def test_find_vec_handle_costs(self):
+        """Test costs of vector handles used to divide up work"""
+        vecs = [np.zeros(3), np.zeros(5)]
+        self.assertEqual(V.find_vec_handle_costs(
+            [V.VecHandleInMemory(vec) for vec in vecs]),
+            [vec.nbytes for vec in vecs])
+        # Costs are unknown for handles without get_cost, or with no cost
+        self.assertIsNone(V.find_vec_handle_costs(
+            [V.VecHandleInMemory(vecs[0]), object()]))
+        self.assertIsNone(V.find_vec_handle_costs(
+            [V.VecHandleInMemory(vecs[0]), V.VecHandle()]))
+
+
+    @unittest.skipIf(parallel.is_distributed(), 'Serial only')
+    def test_find_vec_handle_keys(self):
+        """Test keys identifying the vectors of handles"""
+        vec_path = join(self.test_dir, 'key_vec.pkl')
+        base_path = join(self.test_dir, 'key_base_vec.pkl')
+        V.VecHandlePickle(base_path).put(np.ones(3))
+        vec_handle = V.VecHandlePickle(vec_path)
+        self.assertIsNone(vec_handle.get_key())
+        vec_handle.put(np.zeros(3))
+        keys = V.find_vec_handle_keys([vec_handle,
+            V.VecHandlePickle(vec_path),
+            V.VecHandlePickle(vec_path, scale=2.),
+            V.VecHandlePickle(vec_path,
+                base_vec_handle=V.VecHandlePickle(base_path)),
+            V.VecHandleInMemory(np.zeros(3)), object()])
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(len(set(keys[1:4])), 3)
+        self.assertEqual(keys[4:], [None, None])
+
+        # Keys change with the file, or are set by the user
+        vec_handle.put(np.zeros(4))
+        self.assertNotEqual(vec_handle.get_key(), keys[0])
+        in_memory_handle = V.VecHandleInMemory(np.zeros(3))
+        in_memory_handle.cache_key = 'zeros'
+        self.assertIsNotNone(in_memory_handle.get_key())
+
+
+    def test_find_existing_vec_handles(self):
+        """Test which vectors have been put"""
+        self.assertEqual(V.find_existing_vec_handles([
+            V.VecHandleInMemory(np.zeros(3)), V.VecHandleInMemory(),
+            V.VecHandle(), object()]), [True, False, False, False])
+
+
+    def test_axpy(self):
+        """Test adding scaled vectors in place"""
+        # Arrays are updated in place, in several slabs, including from
+        # non-contiguous arrays and matrices
+        other = np.random.random((V._axpy_slab_size + 10, 3))
+        for other_vec in [other[:, 1], np.mat(other[:, 1]).T]:
+            vec = np.random.random(other_vec.shape)
+            vec_true = vec + 2.5 * other_vec
+            self.assertIs(V.axpy(vec, 2.5, other_vec), vec)
+            np.testing.assert_allclose(vec, vec_true)
+
+        # Vectors with an axpy method
+        class AxpyVec(object):
+            def __init__(self, value):
+                self.value = value
+            def axpy(self, alpha, other):
+                self.value += alpha * other.value
+        vec = AxpyVec(1.)
+        self.assertIs(V.axpy(vec, 3., AxpyVec(2.)), vec)
+        self.assertEqual(vec.value, 7.)
+
+        # Other vectors
+        self.assertEqual(V.axpy(1., 3., 2.), 7.)
 
 
     def test_IP_trapz(self):
@@ -135,5 +245,18 @@ class TestVectors(unittest.TestCase):
         self.assertTrue(convergence < -1.9)
 
 
+    def test_IP_block_array_uniform(self):
+        """Test block inner product of arrays matches pairwise products"""
+        vecs1 = [np.random.random((3, 4)) + 1j*np.random.random((3, 4))
+            for i in range(5)]
+        vecs2 = [np.random.random((3, 4)) for i in range(2)]
+        IP_mat = V.inner_product_block_array_uniform(vecs1, vecs2)
+        self.assertEqual(IP_mat.shape, (5, 2))
+        for i, vec1 in enumerate(vecs1):
+            for j, vec2 in enumerate(vecs2):
+                np.testing.assert_allclose(IP_mat[i, j],
+                    V.inner_product_array_uniform(vec1, vec2))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -6,6 +6,7 @@ import os
 from os.path import join
 from shutil import rmtree
 import copy
+import json
 import random
 #import inspect #makes it possible to find information about a function
 import unittest
@@ -14,8 +15,11 @@ import numpy as np
 
 import modred.parallel as parallel
 from modred.vectorspace import *
+from modred.vectorspace import _find_chunk_sizes, _NodeVecCache, \
+    _add_sum_layers, _is_array_chunk
 import modred.vectors as V
 import modred.util
+from modred.tracing import Tracer
 
 
 class TestVectorSpaceHandles(unittest.TestCase):
@@ -40,7 +44,14 @@ class TestVectorSpaceHandles(unittest.TestCase):
             'max_vecs_per_node': 10000,
             'max_vecs_per_proc': (
                 10000 * parallel.get_num_nodes() // parallel.get_num_procs()),
-            'verbosity': 0, 'print_interval': 10, 'prev_print_time': 0.}
+            'verbosity': 0, 'print_interval': 10, 'prev_print_time': 0.,
+            'inner_product_block': None, 'num_get_threads': 0,
+            'num_put_threads': 0, 'max_bytes_per_node': None,
+            'peak_bytes_per_proc': 0, 'schedule': 'static',
+            'weigh_tasks': False, 'node_cache_vecs': 0,
+            'hierarchical_ring': False, 'checkpoint_dir': None,
+            'checkpoint_interval': 600, 'checkpoint_index': 0,
+            'tracer': None, 'cost_model': None, 'gram_cache': None}
         parallel.barrier()
 
 
@@ -66,6 +77,23 @@ class TestVectorSpaceHandles(unittest.TestCase):
             parallel.get_num_nodes() // parallel.get_num_procs()
         self.assertEqual(util.get_data_members(my_VS), data_members)
 
+        max_bytes_per_node = 10**6
+        my_VS = VectorSpaceHandles(inner_product=np.vdot,
+            max_bytes_per_node=max_bytes_per_node, verbosity=0)
+        data_members = copy.deepcopy(data_members_original)
+        data_members['max_bytes_per_node'] = max_bytes_per_node
+        data_members['max_vecs_per_node'] = None
+        data_members['max_vecs_per_proc'] = None
+        self.assertEqual(util.get_data_members(my_VS), data_members)
+
+        my_VS = VectorSpaceHandles(inner_product=np.vdot, schedule='dynamic',
+            verbosity=0)
+        data_members = copy.deepcopy(data_members_original)
+        data_members['schedule'] = 'dynamic'
+        self.assertEqual(util.get_data_members(my_VS), data_members)
+        self.assertRaises(ValueError, VectorSpaceHandles,
+            inner_product=np.vdot, schedule='guided', verbosity=0)
+
 
     #@unittest.skip('testing other things')
     def test_sanity_check(self):
@@ -206,6 +234,196 @@ class TestVectorSpaceHandles(unittest.TestCase):
         parallel.barrier()
 
 
+    #@unittest.skip('testing others')
+    def test_lin_combine_resume(self):
+        """Test that sums that were already put are not computed again."""
+        num_states = 6
+        num_vecs = self.total_num_vecs_in_mem + 1
+        num_sums = self.total_num_vecs_in_mem + 3
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        coeff_mat = parallel.call_and_bcast(np.random.random,
+            (num_vecs, num_sums))
+        sums_true = np.dot(vec_array, coeff_mat)
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_vecs)]
+        for schedule in ['static', 'dynamic']:
+            sum_handles = [V.VecHandlePickle(join(
+                self.test_dir, 'sum_%s_%03d.pkl'%(schedule, i)))
+                for i in range(num_sums)]
+            # Some sums were put by a run that was killed
+            put_indices = [0, 2, num_sums - 1]
+            if parallel.is_rank_zero():
+                for sum_index in put_indices:
+                    sum_handles[sum_index].put(np.zeros(num_states))
+            parallel.barrier()
+
+            my_VS = VectorSpaceHandles(
+                inner_product=np.vdot, schedule=schedule, verbosity=0)
+            my_VS.max_vecs_per_proc = self.max_vecs_per_proc
+            my_VS.lin_combine(sum_handles, vec_handles, coeff_mat, resume=True)
+            for sum_index, sum_handle in enumerate(sum_handles):
+                if sum_index in put_indices:
+                    np.testing.assert_equal(
+                        sum_handle.get(), np.zeros(num_states))
+                else:
+                    np.testing.assert_allclose(
+                        sum_handle.get(), sums_true[:, sum_index])
+
+            # Nothing is retrieved once all of the sums have been put
+            my_VS.lin_combine(sum_handles,
+                [V.VecHandle() for vec_handle in vec_handles], coeff_mat,
+                resume=True)
+            parallel.barrier()
+
+
+    def test_mode_handles(self):
+        """Test modes that are only computed when retrieved."""
+        class CountingHandle(V.VecHandleInMemory):
+            num_gets = 0
+            def _get(self):
+                CountingHandle.num_gets += 1
+                return V.VecHandleInMemory._get(self)
+
+        num_states = 7
+        num_vecs = 5
+        num_modes = 4
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        coeff_mat = parallel.call_and_bcast(np.random.random,
+            (num_vecs, num_modes))
+        modes_true = np.dot(vec_array, coeff_mat)
+        vec_handles = [CountingHandle(vec_array[:, i])
+            for i in range(num_vecs)]
+        mode_cache = ModeCache(max_bytes=2 * vec_array[:, 0].nbytes)
+        mode_handles = make_mode_handles(vec_handles, coeff_mat,
+            coeff_mat_col_indices=[3, 1, 0], mode_cache=mode_cache,
+            num_basis_vecs_per_chunk=2)
+
+        # Nothing is computed until a mode is retrieved, then the mode is
+        # kept in the cache.
+        self.assertEqual(CountingHandle.num_gets, 0)
+        np.testing.assert_allclose(mode_handles[0].get(), modes_true[:, 3])
+        self.assertEqual(CountingHandle.num_gets, num_vecs)
+        np.testing.assert_allclose(mode_handles[0].get(), modes_true[:, 3])
+        self.assertEqual(CountingHandle.num_gets, num_vecs)
+
+        # Only two modes fit in the cache, so the least recently retrieved is
+        # dropped.
+        mode_handles[1].get()
+        mode_handles[0].get()
+        np.testing.assert_allclose(mode_handles[2].get(), modes_true[:, 0])
+        self.assertEqual(CountingHandle.num_gets, 3 * num_vecs)
+        self.assertEqual(mode_cache.num_bytes, mode_cache.max_bytes)
+        mode_handles[0].get()
+        self.assertEqual(CountingHandle.num_gets, 3 * num_vecs)
+        mode_handles[1].get()
+        self.assertEqual(CountingHandle.num_gets, 4 * num_vecs)
+
+        # Modes can be retrieved within vector space operations
+        my_VS = VectorSpaceHandles(inner_product=np.vdot, verbosity=0)
+        np.testing.assert_allclose(
+            my_VS.compute_inner_product_mat(mode_handles, vec_handles),
+            np.dot(modes_true[:, [3, 1, 0]].T, vec_array))
+        self.assertRaises(ValueError, ModeHandle, vec_handles,
+            np.ones(num_vecs + 1))
+
+        # A cache can also be limited to a number of modes.
+        mode_cache = ModeCache(max_bytes=None, max_modes=1)
+        mode_handles = make_mode_handles(vec_handles, coeff_mat,
+            mode_cache=mode_cache)
+        CountingHandle.num_gets = 0
+        mode_handles[0].get()
+        mode_handles[1].get()
+        self.assertEqual(mode_cache.num_bytes, vec_array[:, 0].nbytes)
+        mode_handles[1].get()
+        self.assertEqual(CountingHandle.num_gets, 2 * num_vecs)
+
+        # Retrieved modes can't be modified, since they are kept in the cache
+        mode = mode_handles[1].get()
+        self.assertRaises(ValueError, mode.__imul__, 100.)
+        np.testing.assert_allclose(mode_handles[1].get(), modes_true[:, 1])
+        mode_cache.clear()
+        mode = mode_handles[1].get()
+        self.assertRaises(ValueError, mode.__imul__, 100.)
+        np.testing.assert_allclose(mode_handles[1].get(), modes_true[:, 1])
+
+        # Other vector objects are copied instead
+        class DataVec(V.Vector):
+            def __init__(self, data):
+                self.data = data
+            def __mul__(self, scalar):
+                return DataVec(self.data * scalar)
+        mode_handle = ModeHandle([V.VecHandleInMemory(DataVec(np.ones(3)))],
+            [2.], mode_cache=ModeCache(max_bytes=None))
+        mode_handle.get().data *= 100.
+        mode_handle.get().data *= 100.
+        np.testing.assert_equal(mode_handle.get().data, 2. * np.ones(3))
+
+        # By default, the cache is limited by the memory available on the
+        # node, or to a few modes if that is unknown, and is shared by all
+        # of the modes.
+        mode_cache = make_mode_handles(vec_handles, coeff_mat)[0].mode_cache
+        self.assertIs(
+            make_mode_handles(vec_handles, coeff_mat)[0].mode_cache,
+            mode_cache)
+        available_bytes = modred.util.get_available_memory()
+        if available_bytes is not None:
+            self.assertTrue(0 < mode_cache.max_bytes <= available_bytes)
+        get_available_memory = modred.util.get_available_memory
+        modred.util.get_available_memory = lambda: None
+        try:
+            mode_cache = ModeCache()
+        finally:
+            modred.util.get_available_memory = get_available_memory
+        self.assertEqual(mode_cache.max_bytes, None)
+        self.assertTrue(mode_cache.max_modes >= 1)
+
+
+    def test_lin_combine_multiple(self):
+        """Test computing several sets of sums over overlapping bases."""
+        num_states = 6
+        num_vecs = 5
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        coeff_mat_1 = parallel.call_and_bcast(np.random.random,
+            (num_vecs - 1, 3))
+        coeff_mat_2 = parallel.call_and_bcast(np.random.random,
+            (num_vecs - 1, 4)) * 1j
+        col_indices_2 = [3, 0]
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_vecs)]
+        for schedule in ['static', 'dynamic']:
+            sum_handles_1 = [V.VecHandleInMemory() for i in range(3)]
+            sum_handles_2 = [V.VecHandleInMemory() for i in range(2)]
+            tracer = Tracer()
+            my_VS = VectorSpaceHandles(inner_product=np.vdot,
+                max_vecs_per_node=20 * parallel.get_num_procs(),
+                schedule=schedule, tracer=tracer, verbosity=0)
+            my_VS.lin_combine_multiple([sum_handles_1, sum_handles_2],
+                [vec_handles[:-1], vec_handles[1:]],
+                [coeff_mat_1, coeff_mat_2],
+                coeff_mat_col_indices_list=[None, col_indices_2])
+            for sum_index, sum_handle in enumerate(sum_handles_1):
+                np.testing.assert_allclose(sum_handle.get(),
+                    np.dot(vec_array[:, :-1], coeff_mat_1[:, sum_index]))
+            for sum_index, sum_handle in enumerate(sum_handles_2):
+                np.testing.assert_allclose(sum_handle.get(),
+                    np.dot(vec_array[:, 1:],
+                    coeff_mat_2[:, col_indices_2[sum_index]]))
+
+            # Each vec is retrieved once for both sets
+            if not parallel.is_distributed():
+                self.assertEqual(tracer.summarize()['get']['count'], num_vecs)
+
+        self.assertRaises(ValueError, my_VS.lin_combine_multiple,
+            [sum_handles_1, sum_handles_2], [vec_handles, vec_handles[1:]],
+            [coeff_mat_1, coeff_mat_2])
+        self.assertRaises(ValueError, my_VS.lin_combine_multiple,
+            [sum_handles_1], [vec_handles[1:], vec_handles[1:]],
+            [coeff_mat_1, coeff_mat_2])
+
+
     #@unittest.skip('testing others')
     @unittest.skipIf(parallel.is_distributed(), 'Serial only')
     def test_compute_inner_product_mat_types(self):
@@ -306,5 +524,691 @@ class TestVectorSpaceHandles(unittest.TestCase):
                 np.testing.assert_allclose(product_computed, product_true)
 
 
+
+    #@unittest.skip('testing other things')
+    def test_compute_inner_product_mats_block(self):
+        """Test computation of inner product matrices using a block inner
+        product."""
+        num_states = 6
+        my_vec_ops = VectorSpaceHandles(
+            inner_product_block=V.inner_product_block_array_uniform,
+            verbosity=0)
+        my_vec_ops.max_vecs_per_proc = self.max_vecs_per_proc
+        for num_row_vecs, num_col_vecs in [(1, 1), (3, 25), (25, 3),
+            (self.total_num_vecs_in_mem * 2, self.total_num_vecs_in_mem)]:
+            row_vec_array = parallel.call_and_bcast(np.random.random,
+                (num_states, num_row_vecs))
+            col_vec_array = parallel.call_and_bcast(np.random.random,
+                (num_states, num_col_vecs))
+            row_vec_handles = [V.VecHandleInMemory(row_vec_array[:, i])
+                for i in range(num_row_vecs)]
+            col_vec_handles = [V.VecHandleInMemory(col_vec_array[:, i])
+                for i in range(num_col_vecs)]
+
+            np.testing.assert_allclose(
+                my_vec_ops.compute_inner_product_mat(
+                    row_vec_handles, col_vec_handles),
+                np.dot(row_vec_array.T, col_vec_array))
+            np.testing.assert_allclose(
+                my_vec_ops.compute_symmetric_inner_product_mat(
+                    row_vec_handles),
+                np.dot(row_vec_array.T, row_vec_array))
+
+
+
+    #@unittest.skip('testing other things')
+    def test_compute_inner_product_mats_assembly(self):
+        """Test assembly of inner product matrices on all processors/MPI
+        workers, on rank zero, and as distributed blocks."""
+        num_states = 6
+        num_row_vecs = self.total_num_vecs_in_mem * 2 + 1
+        num_col_vecs = self.total_num_vecs_in_mem + 2
+        row_vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_row_vecs))
+        col_vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_col_vecs))
+        row_vec_handles = [V.VecHandleInMemory(row_vec_array[:, i])
+            for i in range(num_row_vecs)]
+        col_vec_handles = [V.VecHandleInMemory(col_vec_array[:, i])
+            for i in range(num_col_vecs)]
+        product_true = np.dot(row_vec_array.T, col_vec_array)
+        symm_product_true = np.dot(row_vec_array.T, row_vec_array)
+
+        # Both orientations, since the larger set of vecs is always the one
+        # read in outer chunks
+        for assembly in ['allreduce', 'rank_zero', 'distributed']:
+            for row_handles, col_handles, true in [
+                (row_vec_handles, col_vec_handles, product_true),
+                (col_vec_handles, row_vec_handles, product_true.T)]:
+                IP_mat = self.my_vec_ops.compute_inner_product_mat(
+                    row_handles, col_handles, assembly=assembly)
+                if assembly == 'distributed':
+                    self.assertIsInstance(IP_mat, DistributedMatrix)
+                    self.assertEqual(IP_mat.shape, true.shape)
+                    IP_mat = IP_mat.allreduce()
+                if assembly == 'rank_zero' and not parallel.is_rank_zero():
+                    self.assertIsNone(IP_mat)
+                else:
+                    np.testing.assert_allclose(IP_mat, true)
+
+            symm_IP_mat = self.my_vec_ops.compute_symmetric_inner_product_mat(
+                row_vec_handles, assembly=assembly)
+            if assembly == 'distributed':
+                self.assertTrue(symm_IP_mat.is_symmetric)
+                symm_IP_mat = symm_IP_mat.gather()
+            if parallel.is_rank_zero() or assembly == 'allreduce':
+                np.testing.assert_allclose(symm_IP_mat, symm_product_true)
+            else:
+                self.assertIsNone(symm_IP_mat)
+
+        self.assertRaises(ValueError,
+            self.my_vec_ops.compute_inner_product_mat,
+            row_vec_handles, col_vec_handles, assembly='bcast')
+
+
+
+    #@unittest.skip('testing other things')
+    def test_dynamic_schedule(self):
+        """Test that the dynamic schedule gives the same results as the static
+        one."""
+        num_states = 7
+        num_vecs = self.total_num_vecs_in_mem * 2 + 1
+        num_sums = self.total_num_vecs_in_mem + 3
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        adv_vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs - 2))
+        coeff_mat = parallel.call_and_bcast(np.random.random,
+            (num_vecs, num_sums))
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_vecs)]
+        adv_vec_handles = [V.VecHandleInMemory(adv_vec_array[:, i])
+            for i in range(num_vecs - 2)]
+
+        for inner_product, inner_product_block in [
+            (np.vdot, None), (None, V.inner_product_block_array_uniform)]:
+            for num_get_threads in [0, 2]:
+                my_VS = VectorSpaceHandles(inner_product=inner_product,
+                    inner_product_block=inner_product_block,
+                    num_get_threads=num_get_threads, schedule='dynamic',
+                    verbosity=0)
+                my_VS.max_vecs_per_proc = self.max_vecs_per_proc
+                for row_handles, col_handles in [
+                    (vec_handles, adv_vec_handles),
+                    (adv_vec_handles, vec_handles)]:
+                    np.testing.assert_allclose(
+                        my_VS.compute_inner_product_mat(
+                        row_handles, col_handles),
+                        self.my_vec_ops.compute_inner_product_mat(
+                        row_handles, col_handles))
+                np.testing.assert_allclose(
+                    my_VS.compute_symmetric_inner_product_mat(vec_handles),
+                    self.my_vec_ops.compute_symmetric_inner_product_mat(
+                    vec_handles))
+
+                # Sums are put to files, since each is only put by the proc
+                # that computed it.
+                sum_handles = [V.VecHandlePickle(
+                    join(self.test_dir, 'sum_%03d.pkl'%i))
+                    for i in range(num_sums)]
+                my_VS.lin_combine(sum_handles, vec_handles, coeff_mat)
+                np.testing.assert_allclose(
+                    np.array([handle.get() for handle in sum_handles]).T,
+                    np.dot(vec_array, coeff_mat))
+
+
+
+    #@unittest.skip('testing other things')
+    def test_weigh_tasks(self):
+        """Test that weighing tasks by the costs of the handles gives the
+        same results."""
+        num_states_list = [3, 20, 5, 40, 2, 2, 10, 7, 30]
+        num_vecs = len(num_states_list)
+        vecs = parallel.call_and_bcast(lambda: [np.random.random(num_states)
+            for num_states in num_states_list])
+        # Inner products of vecs of different lengths, with zero padding
+        def inner_product(vec1, vec2):
+            num_states = min(vec1.size, vec2.size)
+            return np.vdot(vec1[:num_states], vec2[:num_states])
+        vec_handles = [V.VecHandleInMemory(vec) for vec in vecs]
+        my_VS = VectorSpaceHandles(inner_product=inner_product,
+            weigh_tasks=True, verbosity=0)
+        my_VS.max_vecs_per_proc = self.max_vecs_per_proc
+        self.assertEqual(my_VS._find_task_weights(vec_handles),
+            [vec.nbytes for vec in vecs])
+        IP_mat_true = np.array([[inner_product(vec1, vec2) for vec2 in vecs]
+            for vec1 in vecs])
+        np.testing.assert_allclose(
+            my_VS.compute_inner_product_mat(vec_handles, vec_handles[:4]),
+            IP_mat_true[:, :4])
+        np.testing.assert_allclose(
+            my_VS.compute_symmetric_inner_product_mat(vec_handles),
+            IP_mat_true)
+
+
+
+    #@unittest.skip('testing other things')
+    def test_node_cache(self):
+        """Test that vecs are shared through the node cache, and that results
+        are the same with it."""
+        num_procs_per_node = parallel.get_num_procs() // \
+            parallel.get_num_nodes()
+        cache = _NodeVecCache(2 * num_procs_per_node)
+        vec = np.random.random(5)
+        vec_handles = cache.wrap([V.VecHandleInMemory(vec),
+            V.VecHandleInMemory(vec), V.VecHandleInMemory(vec),
+            V.VecHandleInMemory({'vec': vec})], 'test')
+        # The first get saves the vec in the cache
+        for vec_handle in vec_handles[:3]:
+            np.testing.assert_equal(vec_handle.get(), vec)
+            np.testing.assert_equal(vec_handle.get(), vec)
+        parallel.barrier()
+        cached_vec = vec_handles[0].get()
+        self.assertIsInstance(cached_vec, np.memmap)
+        self.assertFalse(cached_vec.flags.writeable)
+        # Each proc saves at most its share of the vecs, and others are not
+        # cached
+        self.assertLessEqual(cache._num_vecs_saved, 2)
+        self.assertEqual(vec_handles[3].get(), {'vec': vec})
+        cache.close()
+        self.assertFalse(os.path.exists(cache.cache_dir))
+
+        num_states = 6
+        num_vecs = self.total_num_vecs_in_mem * 2 + 1
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        coeff_mat = parallel.call_and_bcast(np.random.random, (num_vecs, 3))
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_vecs)]
+        for schedule in ['static', 'dynamic']:
+            my_VS = VectorSpaceHandles(inner_product=np.vdot,
+                max_vecs_per_node=(
+                self.max_vecs_per_proc * num_procs_per_node + 2),
+                node_cache_vecs=2, schedule=schedule, verbosity=0)
+            self.assertEqual(my_VS.max_vecs_per_proc, self.max_vecs_per_proc)
+            np.testing.assert_allclose(
+                my_VS.compute_inner_product_mat(vec_handles, vec_handles[:3]),
+                np.dot(vec_array.T, vec_array[:, :3]))
+            np.testing.assert_allclose(
+                my_VS.compute_symmetric_inner_product_mat(vec_handles),
+                np.dot(vec_array.T, vec_array))
+            sum_handles = [V.VecHandlePickle(
+                join(self.test_dir, 'sum_%03d.pkl'%i)) for i in range(3)]
+            my_VS.lin_combine(sum_handles, vec_handles, coeff_mat)
+            np.testing.assert_allclose(
+                np.array([handle.get() for handle in sum_handles]).T,
+                np.dot(vec_array, coeff_mat))
+
+
+    #@unittest.skip('testing other things')
+    def test_checkpoint(self):
+        """Test that inner products saved in checkpoints are restored instead
+        of recomputed."""
+        num_states = 7
+        num_vecs = self.total_num_vecs_in_mem * 2 + 1
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        adv_vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs - 2))
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_vecs)]
+        adv_vec_handles = [V.VecHandleInMemory(adv_vec_array[:, i])
+            for i in range(num_vecs - 2)]
+        num_IPs = [0]
+        def inner_product(vec1, vec2):
+            num_IPs[0] += 1
+            return np.vdot(vec1, vec2)
+
+        for schedule in ['static', 'dynamic']:
+            checkpoint_dir = join(self.test_dir, 'checkpoint_' + schedule)
+            def compute_IP_mats():
+                num_IPs[0] = 0
+                tracer = Tracer()
+                my_VS = VectorSpaceHandles(inner_product=inner_product,
+                    schedule=schedule, checkpoint_dir=checkpoint_dir,
+                    checkpoint_interval=0, tracer=tracer, verbosity=0)
+                my_VS.max_vecs_per_proc = self.max_vecs_per_proc
+                np.testing.assert_allclose(
+                    my_VS.compute_inner_product_mat(
+                    vec_handles, adv_vec_handles),
+                    np.dot(vec_array.T, adv_vec_array))
+                num_IPs_nonsym = num_IPs[0]
+                num_gets_nonsym = tracer.summarize().get(
+                    'get', {'count': 0})['count']
+                np.testing.assert_allclose(
+                    my_VS.compute_symmetric_inner_product_mat(vec_handles),
+                    np.dot(vec_array.T, vec_array))
+                self.assertEqual(my_VS.checkpoint_index, 2)
+                return (num_IPs_nonsym, num_IPs[0] - num_IPs_nonsym,
+                    num_gets_nonsym)
+            num_IPs_computed = compute_IP_mats()
+
+            # Simulate a run that was killed after saving one tile of the
+            # first matrix.  The second matrix was finished, so no inner
+            # products are computed for it (the cost model was calibrated for
+            # the first).  Only the vecs of the tiles that were not saved are
+            # retrieved.
+            manifest_path = join(checkpoint_dir, 'IP_mat_000_np%05d_rank%05d'
+                '.json'%(parallel.get_num_procs(), parallel.get_rank()))
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            manifest['is_complete'] = False
+            manifest['file_names'] = manifest['file_names'][:1]
+            with open(manifest_path, 'w') as manifest_file:
+                json.dump(manifest, manifest_file)
+            parallel.barrier()
+            num_IPs_restarted = compute_IP_mats()
+            self.assertLessEqual(num_IPs_restarted[0], num_IPs_computed[0])
+            if not parallel.is_distributed():
+                self.assertLess(num_IPs_restarted[0], num_IPs_computed[0])
+                self.assertLess(num_IPs_restarted[2], num_IPs_computed[2])
+            self.assertEqual(num_IPs_restarted[1], 0)
+
+            # Files of a run with a different number of processors/MPI
+            # workers, which did not finish, are kept separately and don't
+            # stop the finished matrices from being restored.
+            if parallel.is_rank_zero():
+                with open(join(checkpoint_dir, 'IP_mat_001_np%05d_rank00000'
+                    '.json'%parallel.get_num_procs())) as manifest_file:
+                    manifest = json.load(manifest_file)
+                with open(join(checkpoint_dir, 'IP_mat_001_np%05d_rank00000'
+                    '.json'%(parallel.get_num_procs() + 1)), 'w') as \
+                    manifest_file:
+                    json.dump(dict(manifest, file_names=[],
+                        num_procs=parallel.get_num_procs() + 1,
+                        is_complete=False), manifest_file)
+            parallel.barrier()
+            self.assertEqual(compute_IP_mats(), (0, 0, 0))
+
+            # Checkpoints of other matrices are not used
+            my_VS = VectorSpaceHandles(inner_product=np.vdot,
+                checkpoint_dir=checkpoint_dir, verbosity=0)
+            self.assertRaises(ValueError,
+                my_VS.compute_symmetric_inner_product_mat, vec_handles)
+
+
+
+    #@unittest.skip('testing other things')
+    def test_find_chunk_sizes(self):
+        """Test that spare memory is used for larger inner chunks."""
+        # All outer tasks fit, rest of memory goes to the inner chunk
+        self.assertEqual(_find_chunk_sizes(3, 20, 10), (3, 7))
+        # Inner chunk is no larger than the number of inner tasks
+        self.assertEqual(_find_chunk_sizes(3, 4, 10), (3, 4))
+        # Outer tasks need two loops, so they are split evenly
+        self.assertEqual(_find_chunk_sizes(12, 20, 10), (6, 4))
+        # Extra chunks in memory for prefetching and write-behind
+        self.assertEqual(_find_chunk_sizes(12, 20, 10,
+            num_inner_chunks_in_mem=2), (6, 2))
+        self.assertEqual(_find_chunk_sizes(3, 20, 10,
+            num_outer_chunks_in_mem=2, num_inner_chunks_in_mem=2), (3, 2))
+        # Always at least one vector in each chunk
+        self.assertEqual(_find_chunk_sizes(5, 5, 1), (1, 1))
+        self.assertEqual(_find_chunk_sizes(0, 0, 10), (1, 1))
+
+
+
+    #@unittest.skip('testing other things')
+    def test_add_sum_layers(self):
+        """Test that layers of array vecs are added with matrix
+        multiplications, in several slabs, as they are for other vecs."""
+        num_bases = 4
+        num_sums = 3
+        # Non-contiguous, 2D vecs, which are multiplied in several slabs
+        basis_array = np.random.random((60, 40, num_bases))
+        basis_vecs = [basis_array[:, :, i] for i in range(num_bases)]
+        coeff_block = np.mat(np.random.random((num_bases, num_sums)) +
+            1j * np.random.random((num_bases, num_sums)))
+        sums_true = [sum([basis_vecs[basis_index] *
+            coeff_block[basis_index, sum_index]
+            for basis_index in range(num_bases)])
+            for sum_index in range(num_sums)]
+        sum_layers = [None] * num_sums
+        _add_sum_layers(sum_layers, basis_vecs[:2], coeff_block[:2])
+        _add_sum_layers(sum_layers, basis_vecs[2:], coeff_block[2:])
+        for sum_layer, sum_true in zip(sum_layers, sums_true):
+            self.assertEqual(type(sum_layer), np.ndarray)
+            np.testing.assert_allclose(sum_layer, sum_true)
+
+        # Other vecs are scaled and added one at a time
+        basis_vecs = [np.mat(vec) for vec in basis_vecs]
+        sum_layers = [None] * num_sums
+        _add_sum_layers(sum_layers, basis_vecs, coeff_block)
+        for sum_layer, sum_true in zip(sum_layers, sums_true):
+            self.assertEqual(type(sum_layer), np.matrix)
+            np.testing.assert_allclose(sum_layer, sum_true)
+
+
+    #@unittest.skip('testing other things')
+    def test_sum_buffers(self):
+        """Test that sums are added in place, and that the arrays of sums
+        that have been put are reused when the handles don't keep them."""
+        num_states = 6
+        num_bases = 5
+        num_sums = 4 * self.total_num_vecs_in_mem
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_bases))
+        coeff_mat = parallel.call_and_bcast(np.random.random,
+            (num_bases, num_sums))
+        sums_true = np.dot(vec_array, coeff_mat)
+
+        # Vector objects with an axpy method
+        num_axpys = [0]
+        class AxpyVec(V.Vector):
+            def __init__(self, data):
+                self.data = data
+            def __add__(self, other):
+                return AxpyVec(self.data + other.data)
+            def __mul__(self, scalar):
+                return AxpyVec(self.data * scalar)
+            def axpy(self, alpha, other):
+                num_axpys[0] += 1
+                self.data += alpha * other.data
+        basis_vec_handles = [V.VecHandleInMemory(AxpyVec(vec_array[:, i]))
+            for i in range(num_bases)]
+        sum_vec_handles = [V.VecHandleInMemory() for i in range(num_sums)]
+        my_vec_ops = VectorSpaceHandles(verbosity=0)
+        my_vec_ops.max_vecs_per_proc = self.max_vecs_per_proc
+        my_vec_ops.lin_combine(sum_vec_handles, basis_vec_handles, coeff_mat)
+        for sum_index, sum_vec_handle in enumerate(sum_vec_handles):
+            if sum_vec_handle.vec is not None:
+                np.testing.assert_allclose(sum_vec_handle.vec.data,
+                    sums_true[:, sum_index])
+        self.assertGreater(num_axpys[0], 0)
+
+        # Keep the arrays put to files, so reused ones are put again
+        put_vecs = []
+        class VecHandleRecord(V.VecHandlePickle):
+            def _put(self, vec):
+                put_vecs.append(vec)
+                V.VecHandlePickle._put(self, vec)
+        basis_vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_bases)]
+        for num_put_threads in [0, 2]:
+            del put_vecs[:]
+            my_vec_ops = VectorSpaceHandles(inner_product=np.vdot,
+                num_put_threads=num_put_threads, verbosity=0)
+            my_vec_ops.max_vecs_per_proc = self.max_vecs_per_proc
+            my_vec_ops.max_vecs_per_node = self.max_vecs_per_proc
+            sum_vec_handles = [VecHandleRecord(join(self.test_dir,
+                'sum_%d_%03d.pkl'%(num_put_threads, i)))
+                for i in range(num_sums)]
+            my_vec_ops.lin_combine(sum_vec_handles, basis_vec_handles,
+                coeff_mat)
+            parallel.barrier()
+            np.testing.assert_allclose(
+                np.array([handle.get() for handle in sum_vec_handles]).T,
+                sums_true)
+            self.assertLess(len(set([id(vec) for vec in put_vecs])),
+                len(put_vecs))
+
+
+    #@unittest.skip('testing other things')
+    def test_npy_vec_handles(self):
+        """Test that memory-mapped vecs are summed with matrix
+        multiplications, and that the arrays of their sums are reused."""
+        num_states = 6
+        num_bases = 6
+        num_sums = 3
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_bases))
+        coeff_mat = parallel.call_and_bcast(np.random.random,
+            (num_bases, num_sums))
+        basis_vec_handles = [V.VecHandleNpy(join(self.test_dir,
+            'basis_%03d.npy'%i)) for i in range(num_bases)]
+        if parallel.is_rank_zero():
+            for basis_index, basis_vec_handle in enumerate(basis_vec_handles):
+                basis_vec_handle.put(vec_array[:, basis_index])
+        parallel.barrier()
+        self.assertTrue(_is_array_chunk([basis_vec_handle.get()
+            for basis_vec_handle in basis_vec_handles]))
+
+        put_vecs = []
+        class VecHandleRecord(V.VecHandleNpy):
+            def _put(self, vec):
+                put_vecs.append(vec)
+                V.VecHandleNpy._put(self, vec)
+        sum_vec_handles = [VecHandleRecord(join(self.test_dir,
+            'sum_%03d.npy'%i)) for i in range(num_sums)]
+        num_axpys = [0]
+        axpy = V.axpy
+        def count_axpy(*args):
+            num_axpys[0] += 1
+            return axpy(*args)
+        V.axpy = count_axpy
+        try:
+            my_vec_ops = VectorSpaceHandles(inner_product=np.vdot,
+                verbosity=0)
+            my_vec_ops.max_vecs_per_proc = self.max_vecs_per_proc
+            my_vec_ops.max_vecs_per_node = self.max_vecs_per_proc
+            my_vec_ops.lin_combine(sum_vec_handles, basis_vec_handles,
+                coeff_mat)
+        finally:
+            V.axpy = axpy
+        parallel.barrier()
+        np.testing.assert_allclose(
+            np.array([handle.get() for handle in sum_vec_handles]).T,
+            np.dot(vec_array, coeff_mat))
+        self.assertEqual(num_axpys[0], 0)
+        self.assertTrue(all([type(vec) is np.ndarray for vec in put_vecs]))
+
+
+    #@unittest.skip('testing other things')
+    def test_plan(self):
+        """Test that the predicted costs match those of the operations, and
+        that the cost model is calibrated once."""
+        num_states = 5
+        num_rows, num_cols = 9, 4
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_rows))
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_rows)]
+        num_IPs = [0]
+        def inner_product(vec1, vec2):
+            num_IPs[0] += 1
+            return np.vdot(vec1, vec2)
+
+        my_VS = VectorSpaceHandles(inner_product=inner_product,
+            max_vecs_per_node=4, verbosity=0)
+        self.assertRaises(modred.util.UndefinedError, my_VS.plan,
+            'lin_combine', num_rows, num_cols)
+        my_VS.calibrate(vec_handles[0])
+        cost_model = my_VS.cost_model
+        self.assertEqual(cost_model['vec_nbytes'], vec_array[:, 0].nbytes)
+
+        for schedule in ['static', 'dynamic']:
+            for max_vecs_per_node in [3, 5, 20]:
+                tracer = Tracer()
+                my_VS = VectorSpaceHandles(inner_product=inner_product,
+                    max_vecs_per_node=max_vecs_per_node *
+                    parallel.get_num_procs() // parallel.get_num_nodes(),
+                    schedule=schedule, tracer=tracer, verbosity=0)
+                my_VS.cost_model = cost_model
+                plans = [
+                    my_VS.plan('compute_inner_product_mat', num_cols,
+                    num_rows),
+                    my_VS.plan('compute_symmetric_inner_product_mat',
+                    num_rows),
+                    my_VS.plan('lin_combine', num_rows, num_cols)]
+                num_gets = []
+                num_IPs[0] = 0
+                my_VS.compute_inner_product_mat(
+                    vec_handles[:num_cols], vec_handles)
+                num_gets.append(tracer.summarize()['get']['count'])
+                num_IPs_nonsym = num_IPs[0]
+                del tracer.events[:]
+                my_VS.compute_symmetric_inner_product_mat(vec_handles)
+                num_gets.append(tracer.summarize()['get']['count'])
+                del tracer.events[:]
+                sum_handles = [V.VecHandleInMemory() for i in range(num_cols)]
+                my_VS.lin_combine(sum_handles, vec_handles,
+                    np.ones((num_rows, num_cols)))
+                num_gets.append(tracer.summarize()['get']['count'])
+                self.assertIs(my_VS.cost_model, cost_model)
+
+                for plan in plans:
+                    self.assertEqual(plan['schedule'], schedule)
+                    self.assertLessEqual(plan['peak_bytes'],
+                        my_VS.max_vecs_per_proc * cost_model['vec_nbytes'])
+                if not parallel.is_distributed():
+                    self.assertEqual(
+                        [plan['num_gets'] for plan in plans], num_gets)
+                    self.assertEqual(plans[0]['num_inner_products'],
+                        num_IPs_nonsym)
+                    self.assertEqual(plans[1]['num_inner_products'],
+                        num_IPs[0] - num_IPs_nonsym)
+                    self.assertEqual(plans[2]['num_puts'], num_cols)
+                    for plan in plans:
+                        self.assertEqual(plan['num_message_bytes'], 0)
+                elif schedule == 'static':
+                    for plan, num_gets_proc in zip(plans, num_gets):
+                        self.assertLessEqual(num_gets_proc, plan['num_gets'])
+                        self.assertGreater(plan['num_message_bytes'], 0)
+
+        # The planner can predict for other numbers of processors, and
+        # chooses the dynamic schedule when messages are slow
+        my_VS = VectorSpaceHandles(inner_product=np.vdot, max_vecs_per_node=8,
+            schedule='auto', verbosity=0)
+        my_VS.cost_model = {'get_time': 1., 'inner_product_time': 0.,
+            'add_scale_time': 0., 'message_time': 0., 'vec_nbytes': 8}
+        plan = my_VS.plan('compute_inner_product_mat', 20, 20, num_procs=4,
+            num_nodes=4)
+        self.assertEqual(plan['schedule'], 'static')
+        self.assertEqual(plan['num_message_bytes'], 3 * 5 * 8)
+        my_VS.cost_model['message_time'] = 100.
+        self.assertEqual(my_VS.plan('compute_inner_product_mat', 20, 20,
+            num_procs=4, num_nodes=4)['schedule'], 'dynamic')
+
+
+    #@unittest.skip('testing other things')
+    def test_max_bytes_per_node(self):
+        """Test that the memory budget is set from the size of the vecs and
+        the peak memory used is recorded."""
+        num_states = 100
+        num_vecs = 25
+        num_sums = 12
+        vec_nbytes = num_states * np.zeros(1).itemsize
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        coeff_mat = parallel.call_and_bcast(np.random.random,
+            (num_vecs, num_sums))
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_vecs)]
+        num_procs_per_node = parallel.get_num_procs() // \
+            parallel.get_num_nodes()
+        max_vecs_per_node = 8 * num_procs_per_node
+        # Room for the safety margin and the scratch vecs
+        max_bytes_per_node = int(np.ceil((max_vecs_per_node + 2 *
+            num_procs_per_node) * vec_nbytes / 0.8))
+        for num_get_threads in [0, 1]:
+            my_vec_ops = VectorSpaceHandles(inner_product=np.vdot,
+                max_bytes_per_node=max_bytes_per_node,
+                num_get_threads=num_get_threads, num_put_threads=1,
+                verbosity=0)
+
+            np.testing.assert_allclose(
+                my_vec_ops.compute_inner_product_mat(
+                    vec_handles[:7], vec_handles),
+                np.dot(vec_array[:, :7].T, vec_array))
+            self.assertEqual(my_vec_ops.max_vecs_per_node, max_vecs_per_node)
+            self.assertTrue(0 < my_vec_ops.peak_bytes_per_proc <=
+                my_vec_ops.max_vecs_per_proc * vec_nbytes)
+
+            np.testing.assert_allclose(
+                my_vec_ops.compute_symmetric_inner_product_mat(vec_handles),
+                np.dot(vec_array.T, vec_array))
+            self.assertTrue(0 < my_vec_ops.peak_bytes_per_proc <=
+                my_vec_ops.max_vecs_per_proc * vec_nbytes)
+
+            sum_handles = [V.VecHandleInMemory() for i in range(num_sums)]
+            my_vec_ops.lin_combine(sum_handles, vec_handles, coeff_mat)
+            sums_true = np.dot(vec_array, coeff_mat)
+            for sum_index, sum_handle in enumerate(sum_handles):
+                if sum_handle.vec is not None:
+                    np.testing.assert_allclose(
+                        sum_handle.get(), sums_true[:, sum_index])
+            self.assertTrue(0 < my_vec_ops.peak_bytes_per_proc <=
+                my_vec_ops.max_vecs_per_proc * vec_nbytes)
+
+        # Memory available on the node
+        my_vec_ops = VectorSpaceHandles(inner_product=np.vdot,
+            max_bytes_per_node='auto', verbosity=0)
+        if util.get_available_memory() is not None:
+            np.testing.assert_allclose(
+                my_vec_ops.compute_symmetric_inner_product_mat(vec_handles),
+                np.dot(vec_array.T, vec_array))
+            self.assertTrue(my_vec_ops.max_vecs_per_node >= 1)
+
+
+
+    #@unittest.skip('testing other things')
+    def test_prefetch(self):
+        """Test inner products and linear combinations when prefetching."""
+        num_states = 5
+        num_vecs = 4 * self.total_num_vecs_in_mem + 1
+        num_sums = 3 * self.total_num_vecs_in_mem
+        my_vec_ops = VectorSpaceHandles(inner_product=np.vdot,
+            num_get_threads=2, verbosity=0)
+        my_vec_ops.max_vecs_per_proc = self.max_vecs_per_proc
+
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        coeff_mat = parallel.call_and_bcast(np.random.random,
+            (num_vecs, num_sums))
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_vecs)]
+        np.testing.assert_allclose(
+            my_vec_ops.compute_inner_product_mat(
+                vec_handles[:7], vec_handles),
+            np.dot(vec_array[:, :7].T, vec_array))
+        np.testing.assert_allclose(
+            my_vec_ops.compute_symmetric_inner_product_mat(vec_handles),
+            np.dot(vec_array.T, vec_array))
+
+        sum_handles = [V.VecHandleInMemory() for i in range(num_sums)]
+        my_vec_ops.lin_combine(sum_handles, vec_handles, coeff_mat)
+        sums_true = np.dot(vec_array, coeff_mat)
+        for sum_index, sum_handle in enumerate(sum_handles):
+            if sum_handle.vec is not None:
+                np.testing.assert_allclose(
+                    sum_handle.get(), sums_true[:, sum_index])
+
+
+
+    #@unittest.skip('testing other things')
+    def test_write_behind(self):
+        """Test linear combinations when sums are put in the background."""
+        num_states = 5
+        num_vecs = 2 * self.total_num_vecs_in_mem + 1
+        num_sums = 3 * self.total_num_vecs_in_mem
+        vec_array = parallel.call_and_bcast(np.random.random,
+            (num_states, num_vecs))
+        coeff_mat = parallel.call_and_bcast(np.random.random,
+            (num_vecs, num_sums))
+        vec_handles = [V.VecHandleInMemory(vec_array[:, i])
+            for i in range(num_vecs)]
+        sums_true = np.dot(vec_array, coeff_mat)
+        for num_get_threads in [0, 1]:
+            my_vec_ops = VectorSpaceHandles(inner_product=np.vdot,
+                num_get_threads=num_get_threads, num_put_threads=2,
+                verbosity=0)
+            my_vec_ops.max_vecs_per_proc = self.max_vecs_per_proc
+            sum_handles = [V.VecHandleInMemory() for i in range(num_sums)]
+            my_vec_ops.lin_combine(sum_handles, vec_handles, coeff_mat)
+            for sum_index, sum_handle in enumerate(sum_handles):
+                if sum_handle.vec is not None:
+                    np.testing.assert_allclose(
+                        sum_handle.get(), sums_true[:, sum_index])
+
+        # Errors raised by put in the background are raised again
+        class BadHandle(V.VecHandleInMemory):
+            def _put(self, vec):
+                raise IOError('cannot put')
+        my_vec_ops = VectorSpaceHandles(inner_product=np.vdot,
+            num_put_threads=1, verbosity=0)
+        self.assertRaises(IOError, my_vec_ops.lin_combine,
+            [BadHandle() for i in range(num_sums)], vec_handles, coeff_mat)
+
+
 if __name__=='__main__':
     unittest.main()
@@ -0,0 +1,152 @@
+"""Tracing of the phases of vector space operations.
+
+A :py:class:`Tracer` records the time each processor/MPI worker spends
+retrieving vectors, computing inner products, waiting for vectors from other
+processors/MPI workers, etc., and the number of bytes handled.  Give one to
+:py:class:`vectorspace.VectorSpaceHandles` to trace its operations, then
+summarize the events or save them in the Chrome trace format, e.g., to see
+load imbalance in a viewer such as ``chrome://tracing`` or Perfetto.
+"""
+from __future__ import division
+from __future__ import absolute_import
+from future.builtins import object
+import contextlib
+import json
+import threading
+from time import time
+
+from . import parallel
+
+
+class Tracer(object):
+    """Records events, each a phase of work done by this processor/MPI worker.
+
+    Events are named by the phase:
+
+    - ``'get'`` and ``'put'``: retrieving and putting a vector.
+    - ``'inner_product'``: computing a tile of inner products.
+    - ``'sum'``: adding a chunk of basis vectors into sums.
+    - ``'wait'``: waiting for vectors sent by other processors/MPI workers.
+    - ``'barrier'``, ``'allreduce'`` and ``'gather'``: collective operations.
+
+    Each event is a dictionary with the ``name``, the ``start`` time (in
+    seconds since the epoch), the ``duration`` (in seconds), ``num_bytes``
+    handled (0 if not applicable), and the name of the ``thread`` it ran in,
+    since vectors may be retrieved and put in background threads.  Events are
+    stored in ``events``.  To handle events as they happen instead, e.g., to
+    send them to another profiler, overwrite :py:meth:`record`.
+    """
+    def __init__(self):
+        self.events = []
+
+
+    def record(self, name, start_time, end_time, num_bytes=0):
+        """Records an event ``name`` that ran from ``start_time`` to
+        ``end_time`` (both from ``time.time()``) and handled ``num_bytes``.
+        May be called from several threads."""
+        self.events.append({
+            'name': name, 'start': start_time,
+            'duration': end_time - start_time, 'num_bytes': num_bytes,
+            'thread': threading.current_thread().name})
+
+
+    @contextlib.contextmanager
+    def span(self, name, num_bytes=0):
+        """Context manager that records the code run within it as an event
+        ``name`` that handled ``num_bytes``."""
+        start_time = time()
+        try:
+            yield
+        finally:
+            self.record(name, start_time, time(), num_bytes)
+
+
+    def summarize(self):
+        """Returns the events of this processor/MPI worker, totalled by name.
+
+        Returns:
+            ``summary``: Dictionary whose keys are event names and whose
+            values are dictionaries with the number of events (``count``),
+            their total ``duration`` (in seconds), and their total
+            ``num_bytes``.
+        """
+        summary = {}
+        for event in self.events:
+            totals = summary.setdefault(
+                event['name'], {'count': 0, 'duration': 0., 'num_bytes': 0})
+            totals['count'] += 1
+            totals['duration'] += event['duration']
+            totals['num_bytes'] += event['num_bytes']
+        return summary
+
+
+    def get_chrome_trace(self):
+        """Returns the events of all processors/MPI workers in the Chrome
+        trace format, on rank zero, and None on the others.
+
+        Returns:
+            ``trace``: Dictionary with a list of ``traceEvents``.  Each
+            processor/MPI worker is a process, labelled by its rank, and each
+            of its threads is a thread.  Times are in microseconds since the
+            first event of any processor/MPI worker.
+
+        Must be called by all processors/MPI workers.
+        """
+        if parallel.is_distributed():
+            all_events = parallel.comm.gather(self.events, root=0)
+        else:
+            all_events = [self.events]
+        if not parallel.is_rank_zero():
+            return None
+        start_times = [event['start'] for events in all_events
+            for event in events]
+        if len(start_times) > 0:
+            first_start_time = min(start_times)
+        else:
+            first_start_time = 0.
+        trace_events = []
+        for rank, events in enumerate(all_events):
+            trace_events.append({
+                'name': 'process_name', 'ph': 'M', 'pid': rank,
+                'args': {'name': 'rank %d'%rank}})
+            for event in events:
+                trace_events.append({
+                    'name': event['name'], 'ph': 'X', 'pid': rank,
+                    'tid': event['thread'],
+                    'ts': (event['start'] - first_start_time) * 1e6,
+                    'dur': event['duration'] * 1e6,
+                    'args': {'num_bytes': int(event['num_bytes'])}})
+        return {'traceEvents': trace_events}
+
+
+    def save_chrome_trace(self, file_name):
+        """Saves the events of all processors/MPI workers to a JSON file in
+        the Chrome trace format (see :py:meth:`get_chrome_trace`), from rank
+        zero.  Must be called by all processors/MPI workers."""
+        trace = self.get_chrome_trace()
+        if parallel.is_rank_zero():
+            with open(file_name, 'w') as trace_file:
+                json.dump(trace, trace_file)
+        parallel.barrier()
+
+
+class _NoSpan(object):
+    """Context manager that does nothing, used in place of
+    :py:meth:`Tracer.span` when there is no tracer."""
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        return False
+
+
+_no_span = _NoSpan()
+
+
+def span(tracer, name, num_bytes=0):
+    """Returns ``tracer.span(name, num_bytes)``, or a context manager that
+    does nothing if ``tracer`` is None."""
+    if tracer is None:
+        return _no_span
+    return tracer.span(name, num_bytes)
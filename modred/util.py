@@ -3,6 +3,7 @@ from __future__ import print_function
 from future.builtins import range
 from future.builtins import object
 import inspect
+import sys
 import os
 
 import numpy as np
@@ -127,6 +128,64 @@ def load_array_text(file_name, delimiter=None, is_complex=False):
     return np.array(array.view(dtype))
 
 
+def save_array_binary(array, file_name):
+    """Saves an array or matrix to a binary file.
+
+    Args:
+        ``array``: Matrix or array to save to file.
+
+        ``file_name``: Filepath to location where data is to be saved.
+
+    The array is saved in the ``.npy`` format of ``numpy.save``, exactly
+    at ``file_name``, unless ``file_name`` ends with ``.npz``, in which case
+    it is saved in the compressed ``.npz`` format of
+    ``numpy.savez_compressed``.  Both keep the shape and type of the array
+    (including complex data) and are much faster to write and read than text
+    files.  Files can be read in Python with :py:func:`load_array_binary` or
+    ``numpy.load``.
+    """
+    # Matrices are saved as 2D arrays
+    array_save = np.asarray(array)
+    with open(file_name, 'wb') as array_file:
+        if file_name.endswith('.npz'):
+            np.savez_compressed(array_file, array=array_save)
+        else:
+            np.save(array_file, array_save)
+
+
+def load_array_binary(file_name, mmap_mode=None):
+    """Reads data saved in a binary file, returns an array.
+
+    Args:
+        ``file_name``: Name of file from which to load data.
+
+    Kwargs:
+        ``mmap_mode``: If not None, ``.npy`` files are memory-mapped with this
+        mode (see ``numpy.load``), e.g., ``'r'``, so that they are read
+        lazily, as elements are used.  Compressed ``.npz`` files are always
+        read completely.
+
+    Returns:
+        ``array``: Array containing loaded data.
+
+    See :py:func:`save_array_binary` for the formats read by this function.
+    To memory-map matrices retrieved by, e.g., :py:class:`pod.PODHandles`,
+    give it ``get_mat=functools.partial(load_array_binary, mmap_mode='r')``.
+    """
+    loaded = np.load(file_name, mmap_mode=mmap_mode, allow_pickle=False)
+    if isinstance(loaded, np.ndarray):
+        return loaded
+    # .npz file, holding one array
+    with loaded:
+        if 'array' in loaded.files:
+            return loaded['array']
+        if len(loaded.files) != 1:
+            raise ValueError(
+                'Cannot load an array, file %s has several arrays %s' %
+                (file_name, loaded.files))
+        return loaded[loaded.files[0]]
+
+
 def get_file_list(directory, file_extension=None):
     """Returns list of files in ``directory`` with ``file_extension``."""
     files = os.listdir(directory)
@@ -152,6 +211,108 @@ def get_data_members(obj):
     return data_members
 
 
+def get_nbytes(obj):
+    """Returns an estimate of the memory used by ``obj``, in bytes.
+
+    Arrays report their ``nbytes``.  Lists, tuples, dicts, and objects with
+    a ``__dict__`` (e.g., custom vector classes) are searched recursively for
+    arrays.  Other objects use ``sys.getsizeof``.
+    """
+    num_bytes = 0
+    objs = [obj]
+    visited_IDs = set()
+    while len(objs) > 0:
+        obj = objs.pop()
+        if id(obj) in visited_IDs:
+            continue
+        visited_IDs.add(id(obj))
+        if isinstance(obj, np.ndarray):
+            num_bytes += obj.nbytes
+        elif isinstance(obj, (list, tuple)):
+            objs.extend(obj)
+        elif isinstance(obj, dict):
+            objs.extend(obj.values())
+        elif hasattr(obj, '__dict__'):
+            objs.extend(vars(obj).values())
+        else:
+            num_bytes += sys.getsizeof(obj)
+    return num_bytes
+
+
+def _read_meminfo_available(meminfo_path='/proc/meminfo'):
+    """Returns ``MemAvailable`` (or ``MemFree`` on old kernels) from
+    ``/proc/meminfo`` in bytes, or None if it cannot be read."""
+    try:
+        with open(meminfo_path) as meminfo_file:
+            meminfo = dict(line.split(':', 1) for line in meminfo_file
+                if ':' in line)
+    except (IOError, OSError):
+        return None
+    for key in ['MemAvailable', 'MemFree']:
+        if key in meminfo:
+            # Values are in kB
+            return int(meminfo[key].split()[0]) * 1024
+    return None
+
+
+def _read_cgroup_available(cgroup_path='/proc/self/cgroup',
+    cgroup_root='/sys/fs/cgroup'):
+    """Returns the memory remaining under this process's cgroup memory limit
+    in bytes, or None if there is no limit or it cannot be read.  Supports
+    cgroup v2 (``memory.max``) and v1 (``memory.limit_in_bytes``)."""
+    try:
+        with open(cgroup_path) as cgroup_file:
+            cgroup_lines = cgroup_file.read().splitlines()
+    except (IOError, OSError):
+        cgroup_lines = []
+    # Candidate (limit, usage) files, most specific first.  The cgroup path
+    # may not exist inside a container, where the root is this cgroup.
+    candidates = []
+    for line in cgroup_lines:
+        fields = line.split(':', 2)
+        if len(fields) != 3:
+            continue
+        if fields[0] == '0' and fields[1] == '':
+            for directory in [os.path.join(cgroup_root,
+                fields[2].lstrip('/')), cgroup_root]:
+                candidates.append((os.path.join(directory, 'memory.max'),
+                    os.path.join(directory, 'memory.current')))
+        elif 'memory' in fields[1].split(','):
+            for directory in [os.path.join(cgroup_root, 'memory',
+                fields[2].lstrip('/')), os.path.join(cgroup_root, 'memory')]:
+                candidates.append((
+                    os.path.join(directory, 'memory.limit_in_bytes'),
+                    os.path.join(directory, 'memory.usage_in_bytes')))
+    for limit_path, usage_path in candidates:
+        try:
+            with open(limit_path) as limit_file:
+                limit = limit_file.read().strip()
+            with open(usage_path) as usage_file:
+                usage = int(usage_file.read().strip())
+        except (IOError, OSError, ValueError):
+            continue
+        # No limit ("max" in v2, a huge number in v1)
+        if limit == 'max' or int(limit) >= 2**60:
+            return None
+        return max(0, int(limit) - usage)
+    return None
+
+
+def get_available_memory():
+    """Returns the memory available on this node, in bytes, or None if it
+    cannot be determined.
+
+    This is the smaller of ``MemAvailable`` in ``/proc/meminfo`` and the
+    memory remaining under the cgroup limit of this process (e.g., in a
+    container or batch job), when there is one.
+    """
+    available = [num_bytes for num_bytes in [_read_meminfo_available(),
+        _read_cgroup_available()] if num_bytes is not None]
+    if len(available) == 0:
+        return None
+    return min(available)
+
+
 def sum_arrays(arr1, arr2):
     """Used for ``allreduce`` command."""
     return arr1 + arr2
@@ -175,6 +336,37 @@ def smart_eq(arg1, arg2):
     return eq
 
 
+def extend_mat(mat, new_cols, new_block, new_rows=None):
+    """Extends a matrix by appending columns on the right and rows on the
+    bottom.
+
+    Args:
+        ``mat``: Matrix to extend, of shape ``(m, n)``.
+
+        ``new_cols``: Columns to append, of shape ``(m, k)``.
+
+        ``new_block``: Lower right block of extended matrix, of shape
+        ``(l, k)``.
+
+    Kwargs:
+        ``new_rows``: Rows to append, of shape ``(l, n)``.  If None, the
+        conjugate transpose of ``new_cols`` is used, as for a matrix of inner
+        products of a set of vectors with itself.
+
+    Returns:
+        ``extended_mat``: Matrix ``[[mat, new_cols], [new_rows, new_block]]``,
+        or None if ``mat`` is None (e.g., if it was only assembled on rank
+        zero).
+    """
+    if mat is None:
+        return None
+    new_cols = np.mat(new_cols)
+    if new_rows is None:
+        new_rows = new_cols.H
+    return np.mat(np.bmat([[np.mat(mat), new_cols], [np.mat(new_rows),
+        np.mat(new_block)]]))
+
+
 class InnerProductBlock(object):
     """Only used in tests. Takes inner product of all vectors."""
     def __init__(self, inner_product):
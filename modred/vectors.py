@@ -9,17 +9,136 @@ from future.builtins import str
 from future import standard_library
 standard_library.install_hooks()
 from future.builtins import object
+import os
 import pickle
+import hashlib
+import threading
 
 import numpy as np
 
 from . import util
 
 
+# Number of elements of NumPy arrays updated at once by axpy, which bounds
+# the size of its temporary arrays.
+_axpy_slab_size = 2**16
+
+
+def _get_file_size(path):
+    """Returns the size of the file at ``path`` in bytes, or None if it does
+    not exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def find_vec_handle_costs(vec_handles):
+    """Returns the relative costs of retrieving vectors with ``vec_handles``.
+
+    Args:
+        ``vec_handles``: List of vector handles.
+
+    Returns:
+        ``costs``: List of costs, from the ``get_cost`` method of each handle
+        (see :py:meth:`VecHandle.get_cost`), or None if any cost is not
+        known or all are zero.  Costs are relative, so can be used as the
+        ``task_weights`` of :py:func:`parallel.find_assignments`.
+    """
+    costs = []
+    for vec_handle in vec_handles:
+        get_cost = getattr(vec_handle, 'get_cost', None)
+        if get_cost is None:
+            return None
+        cost = get_cost()
+        if cost is None:
+            return None
+        costs.append(cost)
+    if sum(costs) <= 0:
+        return None
+    return costs
+
+
+def _get_file_key(path):
+    """Returns a string identifying the contents of the file at ``path`` by
+    its absolute path, inode, modification time, and size, or None if it
+    does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return repr((os.path.abspath(path), stat.st_ino, stat.st_mtime,
+        stat.st_size))
+
+
+def find_vec_handle_keys(vec_handles):
+    """Returns keys identifying the vectors of ``vec_handles``.
+
+    Args:
+        ``vec_handles``: List of vector handles.
+
+    Returns:
+        ``keys``: List of keys, from the ``get_key`` method of each handle
+        (see :py:meth:`VecHandle.get_key`), or None for handles without one.
+    """
+    keys = []
+    for vec_handle in vec_handles:
+        get_key = getattr(vec_handle, 'get_key', None)
+        if get_key is None:
+            keys.append(None)
+        else:
+            keys.append(get_key())
+    return keys
+
+
+def find_existing_vec_handles(vec_handles):
+    """Returns whether the vectors of ``vec_handles`` have already been put.
+
+    Args:
+        ``vec_handles``: List of vector handles.
+
+    Returns:
+        ``exist``: List of bools, from the ``exists`` method of each handle
+        (see :py:meth:`VecHandle.exists`), or False for handles without one.
+    """
+    exist = []
+    for vec_handle in vec_handles:
+        exists = getattr(vec_handle, 'exists', None)
+        exist.append(exists is not None and bool(exists()))
+    return exist
+
+
+def _put_file_atomically(path, put_file):
+    """Calls ``put_file`` with a temporary path next to ``path``, then
+    renames the temporary file to ``path``.  A file at ``path`` is therefore
+    complete, even if a run is killed while putting it."""
+    root, ext = os.path.splitext(path)
+    temp_path = root + '.tmp' + ext
+    put_file(temp_path)
+    os.rename(temp_path, path)
+
+
 class VecHandle(object):
-    """Recommended base class for vector handles (not required)."""
+    """Recommended base class for vector handles (not required).
+
+    ``put_keeps_vec`` is True if ``put`` may keep a reference to the vector
+    it is given, e.g., in memory.  Subclasses that only save a copy, e.g., to
+    a file, set it to False, which lets
+    :py:meth:`vectorspace.VectorSpaceHandles.lin_combine` reuse the memory
+    of the vectors it puts.
+
+    ``cache_key`` is a string set by the user that identifies the vector
+    (before the base vector is subtracted and it is scaled), e.g., for
+    vectors in memory, so that their inner products can be kept in a
+    :py:class:`gramcache.GramCache`.  It must change when the vector does.
+    """
+    put_keeps_vec = True
+    cache_key = None
     cached_base_vec_handle = None
     cached_base_vec = None
+    # Vectors may be retrieved from several threads (see the
+    # ``num_get_threads`` option of ``VectorSpaceHandles``).
+    _cached_base_vec_lock = threading.RLock()
 
 
     def __init__(self, base_vec_handle=None, scale=None):
@@ -36,12 +155,13 @@ class VecHandle(object):
         vec = self._get()
         if self.__base_vec_handle is None:
             return self.__scale_vec(vec)
-        if self.__base_vec_handle == VecHandle.cached_base_vec_handle:
-            base_vec = VecHandle.cached_base_vec
-        else:
-            base_vec = self.__base_vec_handle.get()
-            VecHandle.cached_base_vec_handle = self.__base_vec_handle
-            VecHandle.cached_base_vec = base_vec
+        with VecHandle._cached_base_vec_lock:
+            if self.__base_vec_handle == VecHandle.cached_base_vec_handle:
+                base_vec = VecHandle.cached_base_vec
+            else:
+                base_vec = self.__base_vec_handle.get()
+                VecHandle.cached_base_vec_handle = self.__base_vec_handle
+                VecHandle.cached_base_vec = base_vec
         return self.__scale_vec(vec - base_vec)
 
 
@@ -51,6 +171,33 @@ class VecHandle(object):
         return self._put(vec)
 
 
+    def get_key(self):
+        """Returns a string identifying the vector returned by ``get``, or
+        None if it cannot be identified.  It is found from the key of the
+        handle (see ``_get_key``), the key of the base vector handle, and the
+        scale factor."""
+        key = self._get_key()
+        if key is None:
+            return None
+        base_key = None
+        if self.__base_vec_handle is not None:
+            get_base_key = getattr(self.__base_vec_handle, 'get_key', None)
+            if get_base_key is None:
+                return None
+            base_key = get_base_key()
+            if base_key is None:
+                return None
+        return hashlib.sha1(
+            repr((key, base_key, self.scale)).encode('utf-8')).hexdigest()
+
+
+    def _get_key(self):
+        """Returns a key identifying the vector retrieved by ``_get``, or
+        None.  Returns ``cache_key`` unless overwritten, e.g., by handles for
+        files."""
+        return self.cache_key
+
+
     def _get(self):
         """Subclass must overwrite, retrieves a vector."""
         raise NotImplementedError("must be implemented by subclasses")
@@ -61,6 +208,23 @@ class VecHandle(object):
         raise NotImplementedError("must be implemented by subclasses")
 
 
+    def get_cost(self):
+        """Returns the relative cost of retrieving the vector, used to divide
+        work evenly among processors/MPI workers (see
+        :py:func:`find_vec_handle_costs`), or None if it is not known.
+        Subclasses may overwrite this, e.g., with the size of the vector."""
+        return None
+
+
+    def exists(self):
+        """Returns True if the vector has already been put, and False if not
+        or if it is not known.  This is used to skip sums that were already
+        put when resuming :py:meth:`vectorspace.VectorSpaceHandles.lin_combine`
+        (see :py:func:`find_existing_vec_handles`).  Subclasses may overwrite
+        this, e.g., by checking for a file."""
+        return False
+
+
     def __scale_vec(self, vec):
         """Scales the vector by a scalar."""
         if self.scale is not None:
@@ -85,6 +249,16 @@ class VecHandleInMemory(VecHandle):
         self.vec = vec
 
 
+    def get_cost(self):
+        """Returns the number of bytes in the vector."""
+        return util.get_nbytes(self.vec)
+
+
+    def exists(self):
+        """Returns True if a vector is stored."""
+        return self.vec is not None
+
+
     def __eq__(self, other):
         if type(other) != type(self):
             return False
@@ -93,6 +267,8 @@ class VecHandleInMemory(VecHandle):
 
 class VecHandleArrayText(VecHandle):
     """Gets and puts array vector objects from/in text files."""
+    put_keeps_vec = False
+
     def __init__(self, vec_path, base_vec_handle=None, scale=None):
         VecHandle.__init__(self, base_vec_handle, scale)
         self.vec_path = vec_path
@@ -105,7 +281,99 @@ class VecHandleArrayText(VecHandle):
 
     def _put(self, vec):
         """Saves vector to path."""
-        util.save_array_text(vec, self.vec_path)
+        _put_file_atomically(self.vec_path,
+            lambda path: util.save_array_text(vec, path))
+
+
+    def get_cost(self):
+        """Returns the size of the file, or None if it does not exist."""
+        return _get_file_size(self.vec_path)
+
+
+    def exists(self):
+        """Returns True if the file exists."""
+        return os.path.exists(self.vec_path)
+
+
+    def _get_key(self):
+        """Returns ``cache_key`` if it is set, otherwise a key from the
+        path, modification time, and size of the file."""
+        if self.cache_key is not None:
+            return self.cache_key
+        return _get_file_key(self.vec_path)
+
+
+    def __eq__(self, other):
+        if type(other) != type(self):
+            return False
+        return self.vec_path == other.vec_path
+
+
+class VecHandleNpy(VecHandle):
+    """Gets and puts array vector objects from/in NumPy ``.npy`` files.
+
+    Args:
+        ``vec_path``: Path of the ``.npy`` file.
+
+    Kwargs:
+        ``base_vec_handle``: Handle of the base vector, which is subtracted.
+
+        ``scale``: Scale factor of the vector.
+
+        ``mmap_mode``: Mode in which files are memory-mapped when vectors are
+        retrieved (see ``numpy.load``), or None to read them completely.
+        The default, ``'r'``, maps them read-only.
+
+    This is the fastest of the file handles for large arrays.  Retrieving a
+    vector only maps the file, and its elements are read when they are used,
+    e.g., by inner products.  Vectors are written with ``numpy.save``, without
+    copying them.
+    """
+    put_keeps_vec = False
+
+    def __init__(self, vec_path, base_vec_handle=None, scale=None,
+        mmap_mode='r'):
+        VecHandle.__init__(self, base_vec_handle, scale)
+        self.vec_path = vec_path
+        self.mmap_mode = mmap_mode
+
+
+    def _get(self):
+        """Loads vector from path, memory-mapped unless ``mmap_mode`` is
+        None.  Memory-mapped vectors are returned as plain arrays (still
+        backed by the file), so they take the same fast paths as other
+        arrays, e.g., in
+        :py:meth:`vectorspace.VectorSpaceHandles.lin_combine` and when they
+        are sent between processors/MPI workers."""
+        vec = np.load(self.vec_path, mmap_mode=self.mmap_mode,
+            allow_pickle=False)
+        return vec.view(np.ndarray)
+
+
+    def _put(self, vec):
+        """Saves vector to path."""
+        def put_file(path):
+            with open(path, 'wb') as file_obj:
+                np.save(file_obj, vec, allow_pickle=False)
+        _put_file_atomically(self.vec_path, put_file)
+
+
+    def get_cost(self):
+        """Returns the size of the file, or None if it does not exist."""
+        return _get_file_size(self.vec_path)
+
+
+    def exists(self):
+        """Returns True if the file exists."""
+        return os.path.exists(self.vec_path)
+
+
+    def _get_key(self):
+        """Returns ``cache_key`` if it is set, otherwise a key from the
+        path, modification time, and size of the file."""
+        if self.cache_key is not None:
+            return self.cache_key
+        return _get_file_key(self.vec_path)
 
 
     def __eq__(self, other):
@@ -116,6 +384,8 @@ class VecHandleArrayText(VecHandle):
 
 class VecHandlePickle(VecHandle):
     """Gets and puts any vector object from/in pickle files."""
+    put_keeps_vec = False
+
     def __init__(self, vec_path, base_vec_handle=None, scale=None):
         VecHandle.__init__(self, base_vec_handle, scale)
         self.vec_path = vec_path
@@ -128,8 +398,25 @@ class VecHandlePickle(VecHandle):
 
     def _put(self, vec):
         """Saves vector to path."""
-        with open(self.vec_path, 'wb') as file_obj:
-            pickle.dump(vec, file_obj)
+        def put_file(path):
+            with open(path, 'wb') as file_obj:
+                pickle.dump(vec, file_obj)
+        _put_file_atomically(self.vec_path, put_file)
+
+    def get_cost(self):
+        """Returns the size of the file, or None if it does not exist."""
+        return _get_file_size(self.vec_path)
+
+    def exists(self):
+        """Returns True if the file exists."""
+        return os.path.exists(self.vec_path)
+
+    def _get_key(self):
+        """Returns ``cache_key`` if it is set, otherwise a key from the
+        path, modification time, and size of the file."""
+        if self.cache_key is not None:
+            return self.cache_key
+        return _get_file_key(self.vec_path)
 
     def __eq__(self, other):
         if type(other) != type(self):
@@ -137,11 +424,72 @@ class VecHandlePickle(VecHandle):
         return self.vec_path == other.vec_path
 
 
+def axpy(vec, alpha, other):
+    """Adds ``alpha * other`` to ``vec`` in place, without allocating a
+    temporary vector when possible.
+
+    Args:
+        ``vec``: Vector object that is added to.
+
+        ``alpha``: Scalar.
+
+        ``other``: Vector object that is scaled and added.
+
+    Returns:
+        ``vec``: The updated vector object, which is the same object unless
+        it does not support ``+=`` in place.
+
+    If vector objects have an ``axpy`` method (see :py:class:`Vector`),
+    ``vec.axpy(alpha, other)`` is called.  NumPy arrays are updated a slab
+    of elements at a time, so only small temporary arrays are allocated.
+    Other vector objects are updated with ``vec += other * alpha``.
+    """
+    if hasattr(vec, 'axpy'):
+        vec.axpy(alpha, other)
+        return vec
+    if isinstance(vec, np.ndarray) and isinstance(other, np.ndarray) and (
+        vec.shape == other.shape and vec.flags.c_contiguous):
+        flat_vec = vec.view(np.ndarray).reshape(-1)
+        other = other.view(np.ndarray)
+        if other.flags.c_contiguous:
+            flat_other = other.reshape(-1)
+        else:
+            flat_other = other.flat
+        for slab_start in range(0, flat_vec.size, _axpy_slab_size):
+            slab_end = min(flat_vec.size, slab_start + _axpy_slab_size)
+            flat_vec[slab_start:slab_end] += \
+                alpha * flat_other[slab_start:slab_end]
+        return vec
+    vec += other * alpha
+    return vec
+
+
 def inner_product_array_uniform(vec1, vec2):
     """Takes inner product of numpy arrays without weighting."""
     return np.vdot(vec1, vec2)
 
 
+def inner_product_block_array_uniform(vecs1, vecs2):
+    """Takes inner products of all pairs of numpy arrays in two lists without
+    weighting, using a single matrix multiplication.
+
+    Args:
+        ``vecs1``: List of arrays corresponding to rows of the result.
+
+        ``vecs2``: List of arrays corresponding to columns of the result.
+
+    Returns:
+        ``IP_mat``: 2D array whose ``[i, j]`` element is
+        ``inner_product_array_uniform(vecs1[i], vecs2[j])``.
+
+    Can be given to :py:class:`vectorspace.VectorSpaceHandles` (and the
+    classes that use it) as ``inner_product_block``.
+    """
+    vecs1_flat = np.array([np.asarray(vec).ravel() for vec in vecs1])
+    vecs2_flat = np.array([np.asarray(vec).ravel() for vec in vecs2])
+    return np.dot(vecs1_flat.conj(), vecs2_flat.T)
+
+
 class InnerProductTrapz(object):
     """Callable that computes inner product of n-dimensional arrays defined on
     a spatial grid, using the trapezoidal rule.
@@ -184,7 +532,13 @@ class InnerProductTrapz(object):
 
 
 class Vector(object):
-    """Recommended base class for vector objects (not required)."""
+    """Recommended base class for vector objects (not required).
+
+    Subclasses may also define ``axpy(alpha, other)``, which adds ``alpha *
+    other`` to the vector in place.  Sums are then computed by
+    :py:meth:`vectorspace.VectorSpaceHandles.lin_combine` without allocating
+    a temporary vector for each term (see :py:func:`axpy`).
+    """
     def __init__(self):
         """Must overwrite"""
         raise NotImplementedError('constructor must be implemented by subclass')
@@ -3,17 +3,1024 @@ from __future__ import print_function
 from __future__ import absolute_import
 from future.builtins import range
 from future.builtins import object
+import os
 import sys
+import collections
 import copy
+import shutil
+import tempfile
+import threading
+import uuid
 from time import time
 
 import numpy as np
+from future.moves.queue import Queue
 
 from . import util
 from . import parallel
+from . import tracing
+from . import gramcache
+from . import checkpointing
 from . import vectors as V
 
 
+# Fraction of max_bytes_per_node used for vecs, and the number of vecs left
+# for scratch space on each processor.
+_memory_safety_factor = 0.8
+_num_scratch_vecs_per_proc = 2
+
+# Minimum number of elements of each vec stacked at once for the matrix
+# multiplications in lin_combine, so they stay efficient for small vecs.
+_min_slab_size = 1024
+
+# Default number of basis vecs retrieved at once to compute a ModeHandle's
+# mode.
+_num_mode_basis_vecs_per_chunk = 10
+
+# Default fraction of the memory available on a node, shared by its
+# processors, in which a ModeCache keeps modes, and the number of modes it
+# keeps when the available memory is unknown.
+_mode_cache_memory_fraction = 0.25
+_num_modes_cached_if_memory_unknown = 10
+
+
+class _VecPrefetcher(object):
+    """Retrieves chunks of vectors, optionally ahead of time in background
+    threads.
+
+    Args:
+        ``num_threads``: Number of threads used to retrieve a prefetched
+        chunk.  If 0, vectors are only retrieved when they are requested.
+
+    At most one chunk is retrieved ahead of time, so prefetching requires
+    memory for one extra chunk.
+    """
+    def __init__(self, num_threads=0):
+        self.num_threads = num_threads
+        if self.num_threads > 0:
+            self.num_chunks_in_mem = 2
+        else:
+            self.num_chunks_in_mem = 1
+        self._key = None
+        self._vecs = None
+        self._errors = []
+        self._threads = []
+
+
+    def prefetch(self, key, vec_handles):
+        """Starts retrieving ``vec_handles`` in the background.  The chunk is
+        identified by ``key`` in a later call to :py:meth:`get`."""
+        if self.num_threads < 1 or len(vec_handles) == 0:
+            return
+        self.close()
+        self._key = key
+        self._vecs = [None] * len(vec_handles)
+        self._errors = []
+        num_threads = min(self.num_threads, len(vec_handles))
+        self._threads = [threading.Thread(target=self._get_vecs,
+            args=(vec_handles, thread_index, num_threads))
+            for thread_index in range(num_threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+
+    def _get_vecs(self, vec_handles, start_index, step):
+        """Retrieves every ``step``-th vector, starting at ``start_index``.
+        Runs in a background thread."""
+        try:
+            for index in range(start_index, len(vec_handles), step):
+                self._vecs[index] = vec_handles[index].get()
+        except Exception as error:
+            self._errors.append(error)
+
+
+    def get(self, key, vec_handles):
+        """Returns the vectors for ``vec_handles``.  If they are the chunk
+        being prefetched (same ``key``), waits for the background threads.
+        Otherwise retrieves them now."""
+        if self._key is None or self._key != key:
+            return [vec_handle.get() for vec_handle in vec_handles]
+        for thread in self._threads:
+            thread.join()
+        vecs = self._vecs
+        errors = self._errors
+        self._key = None
+        self._vecs = None
+        self._errors = []
+        self._threads = []
+        if len(errors) > 0:
+            raise errors[0]
+        return vecs
+
+
+    def get_nbytes(self):
+        """Returns the bytes held in vectors prefetched so far."""
+        vecs = self._vecs
+        if vecs is None:
+            return 0
+        return sum([util.get_nbytes(vec) for vec in vecs if vec is not None])
+
+
+    def close(self):
+        """Waits for any background retrieval and discards its result."""
+        for thread in self._threads:
+            thread.join()
+        self._key = None
+        self._vecs = None
+        self._errors = []
+        self._threads = []
+
+
+class _VecWriter(object):
+    """Puts vectors, optionally in background threads ("write-behind").
+
+    Args:
+        ``num_threads``: Number of threads used to put vectors.  If 0, each
+        vector is put immediately.
+
+        ``max_num_pending``: Maximum number of vectors that are waiting to be
+        put or are being put.  :py:meth:`put` blocks while this many are
+        pending, which bounds the memory used by the queue.
+
+    ``pending_nbytes`` is the number of bytes held in vectors waiting to be
+    put.  Vectors are numbered in the order they are given to :py:meth:`put`,
+    and ``num_queued`` are the number given so far.  All of those numbered
+    below ``num_done`` have been put.
+    """
+    def __init__(self, num_threads=0, max_num_pending=1):
+        self.num_threads = num_threads
+        if self.num_threads > 0:
+            self.num_chunks_in_mem = 2
+        else:
+            self.num_chunks_in_mem = 1
+        self._queue = Queue()
+        self._num_pending = threading.BoundedSemaphore(max_num_pending)
+        self._pending_nbytes_lock = threading.Lock()
+        self.pending_nbytes = 0
+        self.num_queued = 0
+        self.num_done = 0
+        self._done_indices = set()
+        self._errors = []
+        self._threads = []
+        for thread_index in range(self.num_threads):
+            thread = threading.Thread(target=self._put_vecs)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+
+    def put(self, vec_handle, vec):
+        """Puts ``vec`` using ``vec_handle``, in the background if there are
+        writer threads."""
+        if self.num_threads < 1:
+            vec_handle.put(vec)
+            self.num_queued += 1
+            self.num_done += 1
+            return
+        self._raise_errors()
+        self._num_pending.acquire()
+        vec_nbytes = util.get_nbytes(vec)
+        with self._pending_nbytes_lock:
+            self.pending_nbytes += vec_nbytes
+        self._queue.put((vec_handle, vec, vec_nbytes, self.num_queued))
+        self.num_queued += 1
+
+
+    def _put_vecs(self):
+        """Puts queued vectors until ``None`` is received.  Runs in a
+        background thread."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            try:
+                item[0].put(item[1])
+            except Exception as error:
+                self._errors.append(error)
+            finally:
+                with self._pending_nbytes_lock:
+                    self.pending_nbytes -= item[2]
+                    # Vectors may be finished out of order by several
+                    # threads
+                    self._done_indices.add(item[3])
+                    while self.num_done in self._done_indices:
+                        self._done_indices.remove(self.num_done)
+                        self.num_done += 1
+                del item
+                self._num_pending.release()
+                self._queue.task_done()
+
+
+    def _raise_errors(self):
+        """Raises the first error from a background ``put``, if any."""
+        if len(self._errors) > 0:
+            error = self._errors[0]
+            self._errors = []
+            raise error
+
+
+    def flush(self):
+        """Waits until all pending vectors have been put."""
+        if self.num_threads > 0:
+            self._queue.join()
+        self._raise_errors()
+
+
+    def close(self):
+        """Puts all pending vectors and stops the writer threads."""
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._raise_errors()
+
+
+class _SumBufferPool(object):
+    """Reuses the memory of sums that have been put, for later sums,
+    instead of allocating new arrays.
+
+    Args:
+        ``writer``: The :py:class:`_VecWriter` that puts the sums.
+
+    Only NumPy arrays are reused.  This is only safe if the vector handles
+    do not keep the vectors they put (see ``put_keeps_vec`` of
+    :py:class:`vectors.VecHandle`).
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.free_buffers = []
+        self._pending_buffers = []
+
+
+    def add(self, sums):
+        """Adds ``sums``, which were just given to the writer.  Their
+        memory is reused once they have been put."""
+        self._pending_buffers.append((self.writer.num_queued,
+            [vec for vec in sums if type(vec) is np.ndarray]))
+
+
+    def pop(self, shape, dtype):
+        """Returns an array with ``shape`` and ``dtype`` whose sum has been
+        put, or None if there is none.  Its values are not reset."""
+        while len(self._pending_buffers) > 0 and \
+            self._pending_buffers[0][0] <= self.writer.num_done:
+            self.free_buffers.extend(self._pending_buffers.pop(0)[1])
+        for buffer_index, buf in enumerate(self.free_buffers):
+            if buf.shape == shape and buf.dtype == dtype:
+                return self.free_buffers.pop(buffer_index)
+        return None
+
+
+def _make_sum_buffer_pool(sum_vec_handles, writer):
+    """Returns a :py:class:`_SumBufferPool` for the sums put with
+    ``writer`` if none of ``sum_vec_handles`` keep the vectors they put,
+    otherwise None."""
+    if any([getattr(vec_handle, 'put_keeps_vec', True)
+        for vec_handle in sum_vec_handles]):
+        return None
+    return _SumBufferPool(writer)
+
+
+class _NodeVecCache(object):
+    """Cache of vectors shared by the processors/MPI workers on a node.
+
+    Args:
+        ``max_num_vecs``: Maximum number of vectors in the cache, per node.
+
+    The first processor to retrieve a vector that is a NumPy array saves it
+    to a ``.npy`` file in shared memory (``/dev/shm``, or the temporary
+    directory if that is not available).  After that, every processor on the
+    node maps the file read-only instead of retrieving the vector again, so
+    the data is in memory only once per node.  A lock file, created
+    atomically, makes sure only one processor saves each vector; the others
+    retrieve the vector themselves until it is saved.  Each processor may
+    save at most its share of ``max_num_vecs``, after which vectors are
+    retrieved as usual.  Other vector objects are never cached.
+
+    Must be created and closed by all processors/MPI workers.  Closing
+    removes the cache.
+    """
+    def __init__(self, max_num_vecs):
+        num_procs_per_node = max(
+            1, parallel.get_num_procs() // parallel.get_num_nodes())
+        self.max_num_vecs_per_proc = max_num_vecs // num_procs_per_node
+        # Vectors may be retrieved from several threads (see _VecPrefetcher)
+        self._num_vecs_saved = 0
+        self._num_vecs_saved_lock = threading.Lock()
+        if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+            base_dir = '/dev/shm'
+        else:
+            base_dir = tempfile.gettempdir()
+        self.cache_dir = os.path.join(base_dir, parallel.call_and_bcast(
+            lambda: 'modred_vec_cache_%s'%uuid.uuid4().hex))
+        if parallel.get_node_rank() == 0:
+            os.makedirs(self.cache_dir)
+        parallel.barrier()
+
+
+    def wrap(self, vec_handles, name):
+        """Returns handles that retrieve the vectors of ``vec_handles``
+        through the cache.  ``name`` identifies the list of handles, which is
+        the same on all processors/MPI workers."""
+        return [_CachedVecHandle(self, vec_handle, '%s_%d'%(name, index))
+            for index, vec_handle in enumerate(vec_handles)]
+
+
+    def get(self, vec_handle, key):
+        """Returns the vector of ``vec_handle``, stored in the cache as
+        ``key``."""
+        vec_path = os.path.join(self.cache_dir, key + '.npy')
+        if os.path.exists(vec_path):
+            return np.load(vec_path, mmap_mode='r')
+        with self._num_vecs_saved_lock:
+            if self._num_vecs_saved >= self.max_num_vecs_per_proc:
+                return vec_handle.get()
+            try:
+                lock_fd = os.open(os.path.join(self.cache_dir, key + '.lock'),
+                    os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                # Another processor is saving it, or it is not cached
+                lock_fd = None
+            else:
+                self._num_vecs_saved += 1
+        if lock_fd is None:
+            return vec_handle.get()
+        os.close(lock_fd)
+        vec = vec_handle.get()
+        if type(vec) is not np.ndarray or vec.dtype.hasobject or (
+            vec.size == 0):
+            return vec
+        # Save to a temporary file and rename it, so the file is complete
+        # when the others see it.
+        temp_path = os.path.join(self.cache_dir,
+            '%s.%d.tmp.npy'%(key, parallel.get_rank()))
+        np.save(temp_path, vec)
+        os.rename(temp_path, vec_path)
+        return np.load(vec_path, mmap_mode='r')
+
+
+    def close(self):
+        """Removes the cache once all processors/MPI workers are done with
+        it."""
+        parallel.barrier()
+        if parallel.get_node_rank() == 0:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class _CachedVecHandle(object):
+    """Handle that retrieves a vector through a :py:class:`_NodeVecCache`.
+    Vectors are only retrieved, never put, with these handles."""
+    def __init__(self, cache, vec_handle, key):
+        self.cache = cache
+        self.vec_handle = vec_handle
+        self.key = key
+
+
+    def get(self):
+        """Returns the vector, from the cache if possible."""
+        return self.cache.get(self.vec_handle, self.key)
+
+
+    def get_cost(self):
+        """Returns the cost of the wrapped handle, if it has one."""
+        get_cost = getattr(self.vec_handle, 'get_cost', None)
+        if get_cost is None:
+            return None
+        return get_cost()
+
+
+class _TracedVecHandle(object):
+    """Handle that records getting and putting the vector of ``vec_handle``
+    as ``'get'`` and ``'put'`` events with a :py:class:`tracing.Tracer`."""
+    def __init__(self, tracer, vec_handle):
+        self.tracer = tracer
+        self.vec_handle = vec_handle
+        self.put_keeps_vec = getattr(vec_handle, 'put_keeps_vec', True)
+
+
+    def get(self):
+        """Returns the vector, recording the time and its size."""
+        start_time = time()
+        vec = self.vec_handle.get()
+        self.tracer.record('get', start_time, time(), util.get_nbytes(vec))
+        return vec
+
+
+    def put(self, vec):
+        """Puts the vector, recording the time and its size."""
+        start_time = time()
+        self.vec_handle.put(vec)
+        self.tracer.record('put', start_time, time(), util.get_nbytes(vec))
+
+
+    def get_cost(self):
+        """Returns the cost of the wrapped handle, if it has one."""
+        get_cost = getattr(self.vec_handle, 'get_cost', None)
+        if get_cost is None:
+            return None
+        return get_cost()
+
+
+def _trace_vec_waits(tracer, vecs_iter):
+    """Yields the vecs and indices of ``vecs_iter``, e.g.,
+    :py:func:`parallel.circulate_vecs`, recording the time spent waiting for
+    each as a ``'wait'`` event.  The first vecs are this processor's own, so
+    only the bytes of the others are counted."""
+    num_yielded = 0
+    while True:
+        start_time = time()
+        try:
+            vecs, indices = next(vecs_iter)
+        except StopIteration:
+            return
+        if num_yielded == 0:
+            num_bytes = 0
+        else:
+            num_bytes = util.get_nbytes(vecs)
+        tracer.record('wait', start_time, time(), num_bytes)
+        num_yielded += 1
+        yield vecs, indices
+
+
+def _find_chunk_indices(tasks, chunk_index, num_tasks_per_chunk):
+    """Returns the start and end indices of a chunk of consecutive tasks.
+
+    Args:
+        ``tasks``: List of consecutive indices assigned to a processor.
+
+        ``chunk_index``: Index of the chunk.
+
+        ``num_tasks_per_chunk``: Maximum number of tasks in each chunk.
+
+    Returns:
+        ``start_index``, ``end_index``: Range of indices in the chunk.  Both
+        are zero if there are no tasks.
+    """
+    if len(tasks) == 0:
+        return 0, 0
+    start_index = min(tasks[0] + chunk_index * num_tasks_per_chunk,
+        tasks[-1] + 1)
+    end_index = min(start_index + num_tasks_per_chunk, tasks[-1] + 1)
+    return start_index, end_index
+
+
+def _find_chunk_key_and_handles(vec_handles, tasks):
+    """Returns a key identifying a chunk of consecutive tasks (for a
+    :py:class:`_VecPrefetcher`) and the corresponding handles."""
+    if len(tasks) == 0:
+        return (0, 0), []
+    return (tasks[0], tasks[-1] + 1), vec_handles[tasks[0]:tasks[-1] + 1]
+
+
+def _find_chunk_sizes(num_outer_tasks, num_inner_tasks, num_vecs_available,
+    num_outer_chunks_in_mem=1, num_inner_chunks_in_mem=1):
+    """Splits memory between an outer chunk of vectors, which is kept in
+    memory for a full loop, and an inner chunk, which is cycled through.
+
+    The outer chunk is made as small as possible without increasing the
+    number of outer loops, i.e., the number of times each inner vector is
+    retrieved.  The rest of the memory goes to the inner chunk, which reduces
+    the number of inner loops and messages.
+
+    Args:
+        ``num_outer_tasks``: Max number of outer tasks on any processor.
+
+        ``num_inner_tasks``: Max number of inner tasks on any processor.
+
+        ``num_vecs_available``: Number of vectors that fit in memory.
+
+    Kwargs:
+        ``num_outer_chunks_in_mem``: Number of outer chunks held at once, e.g.,
+        2 with write-behind.
+
+        ``num_inner_chunks_in_mem``: Number of inner chunks held at once, e.g.,
+        2 with prefetching.
+
+    Returns:
+        ``num_outer_per_chunk``: Number of outer vectors in each chunk.
+
+        ``num_inner_per_chunk``: Number of inner vectors in each chunk.
+    """
+    max_num_outer_per_chunk = max(1, (num_vecs_available -
+        num_inner_chunks_in_mem) // num_outer_chunks_in_mem)
+    num_outer_loops = max(1,
+        int(np.ceil(num_outer_tasks * 1. / max_num_outer_per_chunk)))
+    num_outer_per_chunk = max(1,
+        int(np.ceil(num_outer_tasks * 1. / num_outer_loops)))
+    num_inner_per_chunk = (num_vecs_available -
+        num_outer_per_chunk * num_outer_chunks_in_mem) // \
+        num_inner_chunks_in_mem
+    num_inner_per_chunk = max(1, min(num_inner_per_chunk, num_inner_tasks))
+    return num_outer_per_chunk, num_inner_per_chunk
+
+
+def _find_max_vecs_per_proc(max_vecs_per_node, num_procs, num_nodes):
+    """Returns the number of vectors each of ``num_procs`` processors/MPI
+    workers on ``num_nodes`` nodes can hold, given ``max_vecs_per_node``.
+    Each holds at least 2, even if ``max_vecs_per_node`` is too small."""
+    if max_vecs_per_node < 2 * num_procs / num_nodes:
+        return 2
+    return max_vecs_per_node * num_nodes // num_procs
+
+
+def _count_inner_chunks_in_mem(num_prefetch_chunks, num_procs,
+    num_procs_per_node, use_hierarchical_ring):
+    """Returns the number of chunks of vecs passed around the ring that are
+    in memory at once, given the number of chunks held by the prefetcher.
+    In parallel, this includes the chunk being received for the next pass
+    (see :py:func:`parallel.circulate_vecs`), or with a hierarchical ring,
+    the chunks of all processors on two nodes, held by a node leader."""
+    if use_hierarchical_ring:
+        return num_prefetch_chunks + 2 * num_procs_per_node
+    elif num_procs > 1:
+        return num_prefetch_chunks + 1
+    return num_prefetch_chunks
+
+
+def _count_tile_row_gets(num_rows, num_rows_per_tile, num_tiles_per_proc,
+    num_procs):
+    """Returns the number of row vecs retrieved by each processor/MPI
+    worker with the dynamic schedule.  Tiles are numbered along rows, so a
+    single processor/MPI worker keeps the row vecs for a whole row of
+    tiles, but in parallel, consecutive tiles usually go to different
+    ones."""
+    if num_procs == 1:
+        return num_rows
+    return num_tiles_per_proc * num_rows_per_tile
+
+
+def _count_operations(operation, schedule, num_row_vecs, num_col_vecs,
+    num_procs, max_vecs_per_proc, num_inner_chunks_in_mem=1,
+    num_sum_chunks_in_mem=1):
+    """Counts the work done by the busiest processor/MPI worker in a vector
+    space operation, without retrieving any vectors.
+
+    Args:
+        ``operation``: Name of the :py:class:`VectorSpaceHandles` method,
+        ``'compute_inner_product_mat'``,
+        ``'compute_symmetric_inner_product_mat'``, or ``'lin_combine'``.
+
+        ``schedule``: ``'static'`` or ``'dynamic'``.
+
+        ``num_row_vecs``: Number of row vecs of the inner product matrix, or
+        of basis vecs for ``'lin_combine'``.
+
+        ``num_col_vecs``: Number of col vecs of the inner product matrix, or
+        of sum vecs for ``'lin_combine'``.  Ignored for symmetric matrices.
+
+        ``num_procs``: Number of processors/MPI workers.
+
+        ``max_vecs_per_proc``: Number of vecs each one can hold.
+
+    Kwargs:
+        ``num_inner_chunks_in_mem``: Number of inner chunks of vecs held at
+        once.  For the static schedule, these are the chunks passed around
+        the ring (see :py:func:`_count_inner_chunks_in_mem`), and for the
+        dynamic schedule, the chunks of bases held by the prefetcher.
+
+        ``num_sum_chunks_in_mem``: Number of chunks of sums held at once by
+        ``'lin_combine'``, e.g., 2 with write-behind.
+
+    Returns:
+        ``counts``: Dictionary with the number of vecs retrieved
+        (``num_gets``) and put (``num_puts``), inner products
+        (``num_inner_products``), scalings and additions of vecs
+        (``num_add_scales``), vecs sent to other processors/MPI workers
+        (``num_vecs_sent``), the most vecs held at once
+        (``num_vecs_in_mem``), and the numbers of outer and inner vecs in
+        each chunk (``num_vecs_per_chunk``).
+
+    The counts follow the chunks and loops of the operations, so they are
+    exact in serial, and for the static schedule when the vecs divide evenly
+    among processors/MPI workers.  In parallel with the dynamic schedule,
+    the tiles are assumed to be divided evenly, and the row vecs to be
+    retrieved for every tile.
+    """
+    counts = {'num_gets': 0, 'num_puts': 0, 'num_inner_products': 0,
+        'num_add_scales': 0, 'num_vecs_sent': 0}
+    ceil_div = lambda num, den: int(np.ceil(num * 1. / den))
+    if operation == 'compute_inner_product_mat':
+        num_rows, num_cols = sorted([num_row_vecs, num_col_vecs])
+        max_num_row_tasks = ceil_div(num_rows, num_procs)
+        max_num_col_tasks = ceil_div(num_cols, num_procs)
+        if schedule == 'static':
+            num_rows_per_chunk, num_cols_per_chunk = _find_chunk_sizes(
+                max_num_row_tasks, max_num_col_tasks, max_vecs_per_proc,
+                num_inner_chunks_in_mem=num_inner_chunks_in_mem)
+            num_row_loops = ceil_div(max_num_row_tasks, num_rows_per_chunk)
+            counts['num_gets'] = max_num_row_tasks + \
+                num_row_loops * max_num_col_tasks
+            counts['num_inner_products'] = max_num_row_tasks * num_cols
+            counts['num_vecs_sent'] = num_row_loops * (num_procs - 1) * \
+                max_num_col_tasks
+            counts['num_vecs_in_mem'] = num_rows_per_chunk + \
+                num_inner_chunks_in_mem * num_cols_per_chunk
+        else:
+            num_rows_per_chunk, num_cols_per_chunk = _find_chunk_sizes(
+                max_num_row_tasks, max_num_col_tasks, max_vecs_per_proc)
+            num_row_tiles = ceil_div(num_rows, num_rows_per_chunk)
+            num_tiles_per_proc = ceil_div(num_row_tiles *
+                ceil_div(num_cols, num_cols_per_chunk), num_procs)
+            counts['num_gets'] = _count_tile_row_gets(num_rows,
+                num_rows_per_chunk, num_tiles_per_proc, num_procs) + min(
+                num_tiles_per_proc * num_cols_per_chunk,
+                num_row_tiles * num_cols)
+            counts['num_inner_products'] = ceil_div(
+                num_rows * num_cols, num_procs)
+            counts['num_vecs_in_mem'] = num_rows_per_chunk + \
+                num_cols_per_chunk
+        counts['num_vecs_per_chunk'] = (num_rows_per_chunk, num_cols_per_chunk)
+    elif operation == 'compute_symmetric_inner_product_mat':
+        num_vecs = num_row_vecs
+        max_num_tasks = ceil_div(num_vecs, num_procs)
+        counts['num_inner_products'] = ceil_div(
+            num_vecs * (num_vecs + 1) // 2, num_procs)
+        if schedule == 'static':
+            num_rows_per_chunk, num_cols_per_chunk = _find_chunk_sizes(
+                max_num_tasks, max_num_tasks, max_vecs_per_proc,
+                num_inner_chunks_in_mem=num_inner_chunks_in_mem)
+            # Each set of rows is retrieved once, then passed halfway
+            # around the ring for the triangular portion.  The cols after
+            # the set are retrieved and passed all the way around.
+            for start_row_index in range(0, num_vecs,
+                num_rows_per_chunk * num_procs):
+                end_row_index = min(num_vecs,
+                    start_row_index + num_rows_per_chunk * num_procs)
+                num_proc_rows = ceil_div(
+                    end_row_index - start_row_index, num_procs)
+                num_proc_cols = ceil_div(num_vecs - end_row_index, num_procs)
+                counts['num_gets'] += num_proc_rows + num_proc_cols
+                counts['num_vecs_sent'] += ceil_div(num_procs - 1, 2) * \
+                    num_proc_rows + (num_procs - 1) * num_proc_cols
+            counts['num_vecs_in_mem'] = num_rows_per_chunk + \
+                num_inner_chunks_in_mem * num_cols_per_chunk
+        else:
+            num_rows_per_chunk = max(1, min(
+                max_num_tasks, max_vecs_per_proc // 2))
+            num_cols_per_chunk = num_rows_per_chunk
+            num_row_tiles = ceil_div(num_vecs, num_rows_per_chunk)
+            num_tiles_per_proc = ceil_div(
+                num_row_tiles * (num_row_tiles + 1) // 2, num_procs)
+            # Tiles on the diagonal need no col vecs
+            num_off_diag_tiles_per_proc = ceil_div(
+                num_row_tiles * (num_row_tiles - 1) // 2, num_procs)
+            num_off_diag_cols = sum([num_vecs - end_row_index
+                for end_row_index in range(
+                num_rows_per_chunk, num_vecs, num_rows_per_chunk)])
+            counts['num_gets'] = _count_tile_row_gets(num_vecs,
+                num_rows_per_chunk, num_tiles_per_proc, num_procs) + min(
+                num_off_diag_tiles_per_proc * num_cols_per_chunk,
+                num_off_diag_cols)
+            counts['num_vecs_in_mem'] = 2 * num_rows_per_chunk
+        counts['num_vecs_per_chunk'] = (num_rows_per_chunk, num_cols_per_chunk)
+    elif operation == 'lin_combine':
+        num_bases, num_sums = num_row_vecs, num_col_vecs
+        max_num_basis_tasks = ceil_div(num_bases, num_procs)
+        max_num_sum_tasks = ceil_div(num_sums, num_procs)
+        if schedule == 'static':
+            num_sums_per_chunk, num_bases_per_chunk = _find_chunk_sizes(
+                max_num_sum_tasks, max_num_basis_tasks, max_vecs_per_proc,
+                num_outer_chunks_in_mem=num_sum_chunks_in_mem,
+                num_inner_chunks_in_mem=num_inner_chunks_in_mem)
+            num_sum_loops = ceil_div(max_num_sum_tasks, num_sums_per_chunk)
+            counts['num_gets'] = num_sum_loops * max_num_basis_tasks
+            counts['num_puts'] = max_num_sum_tasks
+            counts['num_add_scales'] = max_num_sum_tasks * num_bases
+            counts['num_vecs_sent'] = num_sum_loops * (num_procs - 1) * \
+                max_num_basis_tasks
+            counts['num_vecs_in_mem'] = \
+                num_sum_chunks_in_mem * num_sums_per_chunk + \
+                num_inner_chunks_in_mem * num_bases_per_chunk
+        else:
+            num_sums_per_chunk, num_bases_per_chunk = _find_chunk_sizes(
+                max_num_sum_tasks, num_bases, max_vecs_per_proc,
+                num_outer_chunks_in_mem=num_sum_chunks_in_mem,
+                num_inner_chunks_in_mem=num_inner_chunks_in_mem)
+            num_chunks_per_proc = ceil_div(
+                ceil_div(num_sums, num_sums_per_chunk), num_procs)
+            if num_bases_per_chunk < num_bases:
+                counts['num_gets'] = num_chunks_per_proc * num_bases
+            else:
+                counts['num_gets'] = num_bases
+            counts['num_puts'] = min(
+                num_chunks_per_proc * num_sums_per_chunk, num_sums)
+            counts['num_add_scales'] = counts['num_puts'] * num_bases
+            counts['num_vecs_in_mem'] = \
+                num_sum_chunks_in_mem * num_sums_per_chunk + \
+                num_inner_chunks_in_mem * num_bases_per_chunk
+        counts['num_vecs_per_chunk'] = (
+            num_sums_per_chunk, num_bases_per_chunk)
+    else:
+        raise ValueError('Invalid operation "%s"'%operation)
+    return counts
+
+
+def _symmetrize_IP_mat(IP_mat):
+    """Returns the full symmetric inner product matrix, given a matrix in
+    which each element has been computed above or below the diagonal (and
+    is zero in the other position)."""
+    # Create a mask for the repeated values.  Select values that are zero
+    # in the upper triangular portion (not computed there) but nonzero in
+    # the lower triangular portion (computed there).  For the case where
+    # the inner product is not perfectly symmetric, this will select the
+    # computation done in the upper triangular portion.
+    mask = np.multiply(IP_mat == 0, IP_mat.T != 0)
+
+    # Collect values below diagonal
+    IP_mat += np.multiply(np.triu(IP_mat.T, 1), mask)
+
+    # Symmetrize matrix
+    return np.triu(IP_mat) + np.triu(IP_mat, 1).T
+
+
+def _is_array_chunk(vecs):
+    """Returns True if ``vecs`` are NumPy arrays (not matrices) of numeric
+    data, all with the same shape, which can be stacked into a 2D array."""
+    return len(vecs) > 0 and all([type(vec) is np.ndarray and
+        not vec.dtype.hasobject and vec.shape == vecs[0].shape
+        for vec in vecs])
+
+
+def _add_sum_layers(sum_layers, basis_vecs, coeff_block, buffer_pool=None):
+    """Adds the layers of ``basis_vecs`` into ``sum_layers``.
+
+    Args:
+        ``sum_layers``: List of partial sums, updated in place.  Elements
+        that are None are set to the first layer.
+
+        ``basis_vecs``: List of basis vecs.
+
+        ``coeff_block``: Block of the coefficient matrix, with a row for each
+        basis vec and a column for each sum.
+
+    Kwargs:
+        ``buffer_pool``: A :py:class:`_SumBufferPool` from which the arrays
+        of new sums are taken, if possible.
+
+    If the basis vecs (and the sums so far) are arrays of the same shape,
+    all of the layers are computed with matrix multiplications.  The basis
+    vecs are stacked into a 2D array a slab of elements at a time, so the
+    scratch memory used is about ``_num_scratch_vecs_per_proc`` vecs.
+    Otherwise, each layer is added with :py:func:`vectors.axpy`, which
+    avoids a temporary vector when possible.  Either way, each sum takes the
+    memory of one vec.
+    """
+    coeff_block = np.asarray(coeff_block)
+    if not _is_array_chunk(basis_vecs) or not all([sum_layer is None or (
+        type(sum_layer) is np.ndarray and
+        sum_layer.shape == basis_vecs[0].shape and
+        sum_layer.flags.c_contiguous) for sum_layer in sum_layers]):
+        for sum_index in range(len(sum_layers)):
+            for basis_index, basis_vec in enumerate(basis_vecs):
+                coeff = coeff_block[basis_index, sum_index]
+                if sum_layers[sum_index] is None:
+                    sum_layers[sum_index] = basis_vec * coeff
+                else:
+                    sum_layers[sum_index] = V.axpy(
+                        sum_layers[sum_index], coeff, basis_vec)
+        return
+
+    shape = basis_vecs[0].shape
+    dtype = np.result_type(coeff_block, basis_vecs[0])
+    for sum_index, sum_layer in enumerate(sum_layers):
+        if sum_layer is None:
+            if buffer_pool is not None:
+                sum_layer = buffer_pool.pop(shape, dtype)
+            if sum_layer is None:
+                sum_layers[sum_index] = np.zeros(shape, dtype=dtype)
+            else:
+                sum_layer[...] = 0
+                sum_layers[sum_index] = sum_layer
+    # Flattened views, or iterators for non-contiguous basis vecs, so that
+    # only a slab of each is copied at a time
+    flat_sums = [sum_layer.reshape(-1) for sum_layer in sum_layers]
+    flat_bases = [basis_vec.reshape(-1)
+        if basis_vec.flags.c_contiguous or basis_vec.ndim == 1
+        else basis_vec.flat for basis_vec in basis_vecs]
+    vec_size = basis_vecs[0].size
+    slab_size = max(_min_slab_size, _num_scratch_vecs_per_proc * vec_size //
+        (len(basis_vecs) + len(sum_layers)))
+    for slab_start in range(0, vec_size, slab_size):
+        slab_end = min(vec_size, slab_start + slab_size)
+        basis_slab = np.array([flat_basis[slab_start:slab_end]
+            for flat_basis in flat_bases])
+        layer_slabs = np.dot(coeff_block.T, basis_slab)
+        for flat_sum, layer_slab in zip(flat_sums, layer_slabs):
+            flat_sum[slab_start:slab_end] += layer_slab
+
+
+def _fill_blocks(mat, blocks):
+    """Adds ``blocks``, a list of ``(row_start, col_start, block)``, into the
+    full matrix ``mat``."""
+    for row_start, col_start, block in blocks:
+        mat[row_start:row_start + block.shape[0],
+            col_start:col_start + block.shape[1]] += block
+
+
+class DistributedMatrix(object):
+    """Matrix whose blocks are spread among processors/MPI workers.
+
+    Args:
+        ``shape``: Shape of the full matrix.
+
+    Kwargs:
+        ``dtype``: Data type of the full matrix.  If None (default), it is
+        found from the blocks, so it holds the blocks of every processor/MPI
+        worker once :py:meth:`find_common_dtype` is called.  It is always
+        promoted to hold the blocks added.
+
+        ``is_symmetric``: If True, each off-diagonal element only needs to be
+        stored above or below the diagonal, and the full matrix is
+        symmetrized when it is assembled.
+
+    Each processor/MPI worker holds only the blocks it computed, in
+    ``blocks``, a list of ``(row_start, col_start, block)``.  Elements not
+    in any block are zero.  This is returned by
+    :py:meth:`VectorSpaceHandles.compute_inner_product_mat` with
+    ``assembly='distributed'``.  Use :py:meth:`gather` to assemble the full
+    matrix on one processor/MPI worker, e.g., before an eigendecomposition.
+    """
+    def __init__(self, shape, dtype=None, is_symmetric=False):
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.is_symmetric = is_symmetric
+        self.blocks = []
+        self.num_local_elements = 0
+
+
+    def add_block(self, row_start, col_start, block, transpose=False):
+        """Adds a block whose first element is at ``(row_start,
+        col_start)``.  If ``transpose`` is True, the transpose of ``block``
+        is added at ``(col_start, row_start)`` instead."""
+        block = np.array(block)
+        if transpose:
+            row_start, col_start, block = col_start, row_start, block.T
+        self.blocks.append((row_start, col_start, block))
+        self.num_local_elements += block.size
+        if self.dtype is None:
+            self.dtype = block.dtype
+        else:
+            self.dtype = np.result_type(self.dtype, block.dtype)
+
+
+    def find_common_dtype(self):
+        """Sets ``dtype`` to one that holds the blocks of all processors/MPI
+        workers, e.g., complex if any of them are.  It is float if there are
+        no blocks.  Must be called by all processors/MPI workers."""
+        if parallel.is_distributed():
+            dtypes = parallel.comm.allgather(self.dtype)
+        else:
+            dtypes = [self.dtype]
+        dtypes = [dtype for dtype in dtypes if dtype is not None]
+        if len(dtypes) > 0:
+            self.dtype = np.result_type(*dtypes)
+        else:
+            self.dtype = np.dtype(float)
+
+
+    def _make_local_mat(self):
+        """Returns a full matrix containing only the local blocks."""
+        local_mat = np.mat(np.zeros(self.shape, dtype=self.dtype))
+        _fill_blocks(local_mat, self.blocks)
+        return local_mat
+
+
+    def gather(self, root=0):
+        """Assembles the full matrix on one processor/MPI worker.
+
+        Kwargs:
+            ``root``: Rank of the processor/MPI worker that gets the matrix.
+
+        Returns:
+            ``mat``: The full matrix on ``root``, and None on the others.
+
+        Only the blocks are sent, so no processor/MPI worker other than
+        ``root`` ever holds a full matrix.  Must be called by all
+        processors/MPI workers.
+        """
+        if parallel.is_distributed():
+            all_blocks = parallel.comm.gather(self.blocks, root=root)
+        else:
+            all_blocks = [self.blocks]
+        if parallel.get_rank() != root:
+            return None
+        mat = np.mat(np.zeros(self.shape, dtype=self.dtype))
+        for blocks in all_blocks:
+            _fill_blocks(mat, blocks)
+        if self.is_symmetric:
+            mat = _symmetrize_IP_mat(mat)
+        return mat
+
+
+    def allreduce(self):
+        """Assembles the full matrix on all processors/MPI workers by summing
+        full matrices containing the local blocks.  Must be called by all
+        processors/MPI workers."""
+        mat = self._make_local_mat()
+        if parallel.is_distributed():
+            mat = parallel.custom_comm.allreduce(mat)
+        if self.is_symmetric:
+            mat = _symmetrize_IP_mat(mat)
+        return mat
+
+
+class _IPMatGramCache(object):
+    """Finds and saves the tiles of an inner product matrix in a
+    :py:class:`gramcache.GramCache`.
+
+    Args:
+        ``gram_cache``: The :py:class:`gramcache.GramCache`.
+
+        ``inner_product_key``: String identifying the inner product.
+
+        ``row_keys``: List of the keys of the row vecs (see
+        :py:func:`vectors.find_vec_handle_keys`).
+
+        ``col_keys``: List of the keys of the col vecs.
+
+    Tiles are found by the indices of their rows and cols.
+    """
+    def __init__(self, gram_cache, inner_product_key, row_keys, col_keys):
+        self.gram_cache = gram_cache
+        self.inner_product_key = inner_product_key
+        self.row_keys = row_keys
+        self.col_keys = col_keys
+        self.gram_cache.refresh(inner_product_key)
+
+
+    def find_tile(self, row_indices, col_indices):
+        """Returns the saved inner products of the rows and cols with
+        indices ``row_indices`` and ``col_indices``, and a boolean array of
+        which were saved.  See :py:meth:`gramcache.GramCache.find_IP_mat`."""
+        return self.gram_cache.find_IP_mat(self.inner_product_key,
+            [self.row_keys[row_index] for row_index in row_indices],
+            [self.col_keys[col_index] for col_index in col_indices])
+
+
+    def save_tile(self, row_indices, col_indices, tile):
+        """Saves the inner products of the rows and cols with indices
+        ``row_indices`` and ``col_indices``."""
+        self.gram_cache.save_IP_mat(self.inner_product_key,
+            [self.row_keys[row_index] for row_index in row_indices],
+            [self.col_keys[col_index] for col_index in col_indices], tile)
+
+
+    def restore(self, IP_mat, row_start, col_start, num_rows, num_cols,
+        transpose=False):
+        """Adds the tile at ``(row_start, col_start)`` with shape
+        ``(num_rows, num_cols)`` to ``IP_mat`` if all of its inner products
+        were saved, as :py:meth:`DistributedMatrix.add_block`.  Only the
+        upper-triangular part of tiles on the diagonal of a symmetric matrix
+        is added.  Returns True if it was, and False otherwise."""
+        tile, is_found = self.find_tile(
+            range(row_start, row_start + num_rows),
+            range(col_start, col_start + num_cols))
+        is_diagonal = IP_mat.is_symmetric and row_start == col_start
+        if is_diagonal:
+            is_found = np.triu(is_found) | np.tril(
+                np.ones(is_found.shape, dtype=bool), -1)
+        if not is_found.all():
+            return False
+        if is_diagonal:
+            tile = np.triu(tile)
+        IP_mat.add_block(row_start, col_start, tile, transpose=transpose)
+        return True
+
+
+    def restore_all(self, IP_mat, transpose=False):
+        """Adds all of the inner products to ``IP_mat``, dividing the rows
+        among processors/MPI workers, if all of them were saved.  Returns
+        True if they were, and False otherwise.  Must be called by all
+        processors/MPI workers."""
+        row_indices = parallel.find_assignments(
+            list(range(len(self.row_keys))))[parallel.get_rank()]
+        if len(row_indices) > 0:
+            # For a symmetric matrix, only the cols on and above the
+            # diagonal are needed.
+            if IP_mat.is_symmetric:
+                col_start = row_indices[0]
+            else:
+                col_start = 0
+            tile, is_found = self.find_tile(
+                row_indices, range(col_start, len(self.col_keys)))
+            if IP_mat.is_symmetric:
+                tile = np.triu(tile)
+                is_found = np.triu(is_found) | np.tril(
+                    np.ones(is_found.shape, dtype=bool), -1)
+            is_all_found = is_found.all()
+        else:
+            is_all_found = True
+        if not parallel.allreduce_min(int(is_all_found)):
+            return False
+        if len(row_indices) > 0:
+            IP_mat.add_block(row_indices[0], col_start, tile,
+                transpose=transpose)
+        return True
+
+
 class VectorSpaceMatrices(object):
     """Implements inner products and linear combinations using data stored in
     matrices.
@@ -94,6 +1101,117 @@ class VectorSpaceHandles(object):
         ``print_interval``: Minimum time (in seconds) between printed progress
         messages.
 
+        ``inner_product_block``: Function that computes the matrix of inner
+        products of two lists of vector objects, e.g.,
+        :py:func:`vectors.inner_product_block_array_uniform`.  If given, it is
+        used for every chunk of inner products, which is much faster than
+        calling ``inner_product`` once per pair for array-like vectors.
+
+        ``num_get_threads``: Number of background threads used to prefetch
+        vectors.  If greater than 0, the next chunk of vectors is retrieved
+        while inner products or linear combinations are computed with the
+        current chunk.  Memory for the extra chunk comes out of
+        ``max_vecs_per_node``.  Default is 0 (no prefetching).
+
+        ``num_put_threads``: Number of background threads used to put the
+        results of :py:meth:`lin_combine` ("write-behind").  If greater than
+        0, the next chunk of sums is computed while the previous chunk is put.
+        The sums waiting to be put count against ``max_vecs_per_node``.
+        Default is 0 (sums are put before the next chunk is started).
+
+        ``max_bytes_per_node``: Maximum number of bytes of vectors that can be
+        stored in memory, per node, or ``'auto'`` to use the memory available
+        at the start of each operation (see
+        :py:func:`util.get_available_memory`).  If given, ``max_vecs_per_node``
+        is set at the start of each operation from the size of the first
+        vector, keeping a safety margin, instead of being given.  After
+        each operation, ``peak_bytes_per_proc`` is the most memory held in
+        vectors by this processor.
+
+        ``schedule``: How work is divided among processors/MPI workers.  With
+        ``'static'`` (default), each one is assigned an equal share of the
+        vectors up front and vectors are passed between them.  With
+        ``'dynamic'``, the work is split into tiles of the inner product
+        matrix (or chunks of sums, for :py:meth:`lin_combine`), and each
+        processor/MPI worker takes the next tile when it finishes its last
+        one, retrieving the vectors it needs itself.  This retrieves vectors
+        more often, but keeps all processors/MPI workers busy when ``get``
+        times vary, e.g., for files on a shared filesystem.  With ``'auto'``,
+        the schedule predicted to be faster by :py:meth:`plan` is used for
+        each operation.  The results are the same.
+
+        ``weigh_tasks``: If True, vectors are divided among processors/MPI
+        workers with the static schedule so that each retrieves vectors of
+        about the same total cost, rather than the same number of vectors.
+        The costs come from the ``get_cost`` method of the vector handles,
+        e.g., file sizes (see :py:func:`vectors.find_vec_handle_costs`), and
+        are ignored if any are unknown.  This balances datasets of vectors
+        with different sizes.  Default is False.
+
+        ``node_cache_vecs``: Number of vectors, per node, kept in a cache in
+        shared memory during each operation.  Vectors that are NumPy arrays
+        are then retrieved once per node, and mapped read-only by the other
+        processors on the node instead of being retrieved again.  This
+        helps when vectors are retrieved many times, e.g., with the dynamic
+        schedule or when not all vectors fit in memory.  The cache counts
+        against ``max_vecs_per_node``, leaving fewer vectors for each
+        processor.  Default is 0 (no cache).
+
+        ``hierarchical_ring``: If True, vectors passed between processors/MPI
+        workers with the static schedule go around each node first, then
+        between nodes in one message per pair of nodes (see
+        :py:func:`parallel.circulate_vecs_hierarchical`).  This reduces
+        traffic between nodes, but rank zero of each node holds the vectors
+        of a whole node, so fewer vectors are retrieved at once.  Only has an
+        effect with more than one node.  Default is False.
+
+        ``checkpoint_dir``: Directory in which the tiles of inner product
+        matrices computed so far are saved, so that a run that is killed
+        (e.g., by a batch scheduler) can be restarted.  Each processor/MPI
+        worker saves the tiles it computed since its last save every
+        ``checkpoint_interval`` seconds.  When a run with the same
+        ``checkpoint_dir`` is restarted, tiles that were saved are not
+        recomputed, and matrices that were finished are loaded without
+        retrieving any vectors.  A restarted matrix is computed with the
+        dynamic schedule, so the vectors of saved tiles are not retrieved
+        either.  Tiles are restored from the saved elements, so the
+        restarted run may use a different number of processors/MPI workers
+        or memory settings.  Matrices are numbered in the order they are
+        computed (``checkpoint_index``), so the restarted run must compute
+        the same matrices in the same order, including those found in
+        ``gram_cache``.  A checkpoint saved for other vectors (see
+        :py:meth:`vectors.VecHandle.get_key`) raises a ValueError, so the
+        directory must be emptied when the vectors change.  Default is None
+        (no checkpoints).
+
+        ``checkpoint_interval``: Minimum time (in seconds) between
+        checkpoints.  Default is 600.
+
+        ``tracer``: A :py:class:`tracing.Tracer`, which records the time
+        spent, and the bytes handled, in each phase of each operation:
+        retrieving and putting vectors, computing inner products and sums,
+        waiting for vectors from other processors/MPI workers, and the
+        collective operations at the end.  Use it to find load imbalance and
+        communication stalls, e.g., by saving a Chrome trace with
+        :py:meth:`tracing.Tracer.save_chrome_trace`.  Default is None (no
+        tracing).
+
+        ``gram_cache``: A :py:class:`gramcache.GramCache`, in which the inner
+        products computed are saved, keyed by the vectors and the inner
+        product, so that inner products computed before, e.g., by another
+        decomposition or run with some of the same vectors, are not computed
+        again.  Unlike checkpoints, any matrix of vectors whose inner
+        products were saved can use them.  When all of the inner products of
+        a matrix were saved, no vectors are retrieved (except the first, to
+        calibrate the cost model, see :py:meth:`calibrate`).  With the
+        dynamic schedule, the vectors of tiles whose inner products were all
+        saved are not retrieved either.  Default is None (no cache).
+
+    The cost of each operation is predicted with a cost model (see
+    :py:meth:`calibrate` and :py:meth:`plan`), which is measured on the
+    first vector the first time an operation is called, and reused after
+    that.
+
     This class implements low-level functions for computing large numbers of
     vector sums and inner products.  These functions are used by high-level
     classes in :py:mod:`pod`, :py:mod:`bpod`, :py:mod:`dmd` and
@@ -105,39 +1223,593 @@ class VectorSpaceHandles(object):
     supplied, and sometimes loading from file is slower with more processors.
     """
     def __init__(self, inner_product=None,
-        max_vecs_per_node=None, verbosity=1, print_interval=10):
+        max_vecs_per_node=None, verbosity=1, print_interval=10,
+        inner_product_block=None, num_get_threads=0, num_put_threads=0,
+        max_bytes_per_node=None, schedule='static', weigh_tasks=False,
+        node_cache_vecs=0, hierarchical_ring=False, checkpoint_dir=None,
+        checkpoint_interval=600, tracer=None, gram_cache=None):
         """Constructor."""
+        if schedule not in ['static', 'dynamic', 'auto']:
+            raise ValueError('Invalid schedule "%s", must be "static", '
+                '"dynamic", or "auto"'%schedule)
+        self.schedule = schedule
+        self.weigh_tasks = weigh_tasks
+        self.node_cache_vecs = node_cache_vecs
+        self.hierarchical_ring = hierarchical_ring
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_index = 0
+        self.tracer = tracer
+        self.gram_cache = gram_cache
+        self.cost_model = None
         self.inner_product = inner_product
+        self.inner_product_block = inner_product_block
+        self.num_get_threads = num_get_threads
+        self.num_put_threads = num_put_threads
         self.verbosity = verbosity
         self.print_interval = print_interval
         self.prev_print_time = 0.
 
-        if max_vecs_per_node is None:
-            self.max_vecs_per_node = 10000 # different default?
-            self.print_msg('Warning: max_vecs_per_node was not specified. '
-                'Assuming %d vecs can be in memory per node. Decrease '
-                'max_vecs_per_node if memory errors.'%self.max_vecs_per_node)
+        self.max_bytes_per_node = max_bytes_per_node
+        self.peak_bytes_per_proc = 0
+
+        if max_bytes_per_node is not None:
+            # Set from the size of the vecs at the start of each operation
+            self.max_vecs_per_node = None
+            self.max_vecs_per_proc = None
         else:
-            self.max_vecs_per_node = max_vecs_per_node
+            if max_vecs_per_node is None:
+                self.max_vecs_per_node = 10000 # different default?
+                self.print_msg('Warning: max_vecs_per_node was not specified. '
+                    'Assuming %d vecs can be in memory per node. Decrease '
+                    'max_vecs_per_node if memory errors.'%
+                    self.max_vecs_per_node)
+            else:
+                self.max_vecs_per_node = max_vecs_per_node
+            self._set_max_vecs_per_proc()
 
-        if self.max_vecs_per_node < \
+
+    def _set_max_vecs_per_proc(self):
+        """Sets ``max_vecs_per_proc`` from ``max_vecs_per_node``, less the
+        vectors in the node cache."""
+        max_vecs_per_node = self.max_vecs_per_node - self.node_cache_vecs
+        self.max_vecs_per_proc = _find_max_vecs_per_proc(max_vecs_per_node,
+            parallel.get_num_procs(), parallel.get_num_nodes())
+        if max_vecs_per_node < \
             2 * parallel.get_num_procs() / parallel.get_num_nodes():
-            self.max_vecs_per_proc = 2
             self.print_msg('Warning: max_vecs_per_node too small for given '
                 'number of nodes and procs. Assuming 2 vecs can be '
                 'in memory per processor. If possible, increase '
                 'max_vecs_per_node for a speedup.')
+
+
+    def _set_max_vecs_from_bytes(self, vec_handle):
+        """Sets ``max_vecs_per_node`` from ``max_bytes_per_node`` and the size
+        of the vector retrieved with ``vec_handle``.  Also resets
+        ``peak_bytes_per_proc`` at the start of an operation.
+
+        A fraction of the memory is kept as a safety margin, and room for
+        scratch vecs (e.g., temporaries in user functions) is left on each
+        processor.  Does nothing else if ``max_bytes_per_node`` is None.
+        """
+        self.peak_bytes_per_proc = 0
+        if self.max_bytes_per_node is None:
+            return
+        vec_nbytes = parallel.allreduce_max(
+            max(1, util.get_nbytes(vec_handle.get())))
+        if self.max_bytes_per_node == 'auto':
+            # Every processor on a node sees the same memory, so use the
+            # smallest value measured.
+            available_bytes = util.get_available_memory()
+            if available_bytes is None:
+                available_bytes = -1
+            max_bytes_per_node = parallel.allreduce_min(available_bytes)
+            if max_bytes_per_node < 0:
+                raise RuntimeError('Cannot determine the available memory, '
+                    'specify max_bytes_per_node')
         else:
-            self.max_vecs_per_proc = self.max_vecs_per_node * \
-                parallel.get_num_nodes() // parallel.get_num_procs()
+            max_bytes_per_node = self.max_bytes_per_node
+        num_procs_per_node = parallel.get_num_procs() // \
+            parallel.get_num_nodes()
+        self.max_vecs_per_node = max(1, int(_memory_safety_factor *
+            max_bytes_per_node / vec_nbytes) -
+            _num_scratch_vecs_per_proc * num_procs_per_node)
+        self.print_msg('Assuming %d vecs of %d bytes can be in memory per '
+            'node'%(self.max_vecs_per_node, vec_nbytes))
+        self._set_max_vecs_per_proc()
+
+
+    def _record_bytes_in_mem(self, vec_lists, num_bytes=0, prefetcher=None,
+        writer=None):
+        """Updates ``peak_bytes_per_proc`` with the bytes held in the vecs in
+        ``vec_lists``, ``num_bytes`` more, and the vecs held by
+        ``prefetcher`` and ``writer``."""
+        num_bytes += sum([util.get_nbytes(vec) for vecs in vec_lists
+            for vec in vecs if vec is not None])
+        if prefetcher is not None:
+            num_bytes += prefetcher.get_nbytes()
+        if writer is not None:
+            num_bytes += writer.pending_nbytes
+        self.peak_bytes_per_proc = max(self.peak_bytes_per_proc, num_bytes)
+
+
+    def _print_peak_bytes(self):
+        """Prints the largest ``peak_bytes_per_proc`` of all processors."""
+        peak_bytes_per_proc = parallel.allreduce_max(self.peak_bytes_per_proc)
+        self.print_msg('Peak memory held in vecs: %.1f MB per processor'%(
+            peak_bytes_per_proc / 2.**20))
+
+
+    def _find_task_weights(self, vec_handles):
+        """Returns the costs of ``vec_handles`` to use as task weights if
+        ``weigh_tasks`` is True, otherwise None.  The costs are found on rank
+        zero only, to avoid many processors/MPI workers checking the same
+        files."""
+        if not self.weigh_tasks:
+            return None
+        return parallel.call_and_bcast(V.find_vec_handle_costs, vec_handles)
+
+
+    def _make_node_cache(self):
+        """Returns a :py:class:`_NodeVecCache` if ``node_cache_vecs`` is
+        greater than 0, otherwise None."""
+        if self.node_cache_vecs > 0:
+            return _NodeVecCache(self.node_cache_vecs)
+        return None
+
+
+    def _wrap_vec_handles(self, node_cache, vec_handles, name):
+        """Returns handles that retrieve the vectors of ``vec_handles``
+        through ``node_cache``, if there is one, and record retrieving and
+        putting them with ``tracer``, if there is one."""
+        if node_cache is not None:
+            vec_handles = node_cache.wrap(vec_handles, name)
+        if self.tracer is not None:
+            vec_handles = [_TracedVecHandle(self.tracer, vec_handle)
+                for vec_handle in vec_handles]
+        return vec_handles
+
+
+    def _trace(self, name, num_bytes=0):
+        """Returns a context manager that records the code run within it as
+        an event ``name`` with ``tracer``, if there is one."""
+        return tracing.span(self.tracer, name, num_bytes)
+
+
+    def _record_event(self, name, start_time, num_bytes=0):
+        """Records an event ``name`` from ``start_time`` until now with
+        ``tracer``, if there is one."""
+        if self.tracer is not None:
+            self.tracer.record(name, start_time, time(), num_bytes)
+
+
+    def _check_assembly(self, assembly):
+        """Check that ``assembly`` is a valid assembly mode for an inner
+        product matrix."""
+        if assembly not in ['allreduce', 'rank_zero', 'distributed']:
+            raise ValueError('Invalid assembly "%s", must be "allreduce", '
+                '"rank_zero", or "distributed"'%assembly)
+
+
+    def _assemble_IP_mat(self, IP_mat, assembly):
+        """Assembles a :py:class:`DistributedMatrix` as requested by
+        ``assembly`` (see :py:meth:`compute_inner_product_mat`)."""
+        if assembly == 'allreduce':
+            with self._trace('allreduce', num_bytes=int(
+                np.prod(IP_mat.shape)) * np.dtype(IP_mat.dtype).itemsize):
+                return IP_mat.allreduce()
+        elif assembly == 'rank_zero':
+            with self._trace('gather', num_bytes=IP_mat.num_local_elements *
+                np.dtype(IP_mat.dtype).itemsize):
+                return IP_mat.gather()
+        return IP_mat
+
+
+    def _make_checkpoint(self, IP_mat, vec_keys):
+        """Returns a :py:class:`checkpointing.IPMatCheckpoint` for ``IP_mat``
+        if ``checkpoint_dir`` is given, otherwise None.  ``vec_keys`` are the
+        keys of the row and col vecs (see :py:meth:`_find_vec_keys`), which
+        must match those of the saved checkpoint."""
+        if self.checkpoint_dir is None:
+            return None
+        checkpoint = checkpointing.IPMatCheckpoint(self.checkpoint_dir,
+            'IP_mat_%03d'%self.checkpoint_index, IP_mat,
+            self.checkpoint_interval, vec_keys)
+        self.checkpoint_index += 1
+        if len(checkpoint.saved_blocks) > 0:
+            self.print_msg('Restoring inner products saved in %s'%
+                self.checkpoint_dir)
+        return checkpoint
+
+
+    def _is_schedule_dynamic(self, plan, checkpoint):
+        """Returns True if the tiles of an inner product matrix are computed
+        with the dynamic schedule.  It is used when planned, and when
+        restarting from a checkpoint, since it does not retrieve the vecs of
+        the tiles that are restored, whereas the static schedule passes every
+        vec around the ring."""
+        if plan['schedule'] == 'dynamic':
+            return True
+        if checkpoint is not None and checkpoint.has_saved_blocks():
+            self.print_msg('Using the dynamic schedule to restore the inner '
+                'products saved in %s'%self.checkpoint_dir)
+            return True
+        return False
+
+
+    def _find_vec_keys(self, row_vec_handles, col_vec_handles):
+        """Returns the keys of ``row_vec_handles`` and ``col_vec_handles``
+        (see :py:func:`vectors.find_vec_handle_keys`) if they are used by
+        ``gram_cache`` or ``checkpoint_dir``, otherwise None.  The keys are
+        found on rank zero only, to avoid many processors/MPI workers
+        checking the same files."""
+        if self.gram_cache is None and self.checkpoint_dir is None:
+            return None
+        row_keys = parallel.call_and_bcast(
+            V.find_vec_handle_keys, row_vec_handles)
+        if col_vec_handles is row_vec_handles:
+            col_keys = row_keys
+        else:
+            col_keys = parallel.call_and_bcast(
+                V.find_vec_handle_keys, col_vec_handles)
+        return row_keys, col_keys
+
+
+    def _make_gram_cache(self, vec_keys):
+        """Returns an :py:class:`_IPMatGramCache` for the inner products of
+        the vecs with ``vec_keys``, the keys of the row and col vecs (see
+        :py:meth:`_find_vec_keys`), if ``gram_cache`` is given, otherwise
+        None."""
+        if self.gram_cache is None:
+            return None
+        inner_product_key = self.gram_cache.inner_product_key
+        if inner_product_key is None:
+            if self.inner_product is not None:
+                inner_product_key = gramcache.find_inner_product_key(
+                    self.inner_product)
+            else:
+                inner_product_key = gramcache.find_inner_product_key(
+                    self.inner_product_block)
+        row_keys, col_keys = vec_keys
+        return _IPMatGramCache(
+            self.gram_cache, inner_product_key, row_keys, col_keys)
+
+
+    def _add_IP_tile(self, IP_mat, checkpoint, gram_cache, row_start,
+        col_start, row_vecs, col_vecs, transpose=False):
+        """Adds the tile of inner products of ``row_vecs`` with ``col_vecs``
+        to ``IP_mat``, restoring it from ``checkpoint`` instead of computing
+        it if it was saved, and saves a checkpoint if one is due.  Inner
+        products saved in ``gram_cache`` are not computed again.
+
+        If ``col_vecs`` is None, the tile is on the diagonal of a symmetric
+        matrix, and the inner products of ``row_vecs`` with themselves are
+        computed."""
+        if col_vecs is None:
+            num_cols = len(row_vecs)
+        else:
+            num_cols = len(col_vecs)
+        if checkpoint is None or not checkpoint.restore(IP_mat, row_start,
+            col_start, len(row_vecs), num_cols, transpose=transpose):
+            if gram_cache is not None:
+                IP_mat.add_block(row_start, col_start,
+                    self._compute_cached_IP_tile(gram_cache, row_start,
+                    col_start, row_vecs, col_vecs), transpose=transpose)
+            elif col_vecs is None:
+                IP_mat.add_block(row_start, col_start,
+                    self._compute_symmetric_IP_tile(row_vecs))
+            else:
+                IP_mat.add_block(row_start, col_start,
+                    self._compute_IP_tile(row_vecs, col_vecs),
+                    transpose=transpose)
+        if checkpoint is not None:
+            checkpoint.update(IP_mat)
+
+
+    def _compute_cached_IP_tile(self, gram_cache, row_start, col_start,
+        row_vecs, col_vecs):
+        """Computes the tile of inner products of ``row_vecs`` with
+        ``col_vecs`` (or its upper-triangular part, if ``col_vecs`` is None,
+        as in :py:meth:`_add_IP_tile`), using the inner products saved in
+        ``gram_cache`` and saving the others.
+
+        Only the rows and cols with inner products that were not saved are
+        computed."""
+        is_diagonal = col_vecs is None
+        if is_diagonal:
+            col_vecs = row_vecs
+        row_indices = np.arange(row_start, row_start + len(row_vecs))
+        col_indices = np.arange(col_start, col_start + len(col_vecs))
+        tile, is_found = gram_cache.find_tile(row_indices, col_indices)
+        if is_diagonal:
+            is_found = np.triu(is_found) | np.tril(
+                np.ones(is_found.shape, dtype=bool), -1)
+        missing_rows = np.nonzero(~is_found.all(axis=1))[0]
+        missing_cols = np.nonzero(~is_found.all(axis=0))[0]
+        if is_diagonal and len(missing_rows) == len(row_vecs):
+            # Nothing was saved, so only the upper-triangular part is
+            # computed, and saved as a full tile.
+            tile = self._compute_symmetric_IP_tile(row_vecs)
+            gram_cache.save_tile(row_indices, col_indices,
+                tile + np.triu(tile, 1).conj().T)
+            return tile
+        if len(missing_rows) > 0:
+            missing_tile = self._compute_IP_tile(
+                [row_vecs[row_index] for row_index in missing_rows],
+                [col_vecs[col_index] for col_index in missing_cols])
+            gram_cache.save_tile(row_indices[missing_rows],
+                col_indices[missing_cols], missing_tile)
+            tile = tile.astype(np.result_type(tile, missing_tile), copy=False)
+            tile[np.ix_(missing_rows, missing_cols)] = missing_tile
+        if is_diagonal:
+            return np.triu(tile)
+        return tile
+
+
+    def _finish_IP_mat(self, IP_mat, assembly, prefetcher, node_cache,
+        checkpoint):
+        """Assembles ``IP_mat`` once all of its blocks are computed, and
+        prints the final progress messages."""
+        prefetcher.close()
+        if node_cache is not None:
+            node_cache.close()
+        if checkpoint is not None:
+            checkpoint.save(IP_mat, is_complete=True)
+
+        IP_mat.find_common_dtype()
+        IP_mat = self._assemble_IP_mat(IP_mat, assembly)
+
+        percent_completed_IPs = 100.
+        self.print_msg(('Completed %.1f%% of inner ' +
+            'products')%percent_completed_IPs, sys.stderr)
+        self.prev_print_time = time()
+        self._print_peak_bytes()
+
+        with self._trace('barrier'):
+            parallel.barrier()
+        return IP_mat
+
+
+    def _finish_lin_combine(self, prefetcher, writer, node_cache):
+        """Waits for the sums of :py:meth:`lin_combine` to be put, and prints
+        the final progress messages."""
+        prefetcher.close()
+        writer.close()
+        if node_cache is not None:
+            node_cache.close()
+        self.print_msg('Completed %.1f%% of linear combinations' % 100.)
+        self.prev_print_time = time()
+        self._print_peak_bytes()
+        with self._trace('barrier'):
+            parallel.barrier()
 
 
     def _check_inner_product(self):
-        """Check that ``inner_product`` is defined"""
-        if self.inner_product is None:
+        """Check that ``inner_product`` or ``inner_product_block`` is
+        defined"""
+        if self.inner_product is None and self.inner_product_block is None:
             raise RuntimeError('inner product function is not defined')
 
 
+    def _compute_scalar_inner_product(self, vec1, vec2):
+        """Computes a single inner product, using ``inner_product_block`` if
+        ``inner_product`` is not defined."""
+        if self.inner_product is not None:
+            return self.inner_product(vec1, vec2)
+        return np.array(self.inner_product_block([vec1], [vec2]))[0, 0]
+
+
+    def _compute_IP_tile(self, row_vecs, col_vecs):
+        """Computes the 2D array of inner products of ``row_vecs`` with
+        ``col_vecs``.
+
+        Uses a single call to ``inner_product_block`` if it is defined,
+        otherwise calls ``inner_product`` for every pair."""
+        with self._trace('inner_product'):
+            if self.inner_product_block is not None:
+                return np.array(self.inner_product_block(row_vecs, col_vecs))
+            return np.array([[self.inner_product(row_vec, col_vec)
+                for col_vec in col_vecs] for row_vec in row_vecs])
+
+
+    def _compute_symmetric_IP_tile(self, vecs):
+        """Computes the upper-triangular part (including the diagonal) of the
+        2D array of inner products of ``vecs`` with themselves.  Elements
+        below the diagonal are zero."""
+        with self._trace('inner_product'):
+            if self.inner_product_block is not None:
+                return np.triu(np.array(self.inner_product_block(vecs, vecs)))
+            tile = np.array([[
+                self.inner_product(vecs[row_index], vecs[col_index])
+                if col_index >= row_index else 0.
+                for col_index in range(len(vecs))]
+                for row_index in range(len(vecs))])
+            return tile
+
+
+    def _make_prefetcher(self, num_vecs_per_chunk):
+        """Returns a :py:class:`_VecPrefetcher` for chunks of
+        ``num_vecs_per_chunk`` vectors.  Prefetching is disabled if the extra
+        chunk would leave no room for other vectors."""
+        if self.num_get_threads > 0 and (
+            self.max_vecs_per_proc - 2 * num_vecs_per_chunk < 1):
+            self.print_msg('Warning: max_vecs_per_node too small to prefetch '
+                'vecs. Retrieving vecs without prefetching.')
+            return _VecPrefetcher(0)
+        return _VecPrefetcher(self.num_get_threads)
+
+
+    def _find_num_inner_chunks_in_mem(self, prefetcher):
+        """Returns the number of chunks of vecs passed around the ring that
+        are in memory at once.  This includes the chunk being prefetched, and
+        in parallel, the chunk being received for the next pass (see
+        :py:func:`parallel.circulate_vecs`)."""
+        return _count_inner_chunks_in_mem(prefetcher.num_chunks_in_mem,
+            parallel.get_num_procs(), parallel.get_max_num_procs_per_node(),
+            self._use_hierarchical_ring())
+
+
+    def _use_hierarchical_ring(self):
+        """Returns True if vecs are passed with
+        :py:func:`parallel.circulate_vecs_hierarchical`."""
+        return self.hierarchical_ring and parallel.get_num_nodes() > 1
+
+
+    def _circulate_vecs(self, vecs, indices):
+        """Passes ``vecs`` and ``indices`` among all processors/MPI workers,
+        as :py:func:`parallel.circulate_vecs`, using a hierarchical ring if
+        ``hierarchical_ring`` is True, and recording the waits with
+        ``tracer``, if there is one."""
+        if self._use_hierarchical_ring():
+            vecs_iter = parallel.circulate_vecs_hierarchical(vecs, indices)
+        else:
+            vecs_iter = parallel.circulate_vecs(vecs, indices)
+        if self.tracer is not None:
+            return _trace_vec_waits(self.tracer, vecs_iter)
+        return vecs_iter
+
+
+    def _find_num_put_threads(self, num_vecs_available):
+        """Returns the number of threads to put vecs with, given that sums can
+        use at most ``num_vecs_available`` vectors of memory.  Write-behind
+        needs room for two chunks of sums, so it is disabled if there is not
+        enough memory for it."""
+        if self.num_put_threads > 0 and num_vecs_available < 2:
+            self.print_msg('Warning: max_vecs_per_node too small to put vecs '
+                'in the background. Putting vecs without write-behind.')
+            return 0
+        return self.num_put_threads
+
+
+    def _print_dynamic_progress(self, task_index, num_tasks, operation):
+        """Prints progress through ``num_tasks`` tasks handed out by
+        :py:func:`parallel.dynamic_tasks`, as of task ``task_index``."""
+        if (time() - self.prev_print_time) > self.print_interval:
+            self.print_msg('Completed %.1f%% of %s'%(
+                task_index * 100. / num_tasks, operation), sys.stderr)
+            self.prev_print_time = time()
+
+
+    def _compute_IP_tiles_dynamic(self, IP_mat, checkpoint, gram_cache,
+        row_vec_handles, col_vec_handles, num_rows_per_tile,
+        num_cols_per_tile, transpose=False):
+        """Computes the inner products of ``row_vec_handles`` and
+        ``col_vec_handles`` in tiles handed out by
+        :py:func:`parallel.dynamic_tasks`, adding them to ``IP_mat``.
+
+        If ``IP_mat`` is symmetric, the row and col handles are the same,
+        and only the tiles on and above the diagonal are computed.  Tiles are
+        numbered along rows, so the row vecs are kept when a proc takes two
+        tiles in the same row in a row.  Tiles saved in ``checkpoint``, or
+        whose inner products are all saved in ``gram_cache``, are restored
+        without retrieving their vecs.
+        """
+        row_starts = list(range(0, len(row_vec_handles), num_rows_per_tile))
+        col_starts = list(range(0, len(col_vec_handles), num_cols_per_tile))
+        if IP_mat.is_symmetric:
+            tiles = [(row_start, col_start)
+                for row_index, row_start in enumerate(row_starts)
+                for col_start in col_starts[row_index:]]
+        else:
+            tiles = [(row_start, col_start)
+                for row_start in row_starts for col_start in col_starts]
+
+        row_vecs = []
+        prev_row_start = None
+        for tile_index in parallel.dynamic_tasks(len(tiles)):
+            row_start, col_start = tiles[tile_index]
+            num_rows = len(
+                row_vec_handles[row_start:row_start + num_rows_per_tile])
+            num_cols = len(
+                col_vec_handles[col_start:col_start + num_cols_per_tile])
+            if checkpoint is not None and checkpoint.restore(IP_mat,
+                row_start, col_start, num_rows, num_cols,
+                transpose=transpose):
+                continue
+            if gram_cache is not None and gram_cache.restore(IP_mat,
+                row_start, col_start, num_rows, num_cols,
+                transpose=transpose):
+                continue
+            if row_start != prev_row_start:
+                del row_vecs
+                row_vecs = [vec_handle.get() for vec_handle in
+                    row_vec_handles[row_start:row_start + num_rows_per_tile]]
+                prev_row_start = row_start
+            if IP_mat.is_symmetric and col_start == row_start:
+                self._record_bytes_in_mem([row_vecs])
+                self._add_IP_tile(IP_mat, checkpoint, gram_cache,
+                    row_start, col_start, row_vecs, None)
+            else:
+                col_vecs = [vec_handle.get() for vec_handle in
+                    col_vec_handles[col_start:col_start + num_cols_per_tile]]
+                self._record_bytes_in_mem([row_vecs, col_vecs])
+                self._add_IP_tile(IP_mat, checkpoint, gram_cache,
+                    row_start, col_start, row_vecs, col_vecs,
+                    transpose=transpose)
+                del col_vecs
+            self._print_dynamic_progress(
+                tile_index, len(tiles), 'inner products')
+        del row_vecs
+
+
+    def _compute_sums_dynamic(self, sum_vec_handles, basis_vec_handles,
+        coeff_mat, num_sums_per_chunk, num_bases_per_chunk, prefetcher,
+        writer, buffer_pool):
+        """Computes the linear combinations of :py:meth:`lin_combine` in
+        chunks of sums handed out by :py:func:`parallel.dynamic_tasks`.
+
+        For each chunk of sums, all of the bases are retrieved, in chunks,
+        and the sums are put with ``writer``.  When the bases fit in one
+        chunk, they are only retrieved once.  The memory of sums that have
+        been put is reused from ``buffer_pool``, if there is one.
+        """
+        num_sums = len(sum_vec_handles)
+        num_bases = len(basis_vec_handles)
+        basis_starts = list(range(0, num_bases, num_bases_per_chunk))
+        num_sum_chunks = int(np.ceil(num_sums * 1. / num_sums_per_chunk))
+        basis_vecs = None
+        for sum_chunk_index in parallel.dynamic_tasks(num_sum_chunks):
+            start_sum_index = sum_chunk_index * num_sums_per_chunk
+            end_sum_index = min(num_sums, start_sum_index + num_sums_per_chunk)
+            sum_layers = [None] * (end_sum_index - start_sum_index)
+
+            for basis_chunk_index, start_basis_index in enumerate(
+                basis_starts):
+                end_basis_index = min(
+                    num_bases, start_basis_index + num_bases_per_chunk)
+                if len(basis_starts) > 1 or basis_vecs is None:
+                    basis_vecs = prefetcher.get(
+                        (start_basis_index, end_basis_index),
+                        basis_vec_handles[start_basis_index:end_basis_index])
+                if basis_chunk_index < len(basis_starts) - 1:
+                    next_start_basis_index = \
+                        basis_starts[basis_chunk_index + 1]
+                    next_end_basis_index = min(num_bases,
+                        next_start_basis_index + num_bases_per_chunk)
+                    prefetcher.prefetch(
+                        (next_start_basis_index, next_end_basis_index),
+                        basis_vec_handles[
+                        next_start_basis_index:next_end_basis_index])
+
+                start_time = time()
+                _add_sum_layers(sum_layers, basis_vecs,
+                    coeff_mat[start_basis_index:end_basis_index,
+                    start_sum_index:end_sum_index], buffer_pool=buffer_pool)
+                self._record_event('sum', start_time)
+                self._record_bytes_in_mem([sum_layers, basis_vecs],
+                    prefetcher=prefetcher, writer=writer)
+
+            for sum_index in range(start_sum_index, end_sum_index):
+                writer.put(sum_vec_handles[sum_index],
+                    sum_layers[sum_index - start_sum_index])
+            if buffer_pool is not None:
+                buffer_pool.add(sum_layers)
+            del sum_layers
+            self._print_dynamic_progress(
+                sum_chunk_index, num_sum_chunks, 'linear combinations')
+        del basis_vecs
+
+
     def print_msg(self, msg, output_channel=sys.stdout):
         """Print a message from rank zero MPI worker/processor."""
         if self.verbosity > 0 and parallel.is_rank_zero():
@@ -159,36 +1831,37 @@ class VectorSpaceHandles(object):
         # TODO: Other things which could be tested:
         # ``get``/``put`` doesn't affect other vecs (memory problems)
         self._check_inner_product()
+        inner_product = self._compute_scalar_inner_product
         tol = 1e-10
 
         test_vec = test_vec_handle.get()
         vec_copy = copy.deepcopy(test_vec)
-        vec_copy_mag2 = self.inner_product(vec_copy, vec_copy)
+        vec_copy_mag2 = inner_product(vec_copy, vec_copy)
 
         factor = 2.
         vec_mult = test_vec * factor
 
-        if abs(self.inner_product(vec_mult, vec_mult) -
+        if abs(inner_product(vec_mult, vec_mult) -
                 vec_copy_mag2 * factor**2) > tol:
             raise ValueError('Multiplication of vec/mode failed')
 
-        if abs(self.inner_product(test_vec, test_vec) -
+        if abs(inner_product(test_vec, test_vec) -
                 vec_copy_mag2) > tol:
             raise ValueError('Original vec modified by multiplication!')
         vec_add = test_vec + test_vec
-        if abs(self.inner_product(vec_add, vec_add) - vec_copy_mag2 * 4) > tol:
+        if abs(inner_product(vec_add, vec_add) - vec_copy_mag2 * 4) > tol:
             raise ValueError('Addition does not give correct result')
 
-        if abs(self.inner_product(test_vec, test_vec) - vec_copy_mag2) > tol:
+        if abs(inner_product(test_vec, test_vec) - vec_copy_mag2) > tol:
             raise ValueError('Original vec modified by addition!')
 
         vec_add_mult = test_vec * factor + test_vec
-        if abs(self.inner_product(vec_add_mult, vec_add_mult) - vec_copy_mag2 *
+        if abs(inner_product(vec_add_mult, vec_add_mult) - vec_copy_mag2 *
                 (factor + 1) ** 2) > tol:
             raise ValueError('Multiplication and addition of vec/mode are '+\
                 'inconsistent')
 
-        if abs(self.inner_product(test_vec, test_vec) - vec_copy_mag2) > tol:
+        if abs(inner_product(test_vec, test_vec) - vec_copy_mag2) > tol:
             raise ValueError('Original vec modified by combo of mult/add!')
 
         #vecSub = 3.5*test_vec - test_vec
@@ -197,7 +1870,188 @@ class VectorSpaceHandles(object):
         self.print_msg('Passed the sanity check')
 
 
-    def compute_inner_product_mat(self, row_vec_handles, col_vec_handles):
+    def calibrate(self, vec_handle):
+        """Measures the cost model used by :py:meth:`plan` on the vector
+        retrieved with ``vec_handle``.
+
+        Args:
+            ``vec_handle``: Handle for a vector object like those of the
+            operations to be planned.
+
+        Sets ``cost_model``, a dictionary with the time (in seconds) to
+        retrieve the vector (``get_time``), compute its inner product with
+        itself (``inner_product_time``), scale it and add it to another
+        (``add_scale_time``), and send it to another processor/MPI worker
+        (``message_time``), and its size (``vec_nbytes``).  Each is the
+        largest found by any processor/MPI worker, so all of them predict
+        the same costs.  Putting a vector is assumed to take as long as
+        retrieving it.
+
+        The operations call this the first time they are called, and reuse
+        ``cost_model`` after that.  Call it again, or set ``cost_model`` to
+        None, if the vectors change.  Must be called by all processors/MPI
+        workers.
+        """
+        # Burn the first of each, it sometimes contains slow imports
+        vec = vec_handle.get()
+        start_time = time()
+        vec = vec_handle.get()
+        get_time = time() - start_time
+
+        inner_product_time = 0.
+        if self.inner_product is not None or \
+            self.inner_product_block is not None:
+            self._compute_scalar_inner_product(vec, vec)
+            start_time = time()
+            self._compute_scalar_inner_product(vec, vec)
+            inner_product_time = time() - start_time
+
+        vec_3 = vec + 2. * vec
+        start_time = time()
+        vec_3 = vec + 2. * vec
+        add_scale_time = time() - start_time
+        del vec_3
+
+        message_time = 0.
+        if parallel.is_distributed():
+            rank = parallel.get_rank()
+            num_procs = parallel.get_num_procs()
+            parallel.barrier()
+            start_time = time()
+            parallel.exchange_vecs([vec], [0], (rank + 1) % num_procs,
+                (rank - 1) % num_procs, rank, (rank - 1) % num_procs)
+            message_time = time() - start_time
+
+        self.cost_model = {
+            'get_time': parallel.allreduce_max(get_time),
+            'inner_product_time': parallel.allreduce_max(inner_product_time),
+            'add_scale_time': parallel.allreduce_max(add_scale_time),
+            'message_time': parallel.allreduce_max(message_time),
+            'vec_nbytes': parallel.allreduce_max(util.get_nbytes(vec))}
+
+
+    def _find_cost_model(self, vec_handle):
+        """Calibrates the cost model on ``vec_handle`` if it has not been
+        calibrated yet."""
+        if self.cost_model is None:
+            self.calibrate(vec_handle)
+
+
+    def plan(self, operation, num_row_vecs, num_col_vecs=None,
+        max_vecs_per_node=None, num_procs=None, num_nodes=None,
+        schedule=None):
+        """Predicts the cost of an operation without retrieving any vectors
+        ("dry run").
+
+        Args:
+            ``operation``: Name of the method to plan,
+            ``'compute_inner_product_mat'``,
+            ``'compute_symmetric_inner_product_mat'``, or ``'lin_combine'``.
+
+            ``num_row_vecs``: Number of row vecs of the inner product matrix,
+            or number of basis vecs for :py:meth:`lin_combine`.
+
+        Kwargs:
+            ``num_col_vecs``: Number of col vecs of the inner product matrix,
+            or number of sum vecs for :py:meth:`lin_combine`.  Not needed for
+            symmetric inner product matrices.
+
+            ``max_vecs_per_node``: Maximum number of vectors that can be
+            stored in memory, per node.  Default is the current value.
+
+            ``num_procs``: Number of processors/MPI workers.  Default is the
+            current number.
+
+            ``num_nodes``: Number of nodes.  Default is the current number.
+
+            ``schedule``: ``'static'``, ``'dynamic'``, or ``'auto'`` (see
+            :py:class:`VectorSpaceHandles`).  Default is ``schedule``.
+
+        Returns:
+            ``plan``: Dictionary with the ``schedule`` used (with
+            ``'auto'``, the one predicted to be faster), the numbers of outer
+            and inner vecs in each chunk (``num_vecs_per_chunk``), and the
+            predicted ``num_gets``, ``num_puts``, ``num_inner_products``,
+            ``num_add_scales``, bytes sent to other processors/MPI workers
+            (``num_message_bytes``), and bytes held in vectors at once
+            (``peak_bytes``) of the busiest processor/MPI worker, and the
+            wall ``time`` in seconds.
+
+        The costs are predicted with ``cost_model`` (see
+        :py:meth:`calibrate`), so they can be found for other numbers of
+        vectors, processors/MPI workers, and amounts of memory than the
+        current ones, e.g., to choose ``max_vecs_per_node`` or the number of
+        processors/MPI workers before a long run.  The time does not account
+        for prefetching and write-behind, which hide some of the time spent
+        retrieving and putting vectors.
+        """
+        if self.cost_model is None:
+            raise util.UndefinedError('No cost model, call calibrate first')
+        if max_vecs_per_node is None:
+            max_vecs_per_node = self.max_vecs_per_node
+        if max_vecs_per_node is None:
+            raise util.UndefinedError('max_vecs_per_node is not known until '
+                'an operation is started, specify it')
+        if num_procs is None:
+            num_procs = parallel.get_num_procs()
+            num_procs_per_node = parallel.get_max_num_procs_per_node()
+        else:
+            num_procs_per_node = None
+        if num_nodes is None:
+            num_nodes = parallel.get_num_nodes()
+        if num_procs_per_node is None:
+            num_procs_per_node = int(np.ceil(num_procs * 1. / num_nodes))
+        if num_col_vecs is None:
+            num_col_vecs = num_row_vecs
+        if schedule is None:
+            schedule = self.schedule
+        if schedule == 'auto':
+            plans = [self.plan(operation, num_row_vecs, num_col_vecs,
+                max_vecs_per_node=max_vecs_per_node, num_procs=num_procs,
+                num_nodes=num_nodes, schedule=candidate_schedule)
+                for candidate_schedule in ['static', 'dynamic']]
+            if plans[1]['time'] < plans[0]['time']:
+                return plans[1]
+            return plans[0]
+
+        # Find the memory available to each processor/MPI worker as the
+        # operations do
+        max_vecs_per_proc = _find_max_vecs_per_proc(
+            max_vecs_per_node - self.node_cache_vecs, num_procs, num_nodes)
+        if self.num_get_threads > 0 and max_vecs_per_proc > 2:
+            num_prefetch_chunks = 2
+        else:
+            num_prefetch_chunks = 1
+        if schedule == 'static':
+            num_inner_chunks_in_mem = _count_inner_chunks_in_mem(
+                num_prefetch_chunks, num_procs, num_procs_per_node,
+                self.hierarchical_ring and num_nodes > 1)
+        else:
+            num_inner_chunks_in_mem = num_prefetch_chunks
+        num_sum_chunks_in_mem = 1
+        if self.num_put_threads > 0 and operation == 'lin_combine' and \
+            max_vecs_per_proc - num_inner_chunks_in_mem >= 2:
+            num_sum_chunks_in_mem = 2
+
+        plan = _count_operations(operation, schedule, num_row_vecs,
+            num_col_vecs, num_procs, max_vecs_per_proc,
+            num_inner_chunks_in_mem=num_inner_chunks_in_mem,
+            num_sum_chunks_in_mem=num_sum_chunks_in_mem)
+        cost_model = self.cost_model
+        plan['schedule'] = schedule
+        plan['num_message_bytes'] = plan['num_vecs_sent'] * \
+            cost_model['vec_nbytes']
+        plan['peak_bytes'] = plan['num_vecs_in_mem'] * cost_model['vec_nbytes']
+        plan['time'] = (
+            (plan['num_gets'] + plan['num_puts']) * cost_model['get_time'] +
+            plan['num_inner_products'] * cost_model['inner_product_time'] +
+            plan['num_add_scales'] * cost_model['add_scale_time'] +
+            plan['num_vecs_sent'] * cost_model['message_time'])
+        return plan
+
+
+    def compute_inner_product_mat(self, row_vec_handles, col_vec_handles,
+        assembly='allreduce'):
         """Computes matrix whose elements are inner products of the vector
         objects in ``row_vec_handles`` and ``col_vec_handles``.
 
@@ -210,8 +2064,19 @@ class VectorSpaceHandles(object):
             corresponding to columns of the inner product matrix.  For example,
             in BPOD this is the direct snapshot matrix :math:`X`.
 
+        Kwargs:
+            ``assembly``: How the inner product matrix is assembled from the
+            blocks computed by each processor/MPI worker.  ``'allreduce'``
+            (default) sums full matrices over all processors/MPI workers, so
+            each one gets the full matrix.  ``'rank_zero'`` gathers only the
+            blocks to rank zero, which gets the full matrix, and the others
+            get None.  ``'distributed'`` returns a
+            :py:class:`DistributedMatrix` holding the local blocks, so no
+            processor/MPI worker holds a full matrix.
+
         Returns:
-            ``IP_mat``: 2D array of inner products.
+            ``IP_mat``: 2D array of inner products, or a
+            :py:class:`DistributedMatrix` (see ``assembly``).
 
         The vectors are retrieved in memory-efficient chunks and are not all in
         memory at once.  The row vectors and column vectors are assumed to be
@@ -247,6 +2112,11 @@ class VectorSpaceHandles(object):
         processors, the processors are assigned unequal numbers of tasks.
         However, all processors are always part of the passing cycle.
 
+        The row chunks are made as small as possible without increasing the
+        number of times each column is retrieved, and the remaining memory is
+        used for chunks of several columns.  When all of the rows fit in
+        memory, this reduces the number of messages passed between processors.
+
         The scaling is:
 
         - num gets / processor ~ :math:`(n_r*n_c/((max-2)*n_p*n_p)) + n_r/n_p`
@@ -264,8 +2134,10 @@ class VectorSpaceHandles(object):
         appears in the scaling in the quadratic term).
         """
         self._check_inner_product()
+        self._check_assembly(assembly)
         row_vec_handles = util.make_iterable(row_vec_handles)
         col_vec_handles = util.make_iterable(col_vec_handles)
+        self._set_max_vecs_from_bytes(row_vec_handles[0])
 
         num_cols = len(col_vec_handles)
         num_rows = len(row_vec_handles)
@@ -284,25 +2156,54 @@ class VectorSpaceHandles(object):
         # convenience
         rank = parallel.get_rank()
 
-        ## Old way that worked
-        # num_cols_per_proc_chunk is the number of cols each proc gets at once
-        num_cols_per_proc_chunk = 1
-        num_rows_per_proc_chunk = self.max_vecs_per_proc - \
-            num_cols_per_proc_chunk
-
         # Determine how the retrieving and inner products will be split up.
-        row_tasks = parallel.find_assignments(list(range(num_rows)))
-        col_tasks = parallel.find_assignments(list(range(num_cols)))
+        row_tasks = parallel.find_assignments(list(range(num_rows)),
+            task_weights=self._find_task_weights(row_vec_handles))
+        col_tasks = parallel.find_assignments(list(range(num_cols)),
+            task_weights=self._find_task_weights(col_vec_handles))
 
         # Find max number of col tasks among all processors
         max_num_row_tasks = max([len(tasks) for tasks in row_tasks])
         max_num_col_tasks = max([len(tasks) for tasks in col_tasks])
 
-        ## New way
-        #if self.max_vecs_per_node > max_num_row_tasks:
-        #    num_cols_per_proc_chunk =
-        #num_rows_per_proc_chunk = self.max_vecs_per_proc - \
-        #    num_cols_per_proc_chunk
+        # num_rows_per_proc_chunk and num_cols_per_proc_chunk are the numbers
+        # of rows and cols each proc gets at once.  The row chunk is as small
+        # as possible without increasing the number of times the cols are
+        # retrieved, and the rest of the memory goes to the col chunks.  When
+        # prefetching, the next chunk of cols is in memory too, as is the
+        # chunk being received from the neighbouring proc.
+        prefetcher = self._make_prefetcher(1)
+        num_rows_per_proc_chunk, num_cols_per_proc_chunk = _find_chunk_sizes(
+            max_num_row_tasks, max_num_col_tasks, self.max_vecs_per_proc,
+            num_inner_chunks_in_mem=self._find_num_inner_chunks_in_mem(
+            prefetcher))
+
+        # Each processor keeps only the blocks of the inner product matrix
+        # that it computes.  They are assembled into the full matrix at the
+        # end, as requested by ``assembly``.  Blocks are added in the
+        # original (untransposed) orientation.  The matrix datatype (real or
+        # complex) is found from the blocks.
+        if transpose:
+            IP_mat = DistributedMatrix((num_cols, num_rows))
+        else:
+            IP_mat = DistributedMatrix((num_rows, num_cols))
+
+        # Restore the tiles saved by a previous run, if any.  If it finished
+        # the matrix, no vecs are needed.  The checkpoint is made first, so
+        # the matrices are numbered the same however they are found.
+        vec_keys = self._find_vec_keys(row_vec_handles, col_vec_handles)
+        checkpoint = self._make_checkpoint(IP_mat, vec_keys)
+        if checkpoint is not None and checkpoint.restore_all(IP_mat):
+            return self._finish_IP_mat(
+                IP_mat, assembly, prefetcher, None, checkpoint)
+
+        # If all of the inner products were saved in the Gram cache, no vecs
+        # are needed either.  They are not checkpointed again.
+        gram_cache = self._make_gram_cache(vec_keys)
+        if gram_cache is not None and gram_cache.restore_all(
+            IP_mat, transpose=transpose):
+            return self._finish_IP_mat(
+                IP_mat, assembly, prefetcher, None, None)
 
         # These variables are the number of iters through loops that retrieve
         # ("get") row and column vecs.
@@ -316,113 +2217,85 @@ class VectorSpaceHandles(object):
                     'number of nodes or max_vecs_per_node to reduce redundant '
                     '"get"s for a speedup.'%(num_cols, num_row_get_loops))
 
-        # Estimate the time this will take and determine matrix datatype
-        # (real or complex).
-        row_vec = row_vec_handles[0].get()
-        col_vec = col_vec_handles[0].get()
-        # Burn the first, it sometimes contains slow imports
-        IP_burn = self.inner_product(row_vec, col_vec)
-
-        start_time = time()
-        row_vec = row_vec_handles[0].get()
-        get_time = time() - start_time
+        # Predict the time this will take, and choose the schedule.  The
+        # cost model is calibrated the first time only.
+        self._find_cost_model(row_vec_handles[0])
+        plan = self.plan('compute_inner_product_mat', num_rows, num_cols)
+        self.print_msg('Computing the inner product matrix will take about '
+            '%.1f minutes' % (plan['time'] / 60.))
+
+        # Retrieve vecs through the node cache, if there is one
+        node_cache = self._make_node_cache()
+        row_vec_handles = self._wrap_vec_handles(
+            node_cache, row_vec_handles, 'row')
+        col_vec_handles = self._wrap_vec_handles(
+            node_cache, col_vec_handles, 'col')
+
+        if self._is_schedule_dynamic(plan, checkpoint):
+            num_rows_per_tile, num_cols_per_tile = _find_chunk_sizes(
+                max_num_row_tasks, max_num_col_tasks, self.max_vecs_per_proc)
+            self._compute_IP_tiles_dynamic(IP_mat, checkpoint, gram_cache,
+                row_vec_handles, col_vec_handles, num_rows_per_tile,
+                num_cols_per_tile, transpose=transpose)
+            return self._finish_IP_mat(
+                IP_mat, assembly, prefetcher, node_cache, checkpoint)
 
-        start_time = time()
-        IP = self.inner_product(row_vec, col_vec)
-        IP_time = time() - start_time
-        IP_type = type(IP)
-
-        total_IP_time = (num_rows * num_cols * IP_time /
-            parallel.get_num_procs())
-        vecs_per_proc = self.max_vecs_per_node * parallel.get_num_nodes() / \
-            parallel.get_num_procs()
-        num_gets =  (num_rows*num_cols) / ((vecs_per_proc-2) *
-            parallel.get_num_procs()**2) + num_rows/parallel.get_num_procs()
-        total_get_time = num_gets * get_time
-        self.print_msg('Computing the inner product matrix will take at least '
-                    '%.1f minutes' % ((total_IP_time + total_get_time) / 60.))
-        del row_vec, col_vec
-
-        # To find all of the inner product mat chunks, each
-        # processor has a full IP_mat with size
-        # num_rows x num_cols even though each processor is not responsible for
-        # filling in all of these entries. After each proc fills in what it is
-        # responsible for, the other entries remain 0's. Then, an allreduce
-        # is done and all the IP_mats are summed. This is simpler
-        # concatenating chunks of the IPmats.
-        # The efficiency is not an issue, the size of the mats
-        # are small compared to the size of the vecs for large data.
-        IP_mat = np.mat(np.zeros((num_rows, num_cols), dtype=IP_type))
         for row_get_index in range(num_row_get_loops):
             if len(row_tasks[rank]) > 0:
-                start_row_index = min(row_tasks[rank][0] +
-                    row_get_index*num_rows_per_proc_chunk,
-                    row_tasks[rank][-1]+1)
-                end_row_index = min(row_tasks[rank][-1]+1,
-                    start_row_index + num_rows_per_proc_chunk)
+                start_row_index, end_row_index = _find_chunk_indices(
+                    row_tasks[rank], row_get_index, num_rows_per_proc_chunk)
                 row_vecs = [row_vec_handle.get() for row_vec_handle in
                     row_vec_handles[start_row_index:end_row_index]]
             else:
                 row_vecs = []
+            row_nbytes = sum([util.get_nbytes(vec) for vec in row_vecs])
 
             for col_get_index in range(num_col_get_loops):
-                if len(col_tasks[rank]) > 0:
-                    start_col_index = min(col_tasks[rank][0] +
-                        col_get_index*num_cols_per_proc_chunk,
-                            col_tasks[rank][-1]+1)
-                    end_col_index = min(col_tasks[rank][-1]+1,
-                        start_col_index + num_cols_per_proc_chunk)
+                start_col_index, end_col_index = _find_chunk_indices(
+                    col_tasks[rank], col_get_index, num_cols_per_proc_chunk)
+
+                # Start retrieving the next chunk of cols, which is the first
+                # chunk again once the next chunk of rows is started.
+                if col_get_index < num_col_get_loops - 1:
+                    next_start_col_index, next_end_col_index = \
+                        _find_chunk_indices(col_tasks[rank],
+                        col_get_index + 1, num_cols_per_proc_chunk)
+                elif row_get_index < num_row_get_loops - 1:
+                    next_start_col_index, next_end_col_index = \
+                        _find_chunk_indices(
+                        col_tasks[rank], 0, num_cols_per_proc_chunk)
                 else:
-                    start_col_index = 0
-                    end_col_index = 0
+                    next_start_col_index, next_end_col_index = 0, 0
+                col_vecs = prefetcher.get(
+                    (start_col_index, end_col_index),
+                    col_vec_handles[start_col_index:end_col_index])
+                prefetcher.prefetch(
+                    (next_start_col_index, next_end_col_index),
+                    col_vec_handles[next_start_col_index:next_end_col_index])
+
                 # Cycle the col vecs to proc with rank -> mod(rank+1,num_procs)
-                # Must do this for each processor, until data makes a circle
-                col_vecs_recv = (None, None)
-                col_indices = list(range(start_col_index, end_col_index))
-                for pass_index in range(parallel.get_num_procs()):
-                    #if rank==0: print 'starting pass index=',pass_index
-                    # If on the first pass, get the col vecs, no send/recv
-                    # This is all that is called when in serial, loop iterates
-                    # once.
-                    if pass_index == 0:
-                        col_vecs = [col_handle.get()
-                            for col_handle in col_vec_handles[start_col_index:
-                            end_col_index]]
-                    else:
-                        # Determine with whom to communicate
-                        dest = (rank + 1) % parallel.get_num_procs()
-                        source = (rank - 1)%parallel.get_num_procs()
-
-                        # Create unique tag based on send/recv ranks
-                        send_tag = rank * \
-                                (parallel.get_num_procs() + 1) + dest
-                        recv_tag = source * \
-                            (parallel.get_num_procs() + 1) + rank
-
-                        # Collect data and send/receive
-                        col_vecs_send = (col_vecs, col_indices)
-                        request = parallel.comm.isend(
-                            col_vecs_send, dest=dest, tag=send_tag)
-                        col_vecs_recv = parallel.comm.recv(
-                            source=source, tag=recv_tag)
-                        request.Wait()
-                        parallel.barrier()
-                        col_indices = col_vecs_recv[1]
-                        col_vecs = col_vecs_recv[0]
+                # Must do this for each processor, until data makes a circle.
+                # The col vecs for the next pass are received while the IPs
+                # for this pass are computed.
+                for col_vecs, col_indices in self._circulate_vecs(
+                    col_vecs, list(range(start_col_index, end_col_index))):
+                    self._record_bytes_in_mem(
+                        [col_vecs] * min(parallel.get_num_procs(), 2),
+                        num_bytes=row_nbytes, prefetcher=prefetcher)
 
                     # Compute the IPs for this set of data col_indices stores
                     # the indices of the IP_mat columns to be
                     # filled in.
+                    # The col indices are consecutive, so the whole tile is
+                    # filled in with one slice assignment.
                     if len(row_vecs) > 0:
-                        for row_index in range(start_row_index, end_row_index):
-                            for col_vec_index, col_vec in enumerate(col_vecs):
-                                IP_mat[row_index, col_indices[
-                                    col_vec_index]] = self.inner_product(
-                                    row_vecs[row_index - start_row_index],
-                                    col_vec)
+                        if len(col_vecs) > 0:
+                            self._add_IP_tile(IP_mat, checkpoint,
+                                gram_cache, start_row_index, col_indices[0],
+                                row_vecs, col_vecs, transpose=transpose)
                         if (time() - self.prev_print_time) > \
                             self.print_interval:
-                            num_completed_IPs = (np.abs(IP_mat)>0).sum()
+                            num_completed_IPs = IP_mat.num_local_elements
                             percent_completed_IPs = (100. * num_completed_IPs*
                                 parallel.get_num_MPI_workers()) / (
                                 num_cols*num_rows)
@@ -435,23 +2308,12 @@ class VectorSpaceHandles(object):
             # Completed a chunk of rows and all columns on all processors.
             del row_vecs
 
-        # Assign these chunks into IP_mat.
-        if parallel.is_distributed():
-            IP_mat = parallel.custom_comm.allreduce(IP_mat)
-
-        if transpose:
-            IP_mat = IP_mat.T
-
-        percent_completed_IPs = 100.
-        self.print_msg(('Completed %.1f%% of inner ' +
-            'products')%percent_completed_IPs, sys.stderr)
-        self.prev_print_time = time()
-
-        parallel.barrier()
-        return IP_mat
+        return self._finish_IP_mat(
+            IP_mat, assembly, prefetcher, node_cache, checkpoint)
 
 
-    def compute_symmetric_inner_product_mat(self, vec_handles):
+    def compute_symmetric_inner_product_mat(self, vec_handles,
+        assembly='allreduce'):
         """Computes symmetric matrix whose elements are inner products of the
         vector objects in ``vec_handles`` with each other.
 
@@ -460,8 +2322,19 @@ class VectorSpaceHandles(object):
             to both rows and columns.  For example, in POD this is the snapshot
             matrix :math:`X`.
 
+        Kwargs:
+            ``assembly``: How the inner product matrix is assembled from the
+            blocks computed by each processor/MPI worker.  ``'allreduce'``
+            (default) sums full matrices over all processors/MPI workers, so
+            each one gets the full matrix.  ``'rank_zero'`` gathers only the
+            blocks to rank zero, which gets the full matrix, and the others
+            get None.  ``'distributed'`` returns a
+            :py:class:`DistributedMatrix` holding the local blocks, so no
+            processor/MPI worker holds a full matrix.
+
         Returns:
-            ``IP_mat``: 2D array of inner products.
+            ``IP_mat``: 2D array of inner products, or a
+            :py:class:`DistributedMatrix` (see ``assembly``).
 
         See the documentation for :py:meth:`compute_inner_product_mat` for an
         idea how this works.  Efficiency is achieved by only computing the
@@ -474,7 +2347,9 @@ class VectorSpaceHandles(object):
         # TODO: JON, write detailed documentation similar to
         # :py:meth:`compute_inner_product_mat`.
         self._check_inner_product()
+        self._check_assembly(assembly)
         vec_handles = util.make_iterable(vec_handles)
+        self._set_max_vecs_from_bytes(vec_handles[0])
 
         num_vecs = len(vec_handles)
 
@@ -483,9 +2358,33 @@ class VectorSpaceHandles(object):
         # chunks.  Then symmetric upper triangular portions will be computed,
         # followed by a rectangular piece that uses columns not already in
         # memory.
-        num_cols_per_proc_chunk = 1
-        num_rows_per_proc_chunk = self.max_vecs_per_proc -\
-            num_cols_per_proc_chunk
+        # The row chunk is as small as possible without increasing the number
+        # of sets, and the rest of the memory goes to the col chunks.
+        max_num_tasks = int(np.ceil(num_vecs * 1. / parallel.get_num_procs()))
+        prefetcher = self._make_prefetcher(1)
+        num_rows_per_proc_chunk, num_cols_per_proc_chunk = _find_chunk_sizes(
+            max_num_tasks, max_num_tasks, self.max_vecs_per_proc,
+            num_inner_chunks_in_mem=self._find_num_inner_chunks_in_mem(
+            prefetcher))
+
+        # As in compute_inner_product_mat, each proc keeps only the blocks it
+        # computes.  These are triangular blocks on the diagonal and
+        # rectangular blocks off of it.  Each off-diagonal element is computed
+        # once, above or below the diagonal, and the full matrix is
+        # symmetrized when it is assembled.
+        IP_mat = DistributedMatrix((num_vecs, num_vecs), is_symmetric=True)
+
+        # Restore the tiles saved by a previous run, and the inner products
+        # saved in the Gram cache, as in compute_inner_product_mat.
+        vec_keys = self._find_vec_keys(vec_handles, vec_handles)
+        checkpoint = self._make_checkpoint(IP_mat, vec_keys)
+        if checkpoint is not None and checkpoint.restore_all(IP_mat):
+            return self._finish_IP_mat(
+                IP_mat, assembly, prefetcher, None, checkpoint)
+        gram_cache = self._make_gram_cache(vec_keys)
+        if gram_cache is not None and gram_cache.restore_all(IP_mat):
+            return self._finish_IP_mat(
+                IP_mat, assembly, prefetcher, None, None)
 
         # <nprocs> chunks are computed simulaneously, making up a set.
         num_cols_per_chunk = num_cols_per_proc_chunk * parallel.get_num_procs()
@@ -499,39 +2398,28 @@ class VectorSpaceHandles(object):
                 'number of nodes or max_vecs_per_node to reduce redundant '
                 '"get"s for a speedup.'%(num_vecs,num_row_chunks))
 
-        # Estimate the time this will take and determine matrix datatype
-        # (real or complex).
-        test_vec = vec_handles[0].get()
-        # Burn the first, it sometimes contains slow imports
-        IP_burn = self.inner_product(test_vec, test_vec)
-
-        start_time = time()
-        test_vec = vec_handles[0].get()
-        get_time = time() - start_time
+        # Predict the time this will take, and choose the schedule, as in
+        # compute_inner_product_mat.
+        self._find_cost_model(vec_handles[0])
+        plan = self.plan('compute_symmetric_inner_product_mat', num_vecs)
+        self.print_msg('Computing the inner product matrix will take about '
+            '%.1f minutes' % (plan['time'] / 60.))
+
+        # Retrieve vecs through the node cache, if there is one
+        node_cache = self._make_node_cache()
+        vec_handles = self._wrap_vec_handles(node_cache, vec_handles, 'vec')
+
+        if self._is_schedule_dynamic(plan, checkpoint):
+            # Tiles on the diagonal are square, so rows and cols are
+            # retrieved in chunks of the same size.
+            num_vecs_per_tile = max(1, min(
+                max_num_tasks, self.max_vecs_per_proc // 2))
+            self._compute_IP_tiles_dynamic(IP_mat, checkpoint, gram_cache,
+                vec_handles, vec_handles, num_vecs_per_tile,
+                num_vecs_per_tile)
+            return self._finish_IP_mat(
+                IP_mat, assembly, prefetcher, node_cache, checkpoint)
 
-        start_time = time()
-        IP = self.inner_product(test_vec, test_vec)
-        IP_time = time() - start_time
-        IP_type = type(IP)
-
-        total_IP_time = (num_vecs**2 * IP_time / 2. /
-            parallel.get_num_procs())
-        vecs_per_proc = self.max_vecs_per_node * parallel.get_num_nodes() / \
-            parallel.get_num_procs()
-        num_gets =  (num_vecs**2 /2.) / ((vecs_per_proc-2) *
-            parallel.get_num_procs()**2) + \
-            num_vecs/parallel.get_num_procs()/2.
-        total_get_time = num_gets * get_time
-        self.print_msg('Computing the inner product matrix will take at least '
-                    '%.1f minutes' % ((total_IP_time + total_get_time) / 60.))
-        del test_vec
-
-        # Use the same trick as in compute_IP_mat, having each proc
-        # fill in elements of a num_rows x num_rows sized matrix, rather than
-        # assembling small chunks. This is done for the triangular portions.
-        # For the rectangular portions, the inner product mat is filled
-        # in directly.
-        IP_mat = np.mat(np.zeros((num_vecs, num_vecs), dtype=IP_type))
         for start_row_index in range(0, num_vecs, num_rows_per_chunk):
             end_row_index = min(num_vecs, start_row_index + num_rows_per_chunk)
             proc_row_tasks_all = parallel.find_assignments(list(range(
@@ -544,6 +2432,19 @@ class VectorSpaceHandles(object):
                     proc_row_tasks[0]:proc_row_tasks[-1] + 1]]
             else:
                 row_vecs = []
+            row_nbytes = sum([util.get_nbytes(vec) for vec in row_vecs])
+
+            # Chunks of cols this proc retrieves for the rectangular portion.
+            # The first is prefetched while the triangular portion is
+            # computed.
+            proc_col_tasks_all = [parallel.find_assignments(list(range(
+                start_col_index, min(start_col_index + num_cols_per_chunk,
+                num_vecs))))[parallel.get_rank()]
+                for start_col_index in range(end_row_index, num_vecs,
+                num_cols_per_chunk)]
+            if len(proc_col_tasks_all) > 0:
+                prefetcher.prefetch(*_find_chunk_key_and_handles(
+                    vec_handles, proc_col_tasks_all[0]))
 
             # Triangular chunks
             if len(proc_row_tasks) > 0:
@@ -552,21 +2453,12 @@ class VectorSpaceHandles(object):
                     proc_row_tasks[-1] + 1)):
                     raise ValueError('Indices are not consecutive.')
 
+                self._record_bytes_in_mem([], num_bytes=row_nbytes,
+                    prefetcher=prefetcher)
+
                 # Per-processor triangles (using only vecs in memory)
-                for row_index in range(proc_row_tasks[0],
-                    proc_row_tasks[-1] + 1):
-                    # Diagonal term
-                    IP_mat[row_index, row_index] = self.\
-                        inner_product(row_vecs[row_index - proc_row_tasks[
-                        0]], row_vecs[row_index - proc_row_tasks[0]])
-
-                    # Off-diagonal terms
-                    for col_index in range(row_index + 1, proc_row_tasks[
-                        -1] + 1):
-                        IP_mat[row_index, col_index] = self.\
-                            inner_product(row_vecs[row_index -\
-                            proc_row_tasks[0]], row_vecs[col_index -\
-                            proc_row_tasks[0]])
+                self._add_IP_tile(IP_mat, checkpoint, gram_cache,
+                    proc_row_tasks[0], proc_row_tasks[0], row_vecs, None)
 
             # Number of square chunks to fill in is n * (n-1) / 2.  At each
             # iteration we fill in n of them, so we need (n-1) / 2
@@ -603,128 +2495,98 @@ class VectorSpaceHandles(object):
                     my_row_indices += [np.nan] * (max_num_to_send - my_num_rows)
                     row_vecs += [[]] * (max_num_to_send - my_num_rows)
                 """
-                for send_index in range(max_num_to_send):
-                    # Only processors responsible for rows communicate
-                    if my_num_rows > 0:
-                        # Send row vecs, in groups of num_cols_per_proc_chunk
-                        # These become columns in the ensuing computation
-                        start_col_index = send_index * num_cols_per_proc_chunk
-                        end_col_index = min(start_col_index +
-                            num_cols_per_proc_chunk, my_num_rows)
-                        col_vecs_send = (
-                            row_vecs[start_col_index:end_col_index],
-                            my_row_indices[start_col_index:end_col_index])
-
-                        # Create unique tags based on ranks
-                        send_tag = my_rank * (
-                            parallel.get_num_procs() + 1) + dest_rank
-                        recv_tag = source_rank * (
-                            parallel.get_num_procs() + 1) + my_rank
-
-                        # Send and receieve data.  The Wait() command after the
-                        # receive prevents a race condition not fixed by sync().
-                        # The Wait() is very important for the non-
-                        # blocking send (though we are unsure why).
-                        request = parallel.comm.isend(col_vecs_send,
-                            dest=dest_rank, tag=send_tag)
-                        col_vecs_recv = parallel.comm.recv(source =
-                            source_rank, tag=recv_tag)
-                        request.Wait()
-                        col_vecs = col_vecs_recv[0]
-                        my_col_indices = col_vecs_recv[1]
-
-                        for row_index in range(my_row_indices[0],
-                            my_row_indices[-1] + 1):
-                            for col_vec_index, col_vec in enumerate(col_vecs):
-                                IP_mat[row_index, my_col_indices[
-                                    col_vec_index]] = self.inner_product(
-                                    row_vecs[row_index - my_row_indices[0]],
-                                    col_vec)
-                            if (time() - self.prev_print_time) > \
-                                self.print_interval:
-                                num_completed_IPs = (np.abs(IP_mat)>0).sum()
-                                percent_completed_IPs = \
-                                    (100.*2*num_completed_IPs * \
-                                    parallel.get_num_MPI_workers())/\
-                                    (num_vecs**2)
-                                self.print_msg(
-                                    ('Completed %.1f%% of inner products') %
-                                    percent_completed_IPs, sys.stderr)
-                                self.prev_print_time = time()
-
-                    # Sync after send/receive
-                    parallel.barrier()
+                # Only processors responsible for rows communicate
+                if my_num_rows > 0:
+                    # Create unique tags based on ranks
+                    send_tag = my_rank * (
+                        parallel.get_num_procs() + 1) + dest_rank
+                    recv_tag = source_rank * (
+                        parallel.get_num_procs() + 1) + my_rank
+
+                    # Send row vecs, in groups of num_cols_per_proc_chunk
+                    # These become columns in the ensuing computation
+                    exchange = parallel.VecExchange(
+                        row_vecs[:num_cols_per_proc_chunk],
+                        my_row_indices[:num_cols_per_proc_chunk],
+                        dest_rank, source_rank, send_tag, recv_tag)
+                    for send_index in range(max_num_to_send):
+                        start_time = time()
+                        col_vecs, my_col_indices = exchange.wait()
+                        self._record_event('wait', start_time,
+                            num_bytes=util.get_nbytes(col_vecs))
+
+                        # Start sending and receiving the next group before
+                        # computing the IPs with this one.
+                        if send_index < max_num_to_send - 1:
+                            start_col_index = \
+                                (send_index + 1) * num_cols_per_proc_chunk
+                            end_col_index = \
+                                start_col_index + num_cols_per_proc_chunk
+                            exchange = parallel.VecExchange(
+                                row_vecs[start_col_index:end_col_index],
+                                my_row_indices[start_col_index:end_col_index],
+                                dest_rank, source_rank, send_tag, recv_tag)
+                        self._record_bytes_in_mem([col_vecs, col_vecs],
+                            num_bytes=row_nbytes, prefetcher=prefetcher)
+
+                        if len(col_vecs) > 0:
+                            self._add_IP_tile(IP_mat, checkpoint,
+                                gram_cache, my_row_indices[0],
+                                my_col_indices[0], row_vecs, col_vecs)
+                        if (time() - self.prev_print_time) > \
+                            self.print_interval:
+                            num_completed_IPs = IP_mat.num_local_elements
+                            percent_completed_IPs = \
+                                (100.*2*num_completed_IPs * \
+                                parallel.get_num_MPI_workers())/\
+                                (num_vecs**2)
+                            self.print_msg(
+                                ('Completed %.1f%% of inner products') %
+                                percent_completed_IPs, sys.stderr)
+                            self.prev_print_time = time()
+                    del col_vecs
 
             # Fill in the rectangular portion next to each triangle (if nec.).
             # Start at index after last row, continue to last column. This part
             # of the code is the same as in compute_IP_mat, as of
             # revision 141.
-            for start_col_index in range(end_row_index, num_vecs,
-                num_cols_per_chunk):
-                end_col_index = min(start_col_index + num_cols_per_chunk,
-                    num_vecs)
-                proc_col_tasks = parallel.find_assignments(list(range(
-                    start_col_index, end_col_index)))[parallel.get_rank()]
-
-                # Pass the col vecs to proc with rank -> mod(rank+1,numProcs)
-                # Must do this for each processor, until data makes a circle
-                col_vecs_recv = (None, None)
+            for col_chunk_index, proc_col_tasks in enumerate(
+                proc_col_tasks_all):
+
+                col_vecs = prefetcher.get(
+                    *_find_chunk_key_and_handles(vec_handles, proc_col_tasks))
+                if col_chunk_index < len(proc_col_tasks_all) - 1:
+                    prefetcher.prefetch(
+                        *_find_chunk_key_and_handles(vec_handles,
+                        proc_col_tasks_all[col_chunk_index + 1]))
                 if len(proc_col_tasks) > 0:
                     col_indices = list(range(proc_col_tasks[0],
                         proc_col_tasks[-1]+1))
                 else:
                     col_indices = []
 
-                for num_passes in range(parallel.get_num_procs()):
-                    # If on the first pass, get the col vecs, no send/recv
-                    # This is all that is called when in serial, loop iterates
-                    # once.
-                    if num_passes == 0:
-                        if len(col_indices) > 0:
-                            col_vecs = [col_handle.get() \
-                                for col_handle in vec_handles[col_indices[0]:\
-                                    col_indices[-1] + 1]]
-                        else:
-                            col_vecs = []
-                    else:
-                        # Determine whom to communicate with
-                        dest = (parallel.get_rank() + 1) % parallel.\
-                            get_num_procs()
-                        source = (parallel.get_rank() - 1) % parallel.\
-                            get_num_procs()
-
-                        # Create unique tag based on ranks
-                        send_tag = parallel.get_rank() * (parallel.\
-                            get_num_procs() + 1) + dest
-                        recv_tag = source*(parallel.get_num_procs() + 1) +\
-                            parallel.get_rank()
-
-                        # Collect data and send/receive
-                        col_vecs_send = (col_vecs, col_indices)
-                        request = parallel.comm.isend(col_vecs_send, dest=\
-                            dest, tag=send_tag)
-                        col_vecs_recv = parallel.comm.recv(source=source,
-                            tag=recv_tag)
-                        request.Wait()
-                        parallel.barrier()
-                        col_indices = col_vecs_recv[1]
-                        col_vecs = col_vecs_recv[0]
+                # Pass the col vecs to proc with rank -> mod(rank+1,numProcs)
+                # Must do this for each processor, until data makes a circle.
+                # The col vecs for the next pass are received while the IPs
+                # for this pass are computed.
+                for col_vecs, col_indices in self._circulate_vecs(
+                    col_vecs, col_indices):
+                    self._record_bytes_in_mem(
+                        [col_vecs] * min(parallel.get_num_procs(), 2),
+                        num_bytes=row_nbytes, prefetcher=prefetcher)
 
                     # Compute the IPs for this set of data col_indices stores
                     # the indices of the IP_mat columns to be
                     # filled in.
                     if len(proc_row_tasks) > 0:
-                        for row_index in range(proc_row_tasks[0],
-                            proc_row_tasks[-1]+1):
-                            for col_vec_index, col_vec in enumerate(col_vecs):
-                                IP_mat[row_index, col_indices[
-                                    col_vec_index]] = self.inner_product(
-                                    row_vecs[row_index - proc_row_tasks[0]],
-                                    col_vec)
+                        if len(col_vecs) > 0:
+                            self._add_IP_tile(IP_mat, checkpoint,
+                                gram_cache, proc_row_tasks[0], col_indices[0],
+                                row_vecs, col_vecs)
                         if (
                             (time() - self.prev_print_time) >
                             self.print_interval):
-                            num_completed_IPs = (np.abs(IP_mat)>0).sum()
+                            num_completed_IPs = IP_mat.num_local_elements
                             percent_completed_IPs = (100.*2*num_completed_IPs *
                                 parallel.get_num_MPI_workers())/(num_vecs**2)
                             self.print_msg(('Completed %.1f%% of inner ' +
@@ -735,34 +2597,12 @@ class VectorSpaceHandles(object):
             # Finished row_vecs loop, delete memory used
             del row_vecs
 
-        # Assign the triangular portion chunks into IP_mat.
-        if parallel.is_distributed():
-            IP_mat = parallel.custom_comm.allreduce(IP_mat)
-
-        # Create a mask for the repeated values.  Select values that are zero
-        # in the upper triangular portion (not computed there) but nonzero in
-        # the lower triangular portion (computed there).  For the case where
-        # the inner product is not perfectly symmetric, this will select the
-        # computation done in the upper triangular portion.
-        mask = np.multiply(IP_mat == 0, IP_mat.T != 0)
-
-        # Collect values below diagonal
-        IP_mat += np.multiply(np.triu(IP_mat.T, 1), mask)
-
-        # Symmetrize matrix
-        IP_mat = np.triu(IP_mat) + np.triu(IP_mat, 1).T
-
-        percent_completed_IPs = 100.
-        self.print_msg(('Completed %.1f%% of inner ' +
-            'products')%percent_completed_IPs, sys.stderr)
-        self.prev_print_time = time()
-
-        parallel.barrier()
-        return IP_mat
+        return self._finish_IP_mat(
+            IP_mat, assembly, prefetcher, node_cache, checkpoint)
 
 
     def lin_combine(self, sum_vec_handles, basis_vec_handles, coeff_mat,
-        coeff_mat_col_indices=None):
+        coeff_mat_col_indices=None, resume=False):
         """Computes linear combination(s) of basis vector objects and calls
         ``put`` on result(s), using handles.
 
@@ -782,6 +2622,12 @@ class VectorSpaceHandles(object):
             ``sum_vecs`` corresponding to these columns of the coefficient
             matrix are computed.
 
+            ``resume``: If True, sums that were already put, e.g., by a run
+            that was killed, are not computed again.  They are found with the
+            ``exists`` method of the sum vector handles (see
+            :py:func:`vectors.find_existing_vec_handles`), and the work is
+            divided over only the remaining sums.  Default is False.
+
         Each MPI worker (processor) retrieves a subset of the basis vectors to
         compute as many outputs as an MPI worker (processor) can have in memory
         at once. Each MPI worker (processor) computes the "layers" from the
@@ -789,6 +2635,16 @@ class VectorSpaceHandles(object):
         memory. The layers from all MPI workers (processors) are summed
         together to form the ``sum_vecs`` and ``put`` is called on each.
 
+        When the basis vectors are NumPy arrays of the same shape, the layers
+        of each chunk of bases are computed with matrix multiplications,
+        which is much faster than scaling and adding one basis vector at a
+        time.  Other vector objects only need to support ``*`` and ``+=``,
+        and are added in place with ``axpy`` if they define it (see
+        :py:func:`vectors.axpy`).  Either way, each sum takes the memory of
+        one vector.  If the sum vector handles do not keep the vectors they
+        put (``put_keeps_vec`` is False, e.g., for files), the arrays of
+        sums that have been put are reused for later sums.
+
         Scaling is:
 
           num gets/worker = :math:`n_s/(n_p*(max-2)) * n_b/n_p`
@@ -815,43 +2671,92 @@ class VectorSpaceHandles(object):
             raise ValueError(('Number of coeff_mat cols (%d) does not equal '
                 'number of output handles (%d)')%(coeff_mat.shape[1],num_sums))
 
-        # Estimate time it will take
-        # Burn the first one for slow imports
-        test_vec_burn = basis_vec_handles[0].get()
-        test_vec_burn_3 = test_vec_burn + 2.*test_vec_burn
-        del test_vec_burn, test_vec_burn_3
-        start_time = time()
-        test_vec = basis_vec_handles[0].get()
-        get_time = time() - start_time
-        start_time = time()
-        test_vec_3 = test_vec + 2.*test_vec
-        add_scale_time = time() - start_time
-        del test_vec, test_vec_3
-
-        vecs_per_worker = self.max_vecs_per_node * parallel.get_num_nodes() / \
-            parallel.get_num_MPI_workers()
-        num_gets = num_sums/(parallel.get_num_MPI_workers()*(\
-            vecs_per_worker-2)) + \
-            num_bases/parallel.get_num_MPI_workers()
-        num_add_scales = num_sums*num_bases/parallel.get_num_MPI_workers()
-        self.print_msg('Linear combinations will take at least %.1f minutes'%
-            (num_gets*get_time/60. + num_add_scales*add_scale_time/60.))
+        # Only compute the sums that have not been put yet.  These are found
+        # on rank zero only, to avoid many processors/MPI workers checking the
+        # same files.
+        if resume:
+            sum_indices = [sum_index for sum_index, exists in enumerate(
+                parallel.call_and_bcast(
+                V.find_existing_vec_handles, sum_vec_handles))
+                if not exists]
+            if len(sum_indices) < num_sums:
+                self.print_msg('Skipping %d sums that were already put'%(
+                    num_sums - len(sum_indices)))
+            sum_vec_handles = [
+                sum_vec_handles[sum_index] for sum_index in sum_indices]
+            coeff_mat = coeff_mat[:, sum_indices]
+            num_sums = len(sum_vec_handles)
+            if num_sums == 0:
+                return
+        self._set_max_vecs_from_bytes(basis_vec_handles[0])
+
+        # Predict the time it will take, and choose the schedule, as in
+        # compute_inner_product_mat.
+        self._find_cost_model(basis_vec_handles[0])
+        plan = self.plan('lin_combine', num_bases, num_sums)
+        self.print_msg('Linear combinations will take about %.1f minutes'%
+            (plan['time'] / 60.))
+
+        # Retrieve vecs through the node cache, if there is one
+        node_cache = self._make_node_cache()
+        basis_vec_handles = self._wrap_vec_handles(
+            node_cache, basis_vec_handles, 'basis')
+        sum_vec_handles = self._wrap_vec_handles(None, sum_vec_handles, 'sum')
 
         # convenience
         rank = parallel.get_rank()
 
-        # num_bases_per_proc_chunk is the num of bases each proc gets at once.
-        num_bases_per_proc_chunk = 1
-        num_sums_per_proc_chunk = self.max_vecs_per_proc - \
-            num_bases_per_proc_chunk
-
-        basis_tasks = parallel.find_assignments(list(range(num_bases)))
+        basis_tasks = parallel.find_assignments(list(range(num_bases)),
+            task_weights=self._find_task_weights(basis_vec_handles))
         sum_tasks = parallel.find_assignments(list(range(num_sums)))
 
         # Find max number tasks among all processors
         max_num_basis_tasks = max([len(tasks) for tasks in basis_tasks])
         max_num_sum_tasks = max([len(tasks) for tasks in sum_tasks])
 
+        # num_sums_per_proc_chunk and num_bases_per_proc_chunk are the numbers
+        # of sums and bases each proc holds at once.  The sum chunk is as
+        # small as possible without increasing the number of times the bases
+        # are retrieved, and the rest of the memory goes to the basis chunks.
+        # When prefetching, the next chunk of bases is in memory too, as is
+        # the chunk being received from the neighbouring proc.  With
+        # write-behind, the previous chunk of sums is being put while the
+        # next one is computed, so there are two chunks of sums in memory.
+        prefetcher = self._make_prefetcher(1)
+        num_put_threads = self._find_num_put_threads(self.max_vecs_per_proc -
+            self._find_num_inner_chunks_in_mem(prefetcher))
+        if num_put_threads > 0:
+            num_sum_chunks_in_mem = 2
+        else:
+            num_sum_chunks_in_mem = 1
+        num_sums_per_proc_chunk, num_bases_per_proc_chunk = _find_chunk_sizes(
+            max_num_sum_tasks, max_num_basis_tasks, self.max_vecs_per_proc,
+            num_outer_chunks_in_mem=num_sum_chunks_in_mem,
+            num_inner_chunks_in_mem=self._find_num_inner_chunks_in_mem(
+            prefetcher))
+        if plan['schedule'] == 'dynamic':
+            # Each proc retrieves all of the bases itself, so the sums are
+            # the outer chunk and the bases the inner chunk.
+            num_sums_per_chunk, num_bases_per_chunk = _find_chunk_sizes(
+                max_num_sum_tasks, num_bases, self.max_vecs_per_proc,
+                num_outer_chunks_in_mem=num_sum_chunks_in_mem,
+                num_inner_chunks_in_mem=prefetcher.num_chunks_in_mem)
+            writer = _VecWriter(num_put_threads,
+                max_num_pending=num_sums_per_chunk)
+            self._compute_sums_dynamic(sum_vec_handles, basis_vec_handles,
+                coeff_mat, num_sums_per_chunk, num_bases_per_chunk,
+                prefetcher, writer,
+                _make_sum_buffer_pool(sum_vec_handles, writer))
+            self._finish_lin_combine(prefetcher, writer, node_cache)
+            return
+
+        writer = _VecWriter(num_put_threads,
+            max_num_pending=num_sums_per_proc_chunk)
+
+        # The memory of sums that have been put is reused for later sums, if
+        # the sum handles don't keep them (e.g., files).
+        buffer_pool = _make_sum_buffer_pool(sum_vec_handles, writer)
+
         # These variables are the number of iters through loops that retrieve
         # ("get")
         # and "put" basis and sum vecs.
@@ -882,95 +2787,392 @@ class VectorSpaceHandles(object):
                 sum_layers = []
 
             for basis_get_index in range(num_basis_get_iters):
-                if len(basis_tasks[rank]) > 0:
-                    start_basis_index = min(basis_tasks[rank][0] +
-                        basis_get_index*num_bases_per_proc_chunk,
-                        basis_tasks[rank][-1]+1)
-                    end_basis_index = min(start_basis_index +
-                        num_bases_per_proc_chunk, basis_tasks[rank][-1]+1)
-                    basis_indices = list(
-                        range(start_basis_index, end_basis_index))
+                start_basis_index, end_basis_index = _find_chunk_indices(
+                    basis_tasks[rank], basis_get_index,
+                    num_bases_per_proc_chunk)
+                basis_indices = list(range(start_basis_index, end_basis_index))
+
+                # Start retrieving the next chunk of bases, which is the first
+                # chunk again once the next chunk of sums is started.
+                if basis_get_index < num_basis_get_iters - 1:
+                    next_start_basis_index, next_end_basis_index = \
+                        _find_chunk_indices(basis_tasks[rank],
+                        basis_get_index + 1, num_bases_per_proc_chunk)
+                elif sum_put_index < num_sum_put_iters - 1:
+                    next_start_basis_index, next_end_basis_index = \
+                        _find_chunk_indices(basis_tasks[rank], 0,
+                        num_bases_per_proc_chunk)
                 else:
-                    basis_indices = []
+                    next_start_basis_index, next_end_basis_index = 0, 0
+
+                basis_vecs = prefetcher.get(
+                    (start_basis_index, end_basis_index),
+                    basis_vec_handles[start_basis_index:end_basis_index])
+                prefetcher.prefetch(
+                    (next_start_basis_index, next_end_basis_index),
+                    basis_vec_handles[
+                    next_start_basis_index:next_end_basis_index])
 
                 # Pass the basis vecs to proc with rank -> mod(rank+1,num_procs)
-                # Must do this for each processor, until data makes a circle
-                basis_vecs_recv = (None, None)
-                for pass_index in range(parallel.get_num_procs()):
-                    # If on the first pass, retrieve the basis vecs,
-                    # no send/recv.
-                    # This is all that is called when in serial,
-                    # loop iterates once.
-                    if pass_index == 0:
-                        if len(basis_indices) > 0:
-                            basis_vecs = [basis_handle.get() \
-                                for basis_handle in basis_vec_handles[
-                                    basis_indices[0]:basis_indices[-1]+1]]
-                        else:
-                            basis_vecs = []
-                    else:
-                        # Figure out with whom to communicate
-                        source = (parallel.get_rank()-1) % \
-                            parallel.get_num_procs()
-                        dest = (parallel.get_rank()+1) % \
-                            parallel.get_num_procs()
-
-                        #Create unique tags based on ranks
-                        send_tag = parallel.get_rank() * \
-                            (parallel.get_num_procs()+1) + dest
-                        recv_tag = source*(parallel.get_num_procs()+1) + \
-                            parallel.get_rank()
-
-                        # Send/receive data
-                        basis_vecs_send = (basis_vecs, basis_indices)
-                        request = parallel.comm.isend(basis_vecs_send,
-                            dest=dest, tag=send_tag)
-                        basis_vecs_recv = parallel.comm.recv(
-                            source=source, tag=recv_tag)
-                        request.Wait()
-                        parallel.barrier()
-                        basis_indices = basis_vecs_recv[1]
-                        basis_vecs = basis_vecs_recv[0]
+                # Must do this for each processor, until data makes a circle.
+                # The basis vecs for the next pass are received while the
+                # sums for this pass are computed.
+                for basis_vecs, basis_indices in self._circulate_vecs(
+                    basis_vecs, basis_indices):
+                    self._record_bytes_in_mem(
+                        [sum_layers] + [basis_vecs] * min(
+                        parallel.get_num_procs(), 2),
+                        prefetcher=prefetcher, writer=writer)
 
                     # Compute the scalar multiplications for this set of data.
                     # basis_indices stores the indices of the coeff_mat to
                     # use.
-                    for sum_index in range(start_sum_index, end_sum_index):
-                        for basis_index, basis_vec in enumerate(basis_vecs):
-                            sum_layer = basis_vec * \
-                                coeff_mat[basis_indices[basis_index],\
-                                sum_index]
-                            if sum_layers[sum_index-start_sum_index] is None:
-                                sum_layers[sum_index-start_sum_index] = \
-                                    sum_layer
-                            else:
-                                sum_layers[sum_index-start_sum_index] += \
-                                    sum_layer
-                        if (
-                            (time() - self.prev_print_time) >
-                            self.print_interval):
-                            self.print_msg(
-                                'Completed %.1f%% of linear combinations' %
-                                (sum_index*100./len(sum_tasks[rank])))
-                            self.prev_print_time = time()
-
-            # Completed this set of sum vecs, puts them to memory or file
+                    start_time = time()
+                    _add_sum_layers(sum_layers, basis_vecs,
+                        np.asarray(coeff_mat)[basis_indices,
+                        start_sum_index:end_sum_index],
+                        buffer_pool=buffer_pool)
+                    if len(sum_tasks[rank]) > 0 and (
+                        (time() - self.prev_print_time) >
+                        self.print_interval):
+                        self.print_msg(
+                            'Completed %.1f%% of linear combinations' %
+                            ((end_sum_index - sum_tasks[rank][0]) * 100. /
+                            len(sum_tasks[rank])))
+                        self.prev_print_time = time()
+                    self._record_event('sum', start_time)
+                    self._record_bytes_in_mem([sum_layers] + [basis_vecs] *
+                        min(parallel.get_num_procs(), 2),
+                        prefetcher=prefetcher, writer=writer)
+
+            # Completed this set of sum vecs, puts them to memory or file.
+            # With write-behind, the next set is computed while they are put.
             for sum_index in range(start_sum_index, end_sum_index):
-                sum_vec_handles[sum_index].put(
+                writer.put(sum_vec_handles[sum_index],
                     sum_layers[sum_index-start_sum_index])
+            if buffer_pool is not None:
+                buffer_pool.add(sum_layers)
             del sum_layers
 
-        self.print_msg('Completed %.1f%% of linear combinations' % 100.)
-        self.prev_print_time = time()
-        parallel.barrier()
+        self._finish_lin_combine(prefetcher, writer, node_cache)
+
+
+    def lin_combine_multiple(self, sum_vec_handles_list,
+        basis_vec_handles_list, coeff_mat_list,
+        coeff_mat_col_indices_list=None, resume=False):
+        """Computes several sets of linear combinations, each of its own basis
+        vector objects, and calls ``put`` on the results, using handles.
+
+        Args:
+            ``sum_vec_handles_list``: List of lists of handles for the sum
+            vector objects, one list per set.
+
+            ``basis_vec_handles_list``: List of lists of handles for the basis
+            vector objects, one list per set.
+
+            ``coeff_mat_list``: List of coefficient matrices, one per set.  See
+            :py:meth:`lin_combine`.
+
+        Kwargs:
+            ``coeff_mat_col_indices_list``: List of lists of column indices,
+            one per set, or None.  Only the sums corresponding to these
+            columns of each coefficient matrix are computed.  A list may also
+            be None to compute all of the sums of its set.
+
+            ``resume``: If True, sums that were already put are not computed
+            again.  See :py:meth:`lin_combine`.
+
+        All of the sums are computed by one call to :py:meth:`lin_combine`,
+        whose basis is the union of the bases of the sets.  Basis handles
+        that are the same object, e.g., ``vec_handles[:-1]`` and
+        ``vec_handles[1:]`` of the same list, are retrieved once for all of
+        the sets that use them.  For example, the exact and projected DMD
+        modes, or the modes of several decompositions of the same vectors,
+        can be computed for the cost of retrieving the vectors once (when
+        the sums fit in memory), rather than once per set.  Coefficients of
+        basis vectors that a set does not use are zero, which costs scalar
+        multiplications, but no retrieval.
+        """
+        num_sets = len(coeff_mat_list)
+        if coeff_mat_col_indices_list is None:
+            coeff_mat_col_indices_list = [None] * num_sets
+        if (len(sum_vec_handles_list) != num_sets or
+            len(basis_vec_handles_list) != num_sets or
+            len(coeff_mat_col_indices_list) != num_sets):
+            raise ValueError(('Lists of sum handles, basis handles, '
+                'coeff_mat, and coeff_mat_col_indices have different lengths'))
+
+        # Find the union of the bases, keeping the order in which handles
+        # first appear, and the index of each set's basis in the union.
+        basis_vec_handles = []
+        union_indices = {}
+        set_basis_indices = []
+        for set_basis_vec_handles in basis_vec_handles_list:
+            basis_indices = []
+            for vec_handle in util.make_iterable(set_basis_vec_handles):
+                if id(vec_handle) not in union_indices:
+                    union_indices[id(vec_handle)] = len(basis_vec_handles)
+                    basis_vec_handles.append(vec_handle)
+                basis_indices.append(union_indices[id(vec_handle)])
+            set_basis_indices.append(basis_indices)
+
+        # Put each set's coefficients in the rows of its bases and in its own
+        # columns of one coefficient matrix.
+        set_coeff_mats = []
+        sum_vec_handles = []
+        for set_index, coeff_mat in enumerate(coeff_mat_list):
+            coeff_mat = np.asarray(coeff_mat)
+            if coeff_mat_col_indices_list[set_index] is not None:
+                coeff_mat = coeff_mat[:,
+                    coeff_mat_col_indices_list[set_index]]
+            set_sum_vec_handles = util.make_iterable(
+                sum_vec_handles_list[set_index])
+            num_bases = len(set_basis_indices[set_index])
+            num_sums = len(set_sum_vec_handles)
+            if num_bases != coeff_mat.shape[0]:
+                raise ValueError(('Number of coeff_mat rows (%d) does not '
+                    'equal number of basis handles (%d) in set %d'%(
+                    coeff_mat.shape[0], num_bases, set_index)))
+            if num_sums != coeff_mat.shape[1]:
+                raise ValueError(('Number of coeff_mat cols (%d) does not '
+                    'equal number of output handles (%d) in set %d'%(
+                    coeff_mat.shape[1], num_sums, set_index)))
+            set_coeff_mats.append(coeff_mat)
+            sum_vec_handles.extend(set_sum_vec_handles)
+        combined_coeff_mat = np.zeros(
+            (len(basis_vec_handles), len(sum_vec_handles)),
+            dtype=np.result_type(*set_coeff_mats))
+        start_sum_index = 0
+        for basis_indices, coeff_mat in zip(set_basis_indices, set_coeff_mats):
+            end_sum_index = start_sum_index + coeff_mat.shape[1]
+            # A set's basis may repeat a handle, so add rather than assign.
+            np.add.at(combined_coeff_mat,
+                (basis_indices, slice(start_sum_index, end_sum_index)),
+                coeff_mat)
+            start_sum_index = end_sum_index
+
+        self.lin_combine(sum_vec_handles, basis_vec_handles,
+            combined_coeff_mat, resume=resume)
 
 
     def __eq__(self, other):
         if type(self) != type(other):
             return False
         return (self.inner_product == other.inner_product and
+            self.inner_product_block == other.inner_product_block and
             self.verbosity == other.verbosity)
 
 
     def __ne__(self, other):
         return not self.__eq__(other)
+
+
+class ModeCache(object):
+    """Keeps the modes computed by :py:class:`ModeHandle` objects, under a
+    memory budget.
+
+    Kwargs:
+        ``max_bytes``: Maximum number of bytes of modes kept.  When adding a
+        mode would exceed it, the modes retrieved least recently are dropped,
+        and are computed again if they are retrieved again.  Default is
+        ``'auto'``, for which this processor's share of a quarter of the
+        memory available on the node (see :py:func:`util.get_available_memory`)
+        is used.  If the available memory cannot be determined, at most 10
+        modes are kept instead.  None means no limit.
+
+        ``max_modes``: Maximum number of modes kept, dropped in the same way.
+        Default is None (no limit, other than ``max_bytes``).
+
+    One cache can be shared by the handles of many modes.  ``num_bytes`` is
+    the number of bytes of modes kept.
+
+    The same mode is returned each time it is retrieved from the cache, so
+    modes that are arrays are made read-only when they are kept; copy a mode
+    before modifying it.  Other mode objects are copied when they are kept
+    and when they are retrieved.
+    """
+    def __init__(self, max_bytes='auto', max_modes=None):
+        if max_bytes == 'auto':
+            available_bytes = util.get_available_memory()
+            if available_bytes is None:
+                max_bytes = None
+                if max_modes is None:
+                    max_modes = _num_modes_cached_if_memory_unknown
+            else:
+                max_bytes = int(_mode_cache_memory_fraction * available_bytes /
+                    parallel.get_max_num_procs_per_node())
+        self.max_bytes = max_bytes
+        self.max_modes = max_modes
+        self.num_bytes = 0
+        self._modes = collections.OrderedDict()
+        # Modes may be retrieved from several threads (see the
+        # ``num_get_threads`` option of ``VectorSpaceHandles``).
+        self._lock = threading.Lock()
+
+
+    def get(self, mode_handle):
+        """Returns the mode of ``mode_handle``, or None if it is not kept."""
+        with self._lock:
+            if mode_handle not in self._modes:
+                return None
+            # Move the mode to the end, as the most recently retrieved.
+            mode, num_bytes = self._modes.pop(mode_handle)
+            self._modes[mode_handle] = (mode, num_bytes)
+        if isinstance(mode, np.ndarray):
+            return mode
+        return copy.deepcopy(mode)
+
+
+    def add(self, mode_handle, mode):
+        """Keeps ``mode`` as the mode of ``mode_handle``, if it fits."""
+        num_bytes = util.get_nbytes(mode)
+        if self.max_bytes is not None and num_bytes > self.max_bytes:
+            return
+        if self.max_modes is not None and self.max_modes < 1:
+            return
+        if isinstance(mode, np.ndarray):
+            mode.setflags(write=False)
+        else:
+            mode = copy.deepcopy(mode)
+        with self._lock:
+            if mode_handle in self._modes:
+                self.num_bytes -= self._modes.pop(mode_handle)[1]
+            while ((self.max_bytes is not None and
+                self.num_bytes + num_bytes > self.max_bytes) or
+                (self.max_modes is not None and
+                len(self._modes) >= self.max_modes)):
+                self.num_bytes -= self._modes.popitem(last=False)[1][1]
+            self._modes[mode_handle] = (mode, num_bytes)
+            self.num_bytes += num_bytes
+
+
+    def clear(self):
+        """Drops all of the modes."""
+        with self._lock:
+            self._modes.clear()
+            self.num_bytes = 0
+
+
+_default_mode_cache = None
+
+def _find_default_mode_cache():
+    """Returns the :py:class:`ModeCache` used by :py:func:`make_mode_handles`
+    when none is given, creating it the first time."""
+    global _default_mode_cache
+    if _default_mode_cache is None:
+        _default_mode_cache = ModeCache()
+    return _default_mode_cache
+
+
+class ModeHandle(V.VecHandle):
+    """Handle for a mode, a linear combination of basis vector objects, that
+    is only computed when it is retrieved.
+
+    Args:
+        ``basis_vec_handles``: List of handles for the basis vector objects.
+
+        ``coeffs``: 1D array of the coefficients of the basis vector objects,
+        e.g., a column of the ``coeff_mat`` of
+        :py:meth:`VectorSpaceHandles.lin_combine`.
+
+    Kwargs:
+        ``mode_cache``: :py:class:`ModeCache` in which the mode is kept once
+        it is computed.  Default is None (the mode is computed each time it
+        is retrieved).
+
+        ``num_basis_vecs_per_chunk``: Number of basis vector objects
+        retrieved, and held in memory, at once while computing the mode.
+
+        ``base_vec_handle``, ``scale``: See :py:class:`vectors.VecHandle`.
+
+    The mode is computed by this processor/MPI worker alone, retrieving the
+    basis vector objects a chunk at a time and adding them as
+    :py:meth:`VectorSpaceHandles.lin_combine` does.  It can therefore be
+    retrieved by any processor/MPI worker at any time, e.g., as a basis
+    vector of :py:class:`ltigalerkinproj.LTIGalerkinProjectionHandles`, and
+    no mode that is not retrieved is computed.  Modes cannot be put.
+    """
+    def __init__(self, basis_vec_handles, coeffs, mode_cache=None,
+        num_basis_vecs_per_chunk=_num_mode_basis_vecs_per_chunk,
+        base_vec_handle=None, scale=None):
+        V.VecHandle.__init__(self, base_vec_handle, scale)
+        self.basis_vec_handles = util.make_iterable(basis_vec_handles)
+        self.coeffs = np.asarray(coeffs).reshape(-1)
+        if len(self.basis_vec_handles) != self.coeffs.size:
+            raise ValueError(('Number of coeffs (%d) does not equal number of '
+                'basis handles (%d)')%(
+                self.coeffs.size, len(self.basis_vec_handles)))
+        self.mode_cache = mode_cache
+        self.num_basis_vecs_per_chunk = num_basis_vecs_per_chunk
+
+
+    def _get(self):
+        if self.mode_cache is not None:
+            mode = self.mode_cache.get(self)
+            if mode is not None:
+                return mode
+        mode = [None]
+        for start_index in range(
+            0, len(self.basis_vec_handles), self.num_basis_vecs_per_chunk):
+            end_index = min(len(self.basis_vec_handles),
+                start_index + self.num_basis_vecs_per_chunk)
+            basis_vecs = [basis_vec_handle.get() for basis_vec_handle in
+                self.basis_vec_handles[start_index:end_index]]
+            _add_sum_layers(mode, basis_vecs,
+                self.coeffs[start_index:end_index, np.newaxis])
+            del basis_vecs
+        if self.mode_cache is not None:
+            self.mode_cache.add(self, mode[0])
+        return mode[0]
+
+
+    def get_cost(self):
+        """Returns the total cost of retrieving the basis vector objects (see
+        :py:func:`vectors.find_vec_handle_costs`), or None if unknown."""
+        costs = V.find_vec_handle_costs(self.basis_vec_handles)
+        if costs is None:
+            return None
+        return sum(costs)
+
+
+    def exists(self):
+        """Returns True, since the mode can always be computed."""
+        return True
+
+
+def make_mode_handles(basis_vec_handles, coeff_mat,
+    coeff_mat_col_indices=None, mode_cache=None,
+    num_basis_vecs_per_chunk=_num_mode_basis_vecs_per_chunk):
+    """Returns handles for modes that are linear combinations of basis vector
+    objects, which are only computed when they are retrieved.
+
+    Args:
+        ``basis_vec_handles``: List of handles for the basis vector objects.
+
+        ``coeff_mat``: Matrix whose rows correspond to basis vectors and whose
+        columns correspond to modes, as for
+        :py:meth:`VectorSpaceHandles.lin_combine`.
+
+    Kwargs:
+        ``coeff_mat_col_indices``: List of column indices.  Only handles for
+        the modes corresponding to these columns are returned.
+
+        ``mode_cache``: :py:class:`ModeCache` shared by the handles.  Default
+        is None, for which a single cache with the default memory limit of
+        :py:class:`ModeCache` is shared by all of the calls that use the
+        default, so that together they stay within that limit.
+
+        ``num_basis_vecs_per_chunk``: See :py:class:`ModeHandle`.
+
+    Returns:
+        ``mode_handles``: List of :py:class:`ModeHandle` objects.
+    """
+    coeff_mat = np.asarray(coeff_mat)
+    if coeff_mat_col_indices is None:
+        coeff_mat_col_indices = range(coeff_mat.shape[1])
+    if mode_cache is None:
+        mode_cache = _find_default_mode_cache()
+    return [ModeHandle(basis_vec_handles, coeff_mat[:, col_index],
+        mode_cache=mode_cache,
+        num_basis_vecs_per_chunk=num_basis_vecs_per_chunk)
+        for col_index in coeff_mat_col_indices]